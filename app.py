@@ -1,253 +1,665 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Blueprint, Flask, Response, jsonify, render_template, request
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
 from datetime import datetime, timedelta
 import logging
 import os
 from dotenv import load_dotenv
+from broadcast import ChangeBroadcaster
+from cache import LRUBackend, MongoBackend, ResponseCache
+from changes import ChangeTracker
+from export import EXPORT_FIELDS, EXPORT_FORMATS, stream_documents
+from fanout import FanOut
+from health import HealthMonitor
+from hotwindow import HotWindow
+from indexes import ensure_indexes, require_indexes
+from instrumentation import CommandMetrics, init_metrics
+from ingest import derive_notification, insert_batch, parse_batch, validate_batch, validate_metric, validate_notification
+from logconfig import configure_logging
+from mongo import Mongo, PoolStats, pool_options
+from queries import (PAGE_SORT, build_metrics_query, build_notifications_query, build_page, page_find_args,
+                     parse_dashboard_args, parse_date_param, parse_list_args, parse_percentiles, parse_summary_days,
+                     summary_body)
+from rollups import RollupCheck, sketch_bins, summarize, update_rollups
+from series import fetch_series, parse_points
+from sketches import merge_sketches, percentiles_body
+from slowlog import SlowQueryLog
+from singleflight import SingleFlight, SingleFlightTimeout
+from totals import CountCache, count_total
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("app.log"), logging.StreamHandler()]
-)
+# Configure logging: records are written by a background thread (see logconfig.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# Routes of the dashboard and its API, registered on the app by create_app
+api = Blueprint('api', __name__)
 
-# MongoDB client setup with connection string from environment variables
+# MongoDB connection string from environment variables. Each process connects
+# on first use, so importing this module does no I/O (see mongo.py).
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DB_NAME", "monitoring_app")
 
-try:
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    # Test connection
-    client.admin.command('ping')
-    logger.info("Successfully connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
-    raise
+# Connection pool settings (MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+# MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_COMPRESSORS) and
+# the listener counting checkouts and waits for /api/pool/stats
+MONGO_POOL_OPTIONS = pool_options()
+pool_stats = PoolStats()
+event_listeners = [pool_stats]
+
+# Prometheus exposition on /metrics, with MongoDB command latencies collected
+# by a command listener (see instrumentation.py)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == 'true'
+if METRICS_ENABLED:
+    command_metrics = CommandMetrics()
+    event_listeners.append(command_metrics)
+
+# Log MongoDB operations slower than SLOW_QUERY_MS (0 disables) with their
+# redacted shape, and explain a sample of them in the background
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", 100))
+if SLOW_QUERY_MS > 0:
+    slow_queries = SlowQueryLog(
+        threshold_ms=SLOW_QUERY_MS,
+        explain_rate=float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 0.1)),
+        explain_interval=int(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 60))
+    )
+    event_listeners.append(slow_queries)
+
+mongo = Mongo(MONGO_URI, DB_NAME, event_listeners=event_listeners, **MONGO_POOL_OPTIONS)
+if SLOW_QUERY_MS > 0:
+    slow_queries.mongo = mongo
+
+# Create the indexes the API query shapes rely on; with REQUIRE_INDEXES set,
+# refuse to start instead of serving every query as a collection scan
+CREATE_INDEXES = os.getenv("CREATE_INDEXES", "True").lower() == 'true'
+REQUIRE_INDEXES = os.getenv("REQUIRE_INDEXES", "False").lower() == 'true'
+
+# Answer summaries from the hourly/daily rollup collections where possible,
+# while their bucket counts match the metrics collection (checked every
+# ROLLUP_CHECK_INTERVAL seconds; see rollups.RollupCheck)
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "True").lower() == 'true'
+rollup_check = RollupCheck(interval=int(os.getenv("ROLLUP_CHECK_INTERVAL", 300)))
+
+# Cached pagination totals per normalized filter; entries expire after
+# COUNT_CACHE_TTL seconds and are dropped when this process writes
+count_cache = CountCache(
+    ttl=int(os.getenv("COUNT_CACHE_TTL", 30)),
+    max_entries=int(os.getenv("COUNT_CACHE_SIZE", 1024))
+)
+
+# Response cache for the JSON read endpoints: "memory" keeps an LRU per worker,
+# "mongo" shares entries between workers through a collection, "none" disables it.
+# Entries are keyed by the change versions the request's validators are built
+# from (see ChangeTracker.key).
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory").lower()
+if RESPONSE_CACHE == 'memory':
+    cache_backend = LRUBackend(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 512)))
+elif RESPONSE_CACHE == 'mongo':
+    cache_backend = MongoBackend(mongo.collection('response_cache'))
+else:
+    cache_backend = None
+response_cache = ResponseCache(cache_backend, key_func=ChangeTracker.key)
+
+# Per-endpoint response cache TTLs in seconds (0 disables caching the endpoint)
+CACHE_TTL_METRICS = int(os.getenv("CACHE_TTL_METRICS", 10))
+CACHE_TTL_NOTIFICATIONS = int(os.getenv("CACHE_TTL_NOTIFICATIONS", 10))
+CACHE_TTL_SUMMARY = int(os.getenv("CACHE_TTL_SUMMARY", 30))
+
+# Coalesce identical concurrent requests onto one in-flight MongoDB call;
+# followers give up after SINGLE_FLIGHT_TIMEOUT seconds (0 disables coalescing)
+single_flight = SingleFlight(timeout=float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 10)))
+
+# Number of documents per server-side cursor batch for streaming exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+
+# Batch ingestion limits and write concern (INGEST_W is a number or "majority")
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", 50000))
+INGEST_W = os.getenv("INGEST_W", "1")
+ingest_write_concern = WriteConcern(
+    w=int(INGEST_W) if INGEST_W.isdigit() else INGEST_W,
+    j=os.getenv("INGEST_J", "False").lower() == 'true'
+)
+
+# Health and readiness are answered from a per-process background check run
+# every HEALTH_REFRESH_INTERVAL seconds (ping, uptime, estimated counts)
+health_monitor = HealthMonitor(
+    mongo, ['metrics', 'notifications'],
+    interval=int(os.getenv("HEALTH_REFRESH_INTERVAL", 10))
+)
+# How long /api/health waits for the first check of a fresh process
+HEALTH_FIRST_CHECK_WAIT = 5
+
+# Change counters behind the ETag/Last-Modified validators of the JSON endpoints
+changes = ChangeTracker(mongo.collection('change_counters'))
+
+# Live updates on /api/stream: one change stream per process fanned out to at
+# most STREAM_MAX_CLIENTS clients, each holding a thread of the worker (raise it
+# with gevent workers), with STREAM_BUFFER_SIZE events buffered per client
+broadcaster = ChangeBroadcaster(
+    mongo, ['metrics', 'notifications'],
+    buffer_size=int(os.getenv("STREAM_BUFFER_SIZE", 256)),
+    max_clients=int(os.getenv("STREAM_MAX_CLIENTS", 4)),
+    poll_interval=float(os.getenv("STREAM_POLL_INTERVAL", 2)),
+    counters=changes.collection.name,
+    poll_lookback=int(os.getenv("STREAM_POLL_LOOKBACK", 60))
+)
+# Seconds between keepalive comments, which also detect disconnected clients
+STREAM_HEARTBEAT = int(os.getenv("STREAM_HEARTBEAT", 15))
+
+# Optional per-worker in-memory copy of the last HOT_WINDOW_DAYS days of
+# metrics (0 disables it; needs NumPy), at most HOT_WINDOW_MAX_MB per worker,
+# kept current from the change broadcaster and reloaded every
+# HOT_WINDOW_RELOAD seconds. Recent pages and summaries are answered from it.
+HOT_WINDOW_DAYS = float(os.getenv("HOT_WINDOW_DAYS", 0))
+hot_window = None
+if HOT_WINDOW_DAYS > 0:
+    if HotWindow.available():
+        hot_window = HotWindow(
+            mongo, broadcaster,
+            days=HOT_WINDOW_DAYS,
+            max_bytes=int(float(os.getenv("HOT_WINDOW_MAX_MB", 64)) * 1024 * 1024),
+            reload_interval=int(os.getenv("HOT_WINDOW_RELOAD", 3600)),
+            tracker=changes
+        )
+        broadcaster.add_listener(hot_window)
+    else:
+        logger.warning("HOT_WINDOW_DAYS is set but NumPy is not installed; metrics are served from MongoDB")
+
+# Bounded per-process thread pool running the independent queries of
+# /api/dashboard concurrently (DASHBOARD_PARALLELISM=1 runs them in turn)
+fanout = FanOut(max_workers=int(os.getenv("DASHBOARD_PARALLELISM", 8)))
+
+# Per-process startup work, run when the process first connects to MongoDB
+@mongo.on_connect
+def bootstrap(db):
+    missing_indexes = ensure_indexes(db, create=CREATE_INDEXES)
+    if missing_indexes and REQUIRE_INDEXES:
+        raise RuntimeError(f"Required indexes missing: {missing_indexes}")
+    if isinstance(cache_backend, MongoBackend):
+        cache_backend.ensure_indexes()
+    changes.init(['metrics', 'notifications'])
+    if USE_ROLLUPS:
+        rollup_check.check(db)
+
+# Record a write to a collection and forget cached counts and responses derived from it
+def invalidate_collection(collection_name):
+    changes.bump(collection_name)
+    count_cache.invalidate(collection_name)
+    response_cache.invalidate(collection_name)
+
+# Whether summaries and series can read the rollups right now
+def rollups_usable():
+    return USE_ROLLUPS and rollup_check.usable(mongo.db)
 
 # Route to render the main HTML page
-@app.route('/')
+@api.route('/')
 def index():
     return render_template('index.html')
 
-# Helper function to parse date parameters
-def parse_date_param(date_str):
-    if not date_str:
-        return None
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        return None
+# Helper function to fetch one page of a collection, either by page number
+# (skip/limit) or, in keyset mode, by resuming after the decoded cursor.
+# The total is computed according to count_mode (see totals.count_total).
+# Recent pages of metrics come from the hot window when it holds them.
+# version is the collection's change version read for the request; cached
+# totals and the hot window are only used when at least that recent.
+def fetch_page(collection, query, page, per_page, keyset=False, after=None, count_mode='approx', version=None):
+    find_query, skip, limit = page_find_args(query, page, per_page, keyset, after)
+    docs = total = None
+    if hot_window is not None and collection.name == 'metrics' and hot_window.caught_up(version):
+        docs = hot_window.find(find_query, skip, limit)
+        if docs is not None and count_mode != 'none':
+            total = hot_window.count(query)
+    if docs is None:
+        docs = list(collection.find(find_query).sort(PAGE_SORT).skip(skip).limit(limit))
+    if total is None:
+        total = count_total(collection, query, count_mode, count_cache, version)
+    return build_page(docs, total, page, per_page, keyset)
 
 # API route for metrics data with pagination and filtering
-@app.route('/api/metrics', methods=['GET'])
+@api.route('/api/metrics', methods=['GET'])
+@changes.conditional(['metrics'])
+@response_cache.cached('metrics', ttl=CACHE_TTL_METRICS, tags=['metrics'])
+@single_flight.coalesce(ChangeTracker.key)
 def get_metrics():
     try:
         # Get query parameters
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        start_date = parse_date_param(request.args.get('start_date'))
-        end_date = parse_date_param(request.args.get('end_date'))
-        keyword = request.args.get('keyword', '')
-        
-        # Build query
-        query = {}
-        if start_date or end_date:
-            query['timestamp'] = {}
-            if start_date:
-                query['timestamp']['$gte'] = start_date
-            if end_date:
-                # Include the entire end date
-                query['timestamp']['$lte'] = end_date + timedelta(days=1) - timedelta(seconds=1)
-        
-        if keyword:
-            query['activity'] = {'$regex': keyword, '$options': 'i'}
+        params, error = parse_list_args(request.args, build_metrics_query)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Get total count for pagination
-        total = db.metrics.count_documents(query)
-        
-        # Fetch paginated data
-        metrics = list(db.metrics.find(
-            query, 
-            {'_id': 0}
-        ).sort('timestamp', -1).skip((page - 1) * per_page).limit(per_page))
-        
-        # Format timestamps
-        for metric in metrics:
-            metric['timestamp'] = metric['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+        metrics, pagination = fetch_page(mongo.db.metrics, version=changes.current('metrics'), **params)
         
         return jsonify({
             'data': metrics,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         })
     except Exception as e:
         logger.error(f"Error fetching metrics: {e}")
         return jsonify({'error': 'Failed to fetch metrics'}), 500
 
 # API route for notifications data with pagination and filtering
-@app.route('/api/notifications', methods=['GET'])
+@api.route('/api/notifications', methods=['GET'])
+@changes.conditional(['notifications'])
+@response_cache.cached('notifications', ttl=CACHE_TTL_NOTIFICATIONS, tags=['notifications'])
+@single_flight.coalesce(ChangeTracker.key)
 def get_notifications():
     try:
         # Get query parameters
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        start_date = parse_date_param(request.args.get('start_date'))
-        end_date = parse_date_param(request.args.get('end_date'))
-        keyword = request.args.get('keyword', '')
-        
-        # Build query
-        query = {}
-        if start_date or end_date:
-            query['timestamp'] = {}
-            if start_date:
-                query['timestamp']['$gte'] = start_date
-            if end_date:
-                # Include the entire end date
-                query['timestamp']['$lte'] = end_date + timedelta(days=1) - timedelta(seconds=1)
+        params, error = parse_list_args(request.args, build_notifications_query)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if keyword:
-            query['$or'] = [
-                {'event_type': {'$regex': keyword, '$options': 'i'}},
-                {'description': {'$regex': keyword, '$options': 'i'}}
-            ]
-        
-        # Get total count for pagination
-        total = db.notifications.count_documents(query)
-        
-        # Fetch paginated data
-        notifications = list(db.notifications.find(
-            query, 
-            {'_id': 0}
-        ).sort('timestamp', -1).skip((page - 1) * per_page).limit(per_page))
-        
-        # Format timestamps
-        for notification in notifications:
-            notification['timestamp'] = notification['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+        notifications, pagination = fetch_page(mongo.db.notifications, version=changes.current('notifications'), **params)
         
         return jsonify({
             'data': notifications,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         })
     except Exception as e:
         logger.error(f"Error fetching notifications: {e}")
         return jsonify({'error': 'Failed to fetch notifications'}), 500
 
-# API for system health status
-@app.route('/api/health', methods=['GET'])
-def health_check():
+# Helper function to stream a filtered collection as NDJSON or CSV from a
+# server-side cursor, oldest documents first
+def export_collection(collection_name, build_query):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    query = build_query(
+        parse_date_param(request.args.get('start_date')),
+        parse_date_param(request.args.get('end_date')),
+        request.args.get('keyword', '')
+    )
+    cursor = mongo.db[collection_name].find(query, {'_id': 0}) \
+        .sort([('timestamp', 1), ('_id', 1)]) \
+        .batch_size(EXPORT_BATCH_SIZE)
+
+    def generate():
+        try:
+            yield from stream_documents(cursor, EXPORT_FIELDS[collection_name], fmt)
+        except Exception as e:
+            logger.error(f"Error exporting {collection_name}: {e}")
+            raise
+        finally:
+            cursor.close()
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{collection_name}.{extension}"'
+    })
+
+# API route streaming metrics with the same filters as /api/metrics
+@api.route('/api/metrics/export', methods=['GET'])
+def export_metrics():
+    return export_collection('metrics', build_metrics_query)
+
+# API route streaming notifications with the same filters as /api/notifications
+@api.route('/api/notifications/export', methods=['GET'])
+def export_notifications():
+    return export_collection('notifications', build_notifications_query)
+
+# Helper function to read and validate a batch ingestion request body.
+# Returns the parsed batch or raises ValueError with a client-facing message.
+def read_batch(validate):
+    items = parse_batch(request.get_data(), request.content_type)
+    if len(items) > INGEST_MAX_BATCH:
+        raise ValueError(f"Batch exceeds {INGEST_MAX_BATCH} documents")
+    docs, positions, errors = validate_batch(items, validate)
+    return len(items), docs, positions, errors
+
+# Helper function to build the ingestion response; 207 when some items failed
+def batch_response(received, inserted, errors, **extra):
+    errors.sort(key=lambda error: -1 if error['index'] is None else error['index'])
+    body = {'received': received, 'inserted': inserted, 'failed': len(errors), 'errors': errors}
+    body.update(extra)
+    return jsonify(body), 207 if errors else 201
+
+# Helper function to run a step that follows a successful insert. The
+# documents are stored by then, so a failure is logged instead of answered
+# with a 500, which the client would retry, duplicating them.
+def follow_up(description, fn, *args):
     try:
-        # Check MongoDB connection
-        client.admin.command('ping')
-        
-        # Get server stats
-        uptime = db.command('serverStatus')['uptime']
-        
-        # Get some application metrics
-        metrics_count = db.metrics.count_documents({})
-        notifications_count = db.notifications.count_documents({})
-        
-        return jsonify({
-            'status': 'healthy',
-            'database': 'connected',
-            'db_uptime_seconds': uptime,
-            'metrics_count': metrics_count,
-            'notifications_count': notifications_count,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        fn(*args)
+    except Exception as e:
+        logger.error(f"Error {description} after ingest: {e}")
+
+# API route for batch ingestion of metrics (JSON array or NDJSON). Suspicious
+# metrics also get their notification written in the same request.
+@api.route('/api/metrics/batch', methods=['POST'])
+def ingest_metrics():
+    try:
+        received, docs, positions, errors = read_batch(validate_metric)
+    except ValueError as e:
+        return jsonify({'error': f"Invalid batch: {e}"}), 400
+    try:
+        inserted, write_errors = insert_batch(
+            mongo.db.metrics.with_options(write_concern=ingest_write_concern), docs, positions)
+        errors += write_errors
+    except Exception as e:
+        logger.error(f"Error ingesting metrics: {e}")
+        return jsonify({'error': 'Failed to ingest metrics'}), 500
+
+    # Fold the metrics into the rollups and caches before writing their
+    # notifications, so a failed notification write cannot leave them out
+    if inserted:
+        follow_up("updating rollups", update_rollups, mongo.db, inserted)
+        if hot_window is not None:
+            hot_window.append(inserted)
+        follow_up("invalidating metrics", invalidate_collection, 'metrics')
+
+    # Notification write errors are reported at the position of their metric
+    suspicious = [doc for doc in inserted if doc['activity'] == 'Suspicious']
+    position_of = {id(doc): position for doc, position in zip(docs, positions)}
+    try:
+        notifications, notification_errors = insert_batch(
+            mongo.db.notifications.with_options(write_concern=ingest_write_concern),
+            [derive_notification(doc) for doc in suspicious],
+            [position_of[id(doc)] for doc in suspicious])
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error(f"Error writing notifications after ingest: {e}")
+        notifications = []
+        notification_errors = [{'index': position_of[id(doc)], 'error': 'Failed to write notification'}
+                               for doc in suspicious]
+    errors += [{'index': error['index'], 'error': f"notification: {error['error']}"}
+               for error in notification_errors]
+    if notifications:
+        follow_up("invalidating notifications", invalidate_collection, 'notifications')
+    return batch_response(received, len(inserted), errors, notifications_inserted=len(notifications))
+
+# API route for batch ingestion of notifications (JSON array or NDJSON)
+@api.route('/api/notifications/batch', methods=['POST'])
+def ingest_notifications():
+    try:
+        received, docs, positions, errors = read_batch(validate_notification)
+    except ValueError as e:
+        return jsonify({'error': f"Invalid batch: {e}"}), 400
+    try:
+        inserted, write_errors = insert_batch(
+            mongo.db.notifications.with_options(write_concern=ingest_write_concern), docs, positions)
+        errors += write_errors
+    except Exception as e:
+        logger.error(f"Error ingesting notifications: {e}")
+        return jsonify({'error': 'Failed to ingest notifications'}), 500
+
+    if inserted:
+        follow_up("invalidating notifications", invalidate_collection, 'notifications')
+    return batch_response(received, len(inserted), errors)
+
+# API route pushing new metrics and notifications as Server-Sent Events.
+# A "resync" event means events were dropped and the client should reload.
+@api.route('/api/stream', methods=['GET'])
+def stream_changes():
+    subscription = broadcaster.subscribe()
+    if subscription is None:
+        return jsonify({'error': 'Too many stream clients'}), 503, {'Retry-After': '30'}
+
+    def generate():
+        try:
+            # Browsers reconnect after this many milliseconds
+            yield 'retry: 5000\n\n'
+            while True:
+                events = subscription.take(STREAM_HEARTBEAT)
+                yield ''.join(events) if events else ': keepalive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep nginx from buffering the stream
+    })
+
+# API for the live update stream of this worker process
+@api.route('/api/stream/stats', methods=['GET'])
+def stream_stats():
+    return jsonify({
+        'pid': os.getpid(),
+        'mode': broadcaster.mode,
+        'clients': broadcaster.clients,
+        'max_clients': broadcaster.max_clients,
+        'buffer_size': broadcaster.buffer_size,
+        **broadcaster.stats
+    })
+
+# Liveness probe: the process is up and serving requests. No MongoDB access.
+@api.route('/livez', methods=['GET'])
+def livez():
+    return jsonify({'status': 'alive'})
+
+# Readiness probe from the last background ping; 503 when MongoDB did not answer
+# or no check has completed recently
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    snapshot = health_monitor.current()
+    if not health_monitor.ready(snapshot):
         return jsonify({
+            'status': 'not ready',
+            'error': snapshot.get('error', 'Health check is stale') if snapshot else 'Health check pending'
+        }), 503
+    return jsonify({
+        'status': 'ready',
+        'ping_ms': snapshot['ping_ms'],
+        'checked_at': health_monitor.format_time(snapshot)
+    })
+
+# Helper function to build the health body and status from a health snapshot
+def health_body(snapshot):
+    if not health_monitor.ready(snapshot):
+        return {
             'status': 'unhealthy',
-            'error': str(e),
+            'error': snapshot.get('error', 'Health check is stale') if snapshot else 'Health check pending',
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }), 500
+        }, 500
+    
+    return {
+        'status': 'healthy',
+        'database': 'connected',
+        'db_uptime_seconds': snapshot['db_uptime_seconds'],
+        'metrics_count': snapshot['counts']['metrics'],
+        'notifications_count': snapshot['counts']['notifications'],
+        'checked_at': health_monitor.format_time(snapshot),
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }, 200
+
+# API for system health status, served from the background health check
+@api.route('/api/health', methods=['GET'])
+def health_check():
+    body, status = health_body(health_monitor.current(wait=HEALTH_FIRST_CHECK_WAIT))
+    return jsonify(body), status
+
+# Helper function to summarize the last `days` days, with the requested
+# percentiles of connected users and uptime. version is as in fetch_page.
+def summary_for(days, percentiles=(), version=None):
+    # Calculate date range
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    
+    # Reduce the hot window when it holds the whole range, otherwise aggregate
+    # the range reading whole hours/days from the rollups
+    use_window = hot_window is not None and hot_window.caught_up(version)
+    summary = hot_window.summary(start_date, end_date) if use_window else None
+    if summary is None:
+        summary = summarize(mongo.db, start_date, end_date, use_rollups=rollups_usable())
+    if not percentiles:
+        return summary_body(days, start_date, end_date, summary)
+    
+    # Merge the percentile sketches of the same range
+    sketches = hot_window.sketches(start_date, end_date) if use_window else None
+    if sketches is None:
+        sketches = merge_sketches(sketch_bins(mongo.db, start_date, end_date, use_rollups=rollups_usable()))
+    return summary_body(days, start_date, end_date, summary, percentiles_body(sketches, percentiles))
 
 # API for metrics summary/analytics
-@app.route('/api/metrics/summary', methods=['GET'])
+@api.route('/api/metrics/summary', methods=['GET'])
+@changes.conditional(['metrics'], window=60)
+@response_cache.cached('summary', ttl=CACHE_TTL_SUMMARY, tags=['metrics'])
+@single_flight.coalesce(ChangeTracker.key)
 def metrics_summary():
     try:
         # Get time range parameters
-        days = int(request.args.get('days', 30))
-        if days <= 0 or days > 365:
-            days = 30  # Default to 30 days if invalid
-        
-        # Calculate date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Query metrics within date range
-        query = {'timestamp': {'$gte': start_date, '$lte': end_date}}
+        days = parse_summary_days(request.args)
+        percentiles, error = parse_percentiles(request.args)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Get all metrics in time range
-        metrics = list(db.metrics.find(query, {'_id': 0}))
+        return jsonify(summary_for(days, percentiles, version=changes.current('metrics')))
+    except Exception as e:
+        logger.error(f"Error generating metrics summary: {e}")
+        return jsonify({'error': 'Failed to generate metrics summary'}), 500
+
+# Helper function to run the parts of a bundled response on the fan-out pool.
+# Their MongoDB time is charged to the current request, since command events
+# are published on the pool threads.
+def run_parts(parts):
+    if not METRICS_ENABLED:
+        return fanout.run(parts)
+    results, errors = fanout.run({name: command_metrics.measured(fn) for name, fn in parts.items()})
+    for _, seconds in results.values():
+        command_metrics.add_thread_time(seconds)
+    return {name: result for name, (result, _) in results.items()}, errors
+
+# API route returning everything the dashboard shows on load in one response:
+# summary, health, the current page of both tables and the chart data. The
+# queries run concurrently, so the response takes as long as the slowest one.
+# Parts that fail are reported in "errors" and the others are still returned,
+# uncached.
+@api.route('/api/dashboard', methods=['GET'])
+@changes.conditional(['metrics', 'notifications'], window=health_monitor.interval)
+@single_flight.coalesce(ChangeTracker.key)
+def dashboard():
+    try:
+        days = parse_summary_days(request.args)
+        points = parse_points(request.args)
+        metrics_params, notifications_params, error = parse_dashboard_args(request.args)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Calculate average uptime
-        if metrics:
-            avg_uptime = sum(metric['uptime'] for metric in metrics) / len(metrics)
-        else:
-            avg_uptime = 0
+        # Read here: the parts run on pool threads, outside the request context
+        versions = {name: changes.current(name) for name in ('metrics', 'notifications')}
         
-        # Count suspicious activities
-        suspicious_count = db.metrics.count_documents({
-            'timestamp': {'$gte': start_date, '$lte': end_date},
-            'activity': 'Suspicious'
-        })
+        def table(collection_name, params):
+            data, pagination = fetch_page(mongo.db[collection_name], version=versions[collection_name], **params)
+            return {'data': data, 'pagination': pagination}
         
-        # Get max concurrent users
-        max_users = 0
-        if metrics:
-            max_users = max(metric['users_connected'] for metric in metrics)
+        parts = {
+            'summary': lambda: summary_for(days, version=versions['metrics']),
+            'metrics': lambda: table('metrics', metrics_params),
+            'notifications': lambda: table('notifications', notifications_params),
+            'series': lambda: fetch_series(mongo.db, days, points, use_rollups=rollups_usable())
+        }
+        results, errors = run_parts(parts)
+        for name, e in errors.items():
+            logger.error(f"Error loading dashboard {name}: {e}")
+        if len(errors) == len(parts):
+            return jsonify({'error': 'Failed to load dashboard'}), 500
         
-        # Get average users
-        if metrics:
-            avg_users = sum(metric['users_connected'] for metric in metrics) / len(metrics)
-        else:
-            avg_users = 0
+        # Health comes from the background check and needs no query
+        results['health'], _ = health_body(health_monitor.current(wait=HEALTH_FIRST_CHECK_WAIT))
+        if errors:
+            results['errors'] = {name: f"Failed to load {name}" for name in errors}
+        response = jsonify(results)
+        if errors:
+            # A partial dashboard is neither cached nor given an ETag
+            response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        logger.error(f"Error loading dashboard: {e}")
+        return jsonify({'error': 'Failed to load dashboard'}), 500
+
+# API for the metrics of the last `days` days downsampled to at most `points`
+# buckets, as parallel arrays (see series.py)
+@api.route('/api/metrics/series', methods=['GET'])
+@changes.conditional(['metrics'], window=60)
+@response_cache.cached('series', ttl=CACHE_TTL_SUMMARY, tags=['metrics'])
+@single_flight.coalesce(ChangeTracker.key)
+def metrics_series():
+    try:
+        days = parse_summary_days(request.args)
+        points = parse_points(request.args)
         
+        return jsonify(fetch_series(mongo.db, days, points, use_rollups=rollups_usable()))
+    except Exception as e:
+        logger.error(f"Error generating metrics series: {e}")
+        return jsonify({'error': 'Failed to generate metrics series'}), 500
+
+# API for the hot window of this worker process: state, size, the oldest
+# timestamp it covers and how many reads it answered
+@api.route('/api/hotwindow/stats', methods=['GET'])
+def hot_window_stats():
+    if hot_window is None:
+        return jsonify({'state': 'off'})
+    return jsonify(hot_window.describe())
+
+# API for response cache hit/miss counters
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'backend': RESPONSE_CACHE if cache_backend is not None else 'none',
+        'endpoints': response_cache.stats,
+        'single_flight': single_flight.stats
+    })
+
+# API for connection pool counters of this worker process: connections open
+# and in use, threads waiting for a connection, checkout wait times and timeouts
+@api.route('/api/pool/stats', methods=['GET'])
+def pool_stats_view():
+    try:
+        options = mongo.client.options.pool_options
+        wait_queue_timeout = options.wait_queue_timeout
         return jsonify({
-            'period_days': days,
-            'total_records': len(metrics),
-            'avg_uptime': round(avg_uptime, 2),
-            'suspicious_activities': suspicious_count,
-            'max_concurrent_users': max_users,
-            'avg_users': round(avg_users, 2),
-            'data_start': start_date.strftime("%Y-%m-%d"),
-            'data_end': end_date.strftime("%Y-%m-%d")
+            'pid': os.getpid(),
+            'settings': {
+                'max_pool_size': options.max_pool_size,
+                'min_pool_size': options.min_pool_size,
+                'max_idle_time_ms': int(options.max_idle_time_seconds * 1000) if options.max_idle_time_seconds else None,
+                'wait_queue_timeout_ms': int(wait_queue_timeout * 1000) if wait_queue_timeout else None,
+                'compressors': MONGO_POOL_OPTIONS.get('compressors')
+            },
+            'pools': pool_stats.snapshot()
         })
     except Exception as e:
-        logger.error(f"Error generating metrics summary: {e}")
-        return jsonify({'error': 'Failed to generate metrics summary'}), 500
+        logger.error(f"Error reading pool stats: {e}")
+        return jsonify({'error': 'Failed to read pool stats'}), 500
 
 # Error handlers
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(e):
     return jsonify({'error': 'Resource not found'}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(SingleFlightTimeout)
+def single_flight_timeout(e):
+    logger.warning(f"Request coalescing timed out: {e}")
+    return jsonify({'error': 'Service busy, retry later'}), 503, {'Retry-After': '1'}
+
+@api.app_errorhandler(500)
 def server_error(e):
     logger.error(f"Server error: {e}")
     return jsonify({'error': 'Internal server error'}), 500
 
+# Application factory. Building the app does no I/O unless REQUIRE_INDEXES is
+# set; MongoDB is connected lazily by the first request of each process. The
+# MongoDB handle is shared by the process, so every app built in it must use
+# the same MONGO_URI and DB_NAME (mongo.init_app raises otherwise).
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(MONGO_URI=MONGO_URI, DB_NAME=DB_NAME)
+    if config:
+        app.config.update(config)
+    CORS(app)  # Enable CORS for all routes
+    # With REQUIRE_INDEXES, refuse to start (python app.py, or a gunicorn
+    # master or worker importing the app) rather than fail the first request
+    if REQUIRE_INDEXES:
+        require_indexes(app.config['MONGO_URI'], app.config['DB_NAME'], create=CREATE_INDEXES, **MONGO_POOL_OPTIONS)
+    mongo.init_app(app)
+    app.register_blueprint(api)
+    if METRICS_ENABLED:
+        init_metrics(app, command_metrics)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=os.environ.get('DEBUG', 'False').lower() == 'true', host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,443 @@
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from instrumentation import CommandMetrics
+from mongo import pool_options
+from pymongo import AsyncMongoClient
+from urllib.parse import parse_qsl, urlencode
+from werkzeug.datastructures import MultiDict
+from queries import (PAGE_SORT, build_metrics_query, build_notifications_query, build_page, page_find_args,
+                     parse_dashboard_args, parse_list_args, parse_percentiles, parse_summary_days,
+                     summary_body)
+from rollups import (ROLLUPS, RollupCheck, combine_totals, missing_sketches, rollup_count_pipeline, sketch_aggregations,
+                     summary_aggregations)
+from series import parse_points, series_aggregations, series_body, series_window
+from sketches import merge_sketches, percentiles_body
+from totals import CountCache, count_total_async
+import asyncio
+import json
+import logging
+import os
+import time
+from dotenv import load_dotenv
+
+# Async serving mode: the dashboard's read endpoints are served by coroutines
+# on PyMongo's AsyncMongoClient, so concurrent requests multiplex on one event
+# loop instead of holding a thread each. Every other route (the page, static
+# files, exports, ingestion) is delegated to the Flask app.
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = os.getenv("DB_NAME", "monitoring_app")
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "True").lower() == 'true'
+# Rollups are only read while they match the metrics, as in the sync mode
+rollup_check = RollupCheck(interval=int(os.getenv("ROLLUP_CHECK_INTERVAL", 300)))
+# Same pool settings as the sync mode; ASYNC_MAX_POOL_SIZE overrides the pool size
+MONGO_POOL_OPTIONS = pool_options()
+if os.getenv("ASYNC_MAX_POOL_SIZE"):
+    MONGO_POOL_OPTIONS['maxPoolSize'] = int(os.getenv("ASYNC_MAX_POOL_SIZE"))
+
+# MongoDB command latencies, exposed on /metrics by the Flask app
+if os.getenv("METRICS_ENABLED", "True").lower() == 'true':
+    MONGO_POOL_OPTIONS['event_listeners'] = [CommandMetrics()]
+
+count_cache = CountCache(
+    ttl=int(os.getenv("COUNT_CACHE_TTL", 30)),
+    max_entries=int(os.getenv("COUNT_CACHE_SIZE", 1024))
+)
+
+# Last health check, refreshed on demand (see current_health); a snapshot
+# older than HEALTH_MAX_AGE means the refresh is stuck, as in health.HealthMonitor
+HEALTH_REFRESH_INTERVAL = int(os.getenv("HEALTH_REFRESH_INTERVAL", 10))
+HEALTH_MAX_AGE = 3 * HEALTH_REFRESH_INTERVAL
+health_snapshot = None
+
+# Threads running the routes delegated to the Flask app
+ASGI_FALLBACK_THREADS = int(os.getenv("ASGI_FALLBACK_THREADS", 16))
+
+# Created on startup inside the server's event loop
+client = None
+db = None
+
+# In-flight requests per normalized path and query, shared by identical
+# concurrent requests (the async counterpart of singleflight.SingleFlight)
+inflight = {}
+
+class JSONResponse:
+    def __init__(self, body, status=200):
+        # Same encoding as Flask's jsonify in production mode
+        self.body = (json.dumps(body, sort_keys=True, separators=(',', ':')) + '\n').encode()
+        self.status = status
+
+    async def send(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(self.body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
+
+# Helper function to fetch one page, running the count and the find concurrently
+async def fetch_page(collection, query, page, per_page, keyset=False, after=None, count_mode='approx'):
+    find_query, skip, limit = page_find_args(query, page, per_page, keyset, after)
+    cursor = collection.find(find_query).sort(PAGE_SORT).skip(skip).limit(limit)
+    total, docs = await asyncio.gather(
+        count_total_async(collection, query, count_mode, count_cache),
+        cursor.to_list(length=limit)
+    )
+    return build_page(docs, total, page, per_page, keyset)
+
+async def get_metrics(args):
+    try:
+        params, error = parse_list_args(args, build_metrics_query)
+        if error:
+            return JSONResponse({'error': error}, 400)
+        metrics, pagination = await fetch_page(db.metrics, **params)
+        return JSONResponse({'data': metrics, 'pagination': pagination})
+    except Exception as e:
+        logger.error(f"Error fetching metrics: {e}")
+        return JSONResponse({'error': 'Failed to fetch metrics'}, 500)
+
+async def get_notifications(args):
+    try:
+        params, error = parse_list_args(args, build_notifications_query)
+        if error:
+            return JSONResponse({'error': error}, 400)
+        notifications, pagination = await fetch_page(db.notifications, **params)
+        return JSONResponse({'data': notifications, 'pagination': pagination})
+    except Exception as e:
+        logger.error(f"Error fetching notifications: {e}")
+        return JSONResponse({'error': 'Failed to fetch notifications'}, 500)
+
+# Run the health check (ping, uptime, estimated counts) at most once per
+# HEALTH_REFRESH_INTERVAL seconds, however often it is polled
+async def current_health():
+    global health_snapshot
+    if health_snapshot is None or time.time() - health_snapshot['checked_at'] > HEALTH_REFRESH_INTERVAL:
+        started = time.perf_counter()
+        snapshot = {'checked_at': time.time()}
+        try:
+            await client.admin.command('ping')
+            snapshot['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            server_status, metrics_count, notifications_count = await asyncio.gather(
+                db.command('serverStatus'),
+                db.metrics.estimated_document_count(),
+                db.notifications.estimated_document_count()
+            )
+            snapshot.update(ok=True, db_uptime_seconds=server_status['uptime'],
+                            counts={'metrics': metrics_count, 'notifications': notifications_count})
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+            snapshot.update(ok=False, error=str(e))
+        health_snapshot = snapshot
+    return health_snapshot
+
+# Compare the rollup bucket counts with the metrics count (see rollups.RollupCheck)
+async def check_rollups(_):
+    watermark = rollup_check.watermark()
+
+    async def bucket_count(collection_name):
+        cursor = await db[collection_name].aggregate(rollup_count_pipeline(watermark))
+        return next(iter(await cursor.to_list(length=1)), {}).get('count', 0)
+
+    metrics_count, *counts = await asyncio.gather(
+        db.metrics.count_documents({'timestamp': {'$lt': watermark}}),
+        *(bucket_count(collection_name) for collection_name, _, _ in ROLLUPS.values())
+    )
+    return rollup_check.record(metrics_count, dict(zip(ROLLUPS, counts)))
+
+# Whether summaries and series can read the rollups, checking again when due
+async def rollups_usable():
+    if not USE_ROLLUPS:
+        return False
+    if rollup_check.due():
+        try:
+            await coalesced('rollups', check_rollups, None)
+        except Exception as e:
+            rollup_check.record_error(e)
+    return rollup_check.stale == []
+
+# Error of a snapshot that cannot answer readiness, None when it is ready;
+# the same conditions as the sync mode's HealthMonitor.ready
+def health_error(snapshot):
+    if not snapshot['ok']:
+        return snapshot['error']
+    if time.time() - snapshot['checked_at'] > HEALTH_MAX_AGE:
+        return 'Health check is stale'
+    return None
+
+# Helper function to build the health body and status from a health snapshot
+def health_body(snapshot):
+    error = health_error(snapshot)
+    if error:
+        return {
+            'status': 'unhealthy',
+            'error': error,
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }, 500
+    return {
+        'status': 'healthy',
+        'database': 'connected',
+        'db_uptime_seconds': snapshot['db_uptime_seconds'],
+        'metrics_count': snapshot['counts']['metrics'],
+        'notifications_count': snapshot['counts']['notifications'],
+        'checked_at': datetime.fromtimestamp(snapshot['checked_at']).strftime("%Y-%m-%d %H:%M:%S"),
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }, 200
+
+async def health_check(args):
+    snapshot = await coalesced('health', lambda _: current_health(), None)
+    return JSONResponse(*health_body(snapshot))
+
+async def livez(args):
+    return JSONResponse({'status': 'alive'})
+
+async def readyz(args):
+    snapshot = await coalesced('health', lambda _: current_health(), None)
+    error = health_error(snapshot)
+    if error:
+        return JSONResponse({'status': 'not ready', 'error': error}, 503)
+    return JSONResponse({
+        'status': 'ready',
+        'ping_ms': snapshot['ping_ms'],
+        'checked_at': datetime.fromtimestamp(snapshot['checked_at']).strftime("%Y-%m-%d %H:%M:%S")
+    })
+
+# Helper function to summarize the last `days` days, with the requested
+# percentiles; the raw edges and rollup spans, and their sketches, are
+# aggregated concurrently
+async def summary_for(days, percentiles=()):
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    use_rollups = await rollups_usable()
+
+    async def totals(collection_name, pipeline):
+        cursor = await db[collection_name].aggregate(pipeline)
+        return next(iter(await cursor.to_list(length=1)), None)
+
+    async def bins(collection_name, pipeline):
+        cursor = await db[collection_name].aggregate(pipeline)
+        result, fallback = missing_sketches(collection_name, await cursor.to_list(length=None))
+        if fallback is not None:
+            cursor = await db.metrics.aggregate(fallback)
+            result.extend(await cursor.to_list(length=None))
+        return result
+
+    totals_parts = [
+        totals(collection_name, pipeline)
+        for collection_name, pipeline in summary_aggregations(start_date, end_date, use_rollups)
+    ]
+    sketch_parts = [
+        bins(collection_name, pipeline)
+        for collection_name, pipeline in sketch_aggregations(start_date, end_date, use_rollups)
+    ] if percentiles else []
+    parts = await asyncio.gather(*totals_parts, *sketch_parts)
+    summary = combine_totals(parts[:len(totals_parts)])
+    if not percentiles:
+        return summary_body(days, start_date, end_date, summary)
+
+    sketches = merge_sketches(doc for part in parts[len(totals_parts):] for doc in part)
+    return summary_body(days, start_date, end_date, summary, percentiles_body(sketches, percentiles))
+
+async def metrics_summary(args):
+    try:
+        percentiles, error = parse_percentiles(args)
+        if error:
+            return JSONResponse({'error': error}, 400)
+        return JSONResponse(await summary_for(parse_summary_days(args), percentiles))
+    except Exception as e:
+        logger.error(f"Error generating metrics summary: {e}")
+        return JSONResponse({'error': 'Failed to generate metrics summary'}, 500)
+
+# Helper function to build the downsampled series of the last `days` days;
+# the raw edges and rollup spans are aggregated concurrently
+async def series_for(days, points):
+    start, end, unit, bin_size = series_window(days, points)
+    use_rollups = await rollups_usable()
+
+    async def buckets(collection_name, pipeline):
+        cursor = await db[collection_name].aggregate(pipeline)
+        return await cursor.to_list(length=None)
+
+    parts = await asyncio.gather(*(
+        buckets(collection_name, pipeline)
+        for collection_name, pipeline in series_aggregations(start, end, unit, bin_size, use_rollups)
+    ))
+    return series_body(days, start, end, unit, bin_size, [doc for part in parts for doc in part])
+
+async def metrics_series(args):
+    try:
+        return JSONResponse(await series_for(parse_summary_days(args), parse_points(args)))
+    except Exception as e:
+        logger.error(f"Error generating metrics series: {e}")
+        return JSONResponse({'error': 'Failed to generate metrics series'}, 500)
+
+# Everything the dashboard shows on load, with all parts gathered concurrently
+# (see /api/dashboard in app.py)
+async def dashboard(args):
+    try:
+        days = parse_summary_days(args)
+        points = parse_points(args)
+        metrics_params, notifications_params, error = parse_dashboard_args(args)
+        if error:
+            return JSONResponse({'error': error}, 400)
+
+        async def table(collection, params):
+            data, pagination = await fetch_page(collection, **params)
+            return {'data': data, 'pagination': pagination}
+
+        parts = {
+            'summary': summary_for(days),
+            'metrics': table(db.metrics, metrics_params),
+            'notifications': table(db.notifications, notifications_params),
+            'series': series_for(days, points)
+        }
+        outcomes = await asyncio.gather(*parts.values(), return_exceptions=True)
+        results, errors = {}, {}
+        for name, outcome in zip(parts, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Error loading dashboard {name}: {outcome}")
+                errors[name] = f"Failed to load {name}"
+            else:
+                results[name] = outcome
+        if not results:
+            return JSONResponse({'error': 'Failed to load dashboard'}, 500)
+
+        results['health'], _ = health_body(await coalesced('health', lambda _: current_health(), None))
+        if errors:
+            results['errors'] = errors
+        return JSONResponse(results)
+    except Exception as e:
+        logger.error(f"Error loading dashboard: {e}")
+        return JSONResponse({'error': 'Failed to load dashboard'}, 500)
+
+ROUTES = {
+    '/api/metrics': get_metrics,
+    '/api/notifications': get_notifications,
+    '/api/health': health_check,
+    '/livez': livez,
+    '/readyz': readyz,
+    '/api/metrics/summary': metrics_summary,
+    '/api/metrics/series': metrics_series,
+    '/api/dashboard': dashboard,
+}
+
+# Run a handler, sharing the result with identical requests already in flight
+async def coalesced(key, handler, args):
+    task = inflight.get(key)
+    if task is None:
+        task = inflight[key] = asyncio.ensure_future(handler(args))
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def lifespan(receive, send):
+    global client, db
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                client = AsyncMongoClient(MONGO_URI, **MONGO_POOL_OPTIONS)
+                db = client[DB_NAME]
+                await client.admin.command('ping')
+                await rollups_usable()
+                logger.info("Successfully connected to MongoDB (async)")
+                await send({'type': 'lifespan.startup.complete'})
+            except Exception as e:
+                logger.error(f"Failed to connect to MongoDB: {e}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+        elif message['type'] == 'lifespan.shutdown':
+            if client is not None:
+                await client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# WsgiToAsgi runs every request on one shared thread, so a slow delegated
+# request (an export, a large ingestion batch) would hold up all the others.
+# This variant runs each one on a pool of ASGI_FALLBACK_THREADS threads. It
+# relies on the environ and start_response helpers of asgiref 3.12 (pinned in
+# the Pipfile).
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self.run_in_pool, thread_sensitive=False, executor=self.executor)(body)
+
+    # Run the WSGI app and send its response, on a pool thread, so that
+    # start_response is called on the thread running the app
+    def run_in_pool(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request: Too many duplicate headers'})
+            return
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            sent = 0
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # Never send more than the Content-Length the app declared
+                if self.response_content_length is not None:
+                    chunk = chunk[:self.response_content_length - sent]
+                self.sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                sent += len(chunk)
+                if sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    def __init__(self, wsgi_application, max_workers):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='flask-fallback')
+
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+# Helper function to build the coalescing key of a request, ignoring the
+# order of its query arguments like ResponseCache.key
+def request_key(path, args):
+    return f"{path}?{urlencode(sorted(args.items(multi=True)))}"
+
+# The Flask app is only imported when a delegated route is first hit
+flask_fallback = None
+
+async def app(scope, receive, send):
+    global flask_fallback
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    # The live update stream never completes, so through the WSGI fallback
+    # each client would hold one of its threads for as long as it stays connected
+    if scope['type'] == 'http' and scope.get('path') == '/api/stream':
+        return await JSONResponse({'error': 'Live updates are not available in async mode'}, 503).send(send)
+
+    handler = ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    if handler is None:
+        if flask_fallback is None:
+            from app import app as flask_app
+            flask_fallback = PooledWsgiToAsgi(flask_app, ASGI_FALLBACK_THREADS)
+        return await flask_fallback(scope, receive, send)
+
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+    response = await coalesced(request_key(scope['path'], args), handler, args)
+    await response.send(send)
@@ -0,0 +1,160 @@
+# Sync vs async serving mode under many concurrent dashboard clients.
+#
+# Starts the app under gunicorn (sync, app:app) and under uvicorn (async,
+# asgi:app) against the same database, then opens N simultaneous clients that
+# each load the dashboard: the five API calls of one page load issued in
+# parallel, repeated a few times. Reports page-load latency, throughput,
+# failed page loads and the server's thread count and peak RSS.
+#
+#     python benchmarks/bench_async.py --clients 10,100,1000 --db monitoring_bench_100k
+from common import ROOT, UNCACHED_ENV, latency_stats, peak_rss_mb, run_metadata, save_results, wait_for_server
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import time
+
+# The five API calls of a dashboard page load before /api/dashboard bundled them;
+# async mode serves each of them natively
+PAGE_LOAD = [
+    '/api/metrics?per_page=100&page=1',
+    '/api/metrics/summary?days=7',
+    '/api/metrics?page=1&per_page=10',
+    '/api/notifications?page=1&per_page=10',
+    '/api/health',
+]
+
+SERVERS = {
+    'sync': lambda args: ['gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                          '--timeout', '120', '--bind', f"127.0.0.1:{args.port}", 'app:app'],
+    'async': lambda args: ['uvicorn', '--workers', str(args.workers), '--no-access-log',
+                           '--host', '127.0.0.1', '--port', str(args.port), 'asgi:app'],
+}
+
+# Total threads of a process and its children (Linux only)
+def thread_count(pid):
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith('Threads:'):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pids += [int(child) for child in children.read().split()]
+        except OSError:
+            continue
+    return total or None
+
+# Minimal HTTP/1.1 GET over one keep-alive connection; returns the status code
+async def get(reader, writer, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+# One dashboard client: a connection per parallel call, as a browser would open
+async def client(port, page_loads, timeout, latencies, failures):
+    connections = []
+    try:
+        for _ in PAGE_LOAD:
+            connections.append(await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout))
+        for _ in range(page_loads):
+            started = time.perf_counter()
+            try:
+                statuses = await asyncio.wait_for(asyncio.gather(*(
+                    get(reader, writer, path) for (reader, writer), path in zip(connections, PAGE_LOAD)
+                )), timeout)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                failures.append(1)
+                return
+            if any(status >= 500 for status in statuses):
+                failures.append(1)
+            else:
+                latencies.append(time.perf_counter() - started)
+    except (OSError, asyncio.TimeoutError):
+        failures.append(1)
+    finally:
+        for _, writer in connections:
+            writer.close()
+
+async def run_clients(port, clients, page_loads, timeout):
+    latencies, failures = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(port, page_loads, timeout, latencies, failures) for _ in range(clients)))
+    return latency_stats(latencies, time.perf_counter() - started, len(failures))
+
+def bench_server(mode, client_counts, args):
+    command = SERVERS[mode](args)
+    if not shutil.which(command[0]):
+        print(f"{command[0]} not installed, skipping the {mode} mode")
+        return {}
+    env = dict(os.environ, DB_NAME=args.db, MONGO_URI=args.connection, **UNCACHED_ENV)
+    server = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(f"http://127.0.0.1:{args.port}", '/api/health')
+        results = {}
+        for clients in client_counts:
+            # Sample the thread count while the clients are connected
+            async def measure():
+                load = asyncio.ensure_future(run_clients(args.port, clients, args.page_loads, args.timeout))
+                await asyncio.sleep(min(1.0, args.timeout / 2))
+                threads = thread_count(server.pid)
+                return await load, threads
+            stats, threads = asyncio.run(measure())
+            stats['server_threads'] = threads
+            stats['peak_rss_mb'] = peak_rss_mb(server.pid)
+            results[str(clients)] = stats
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def print_table(mode, results):
+    print(f"\n{mode} mode (latency of a whole page load)")
+    print(f"  {'clients':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'loads/s':>9} "
+          f"{'failed':>7} {'threads':>8} {'RSS MB':>8}")
+    for clients, stats in results.items():
+        print(f"  {clients:>8} {stats['p50_ms'] or 0:>9.2f} {stats['p95_ms'] or 0:>9.2f} "
+              f"{stats['p99_ms'] or 0:>9.2f} {stats['throughput_rps'] or 0:>9.1f} {stats['errors']:>7} "
+              f"{stats['server_threads'] or 0:>8} {stats['peak_rss_mb'] or 0:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sync and async serving modes under concurrent clients")
+    parser.add_argument('--clients', default='10,100,1000', help="Comma separated numbers of simultaneous clients")
+    parser.add_argument('--modes', default='sync,async', help="sync (gunicorn app:app), async (uvicorn asgi:app)")
+    parser.add_argument('--page-loads', type=int, default=5, help="Dashboard page loads per client")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Seconds before a page load counts as failed")
+    parser.add_argument('--workers', type=int, default=2, help="Server processes in both modes")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker in sync mode")
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--db', default=os.getenv("DB_NAME", "monitoring_app"),
+                        help="Database to serve, e.g. one seeded by bench_endpoints.py")
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--output', default='bench_async_results.json')
+    args = parser.parse_args()
+
+    client_counts = [int(count) for count in args.clients.split(',')]
+    # Each client holds one socket per call of a page load
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    results = {'meta': run_metadata(db=args.db, workers=args.workers, threads=args.threads,
+                                    page_loads=args.page_loads),
+               'results': {}}
+    for mode in args.modes.split(','):
+        results['results'][mode] = bench_server(mode, client_counts, args)
+        print_table(mode, results['results'][mode])
+    save_results(args.output, results)
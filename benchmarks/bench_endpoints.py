@@ -0,0 +1,183 @@
+# Endpoint latency benchmark against seeded datasets of several sizes.
+#
+# Seeds one database per dataset size on a local mongod (reused between runs),
+# then drives every API route through the Flask test client and through
+# gunicorn, reporting p50/p95/p99 latency, throughput and peak RSS.
+#
+#     python benchmarks/bench_endpoints.py --sizes 10k,1m --output results.json
+#     python benchmarks/bench_endpoints.py --sizes 10k --baseline results.json
+from common import (ROOT, UNCACHED_ENV, compare_with_baseline, http_load, latency_stats,
+                    peak_rss_mb, run_metadata, save_results, wait_for_server)
+from datetime import timedelta
+from pymongo import MongoClient
+import argparse
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Minutes in a year: above this many metrics the generator adds hosts
+YEAR_OF_MINUTES = 365 * 24 * 60
+
+# Routes exercised by the benchmark; {deep}/{deep_keyword}/{deep_notifications}
+# are replaced by page numbers close to the end of each result set
+ROUTES = {
+    'metrics_page1': '/api/metrics?page=1&per_page=10',
+    'metrics_deep': '/api/metrics?page={deep}&per_page=10',
+    'metrics_keyword_page1': '/api/metrics?page=1&per_page=10&keyword=susp',
+    'metrics_keyword_deep': '/api/metrics?page={deep_keyword}&per_page=10&keyword=susp',
+    'notifications_page1': '/api/notifications?page=1&per_page=10',
+    'notifications_deep': '/api/notifications?page={deep_notifications}&per_page=10',
+    'summary_7d': '/api/metrics/summary?days=7',
+    'summary_30d': '/api/metrics/summary?days=30',
+    'summary_365d': '/api/metrics/summary?days=365',
+    'percentiles_365d': '/api/metrics/summary?days=365&percentiles=1,50,95,99',
+    'series_7d': '/api/metrics/series?days=7&points=200',
+    'series_365d': '/api/metrics/series?days=365&points=200',
+    'health': '/api/health',
+    'dashboard': '/api/dashboard?days=7&per_page=10',
+}
+
+# Seed a benchmark database with about `size` one-minute metrics, unless it
+# already holds that dataset
+def seed(connection, db_name, size, reseed=False):
+    from generate_data import generate_data
+    from indexes import ensure_indexes
+    from rollups import ROLLUPS
+
+    db = MongoClient(connection)[db_name]
+    hosts = max(1, math.ceil(size / YEAR_OF_MINUTES))
+    days = min(365, math.ceil(size / hosts / 1440))
+    expected = days * 1440 * hosts
+    if not reseed and db.metrics.estimated_document_count() == expected:
+        print(f"Reusing {db_name} ({expected} metrics)")
+        return db
+    for name in ['metrics', 'notifications'] + [collection for collection, _, _ in ROLLUPS.values()]:
+        db[name].drop()
+    ensure_indexes(db)
+    generate_data(db, connection, days=days, interval=timedelta(minutes=1), hosts=hosts,
+                  workers=os.cpu_count() or 1, seed=42)
+    return db
+
+# Concrete paths for a dataset, with deep pages near the end of each result set
+def route_paths(db):
+    metrics = db.metrics.estimated_document_count()
+    suspicious = db.metrics.count_documents({'activity': 'Suspicious'})
+    notifications = db.notifications.estimated_document_count()
+    pages = {
+        'deep': max(1, int(metrics * 0.9) // 10),
+        'deep_keyword': max(1, int(suspicious * 0.9) // 10),
+        'deep_notifications': max(1, int(notifications * 0.9) // 10),
+    }
+    return {name: path.format(**pages) for name, path in ROUTES.items()}
+
+# Child process: drive routes through the Flask test client of a fresh app
+def run_test_client(paths, requests, warmup):
+    import app as app_module
+    client = app_module.app.test_client()
+    results = {}
+    for name, path in paths.items():
+        for _ in range(warmup):
+            client.get(path)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            response = client.get(path)
+            if response.status_code >= 500:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - request_started)
+        results[name] = latency_stats(latencies, time.perf_counter() - started, errors)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for stats in results.values():
+        stats['peak_rss_mb'] = round(peak_kb / 1024, 1)
+    return results
+
+def bench_test_client(db_name, paths, args):
+    env = dict(os.environ, DB_NAME=db_name, MONGO_URI=args.connection, **UNCACHED_ENV)
+    output = subprocess.check_output([
+        sys.executable, __file__, '--child', json.dumps(paths),
+        '--requests', str(args.requests), '--warmup', str(args.warmup)
+    ], env=env, cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+# Drive routes through gunicorn over real HTTP connections
+def bench_wsgi(db_name, paths, args):
+    if not shutil.which('gunicorn'):
+        print("gunicorn not installed, skipping the WSGI benchmark")
+        return {}
+    env = dict(os.environ, DB_NAME=db_name, MONGO_URI=args.connection, **UNCACHED_ENV)
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([
+        'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+        '--bind', f"127.0.0.1:{args.port}", 'app:app'
+    ], env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(base_url)
+        results = {}
+        for name, path in paths.items():
+            http_load(base_url, [path] * args.warmup, concurrency=1)
+            results[name] = http_load(base_url, [path] * args.requests, concurrency=args.concurrency)
+            results[name]['peak_rss_mb'] = peak_rss_mb(server.pid)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def print_table(size, mode, results):
+    print(f"\n{size} metrics, {mode}")
+    print(f"  {'route':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'RSS MB':>8}")
+    for name, stats in results.items():
+        print(f"  {name:<24} {stats['p50_ms'] or 0:>9.2f} {stats['p95_ms'] or 0:>9.2f} "
+              f"{stats['p99_ms'] or 0:>9.2f} {stats['throughput_rps'] or 0:>9.1f} "
+              f"{stats.get('peak_rss_mb') or 0:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every API route on datasets of several sizes")
+    parser.add_argument('--sizes', default='10k', help=f"Comma separated sizes among {', '.join(SIZES)}")
+    parser.add_argument('--modes', default='client,wsgi', help="client (Flask test client), wsgi (gunicorn)")
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per route")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per route")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent connections in wsgi mode")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers in wsgi mode")
+    parser.add_argument('--threads', type=int, default=4, help="gunicorn threads per worker in wsgi mode")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--reseed', action='store_true', help="Regenerate the datasets even if present")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="Results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p95 increase flagged as regression")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_test_client(json.loads(args.child), args.requests, args.warmup)))
+        sys.exit(0)
+
+    modes = args.modes.split(',')
+    results = {'meta': run_metadata(requests=args.requests, concurrency=args.concurrency,
+                                    workers=args.workers, threads=args.threads),
+               'results': {}}
+    for size in args.sizes.split(','):
+        db_name = f"monitoring_bench_{size}"
+        db = seed(args.connection, db_name, SIZES[size], args.reseed)
+        paths = route_paths(db)
+        results['results'][size] = {}
+        if 'client' in modes:
+            results['results'][size]['client'] = bench_test_client(db_name, paths, args)
+            print_table(size, 'Flask test client', results['results'][size]['client'])
+        if 'wsgi' in modes:
+            results['results'][size]['wsgi'] = bench_wsgi(db_name, paths, args)
+            print_table(size, f"gunicorn {args.workers}x{args.threads}, {args.concurrency} connections",
+                        results['results'][size]['wsgi'])
+
+    save_results(args.output, results)
+    if args.baseline and compare_with_baseline(results, args.baseline, args.threshold):
+        sys.exit(1)
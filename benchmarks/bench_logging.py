@@ -0,0 +1,134 @@
+# Logging overhead per request, before and after the background logging pipeline.
+#
+# Each mode runs in a fresh process with its own logconfig settings. Two
+# measurements are made:
+# - the time a request thread spends emitting one access log line and one
+#   application log line, from several threads at once;
+# - latency and throughput of a trivial Flask route served by werkzeug's
+#   threaded server, which writes an access log line per request.
+# "off" disables logging and is the floor. "sync" is the previous setup, where
+# the request thread writes to the file and console itself.
+#
+#     python benchmarks/bench_logging.py --requests 20000 --threads 8
+from common import ROOT, http_load, latency_stats, run_metadata, save_results, wait_for_server
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODES = {
+    'off': {'LOG_LEVEL': 'CRITICAL'},
+    'sync': {'LOG_QUEUE': 'False'},
+    'queue': {'LOG_QUEUE': 'True'},
+    'queue_json': {'LOG_QUEUE': 'True', 'LOG_FORMAT': 'json'},
+    'queue_sampled': {'LOG_QUEUE': 'True', 'ACCESS_LOG_SAMPLE': '0.1'},
+}
+
+# Child process: measure the logging calls of one request from several threads
+def measure_calls(requests, threads):
+    import logging
+    from logconfig import configure_logging
+    handler = configure_logging()
+    access = logging.getLogger('werkzeug')
+    app_logger = logging.getLogger('app')
+    per_thread = requests // threads
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        samples = []
+        for i in range(per_thread):
+            started = time.perf_counter()
+            access.info('127.0.0.1 - - [18/Oct/2026 10:00:00] "%s" %s %s', f'GET /api/metrics?page={i} HTTP/1.1', '200', '-')
+            app_logger.info(f"Fetched page {i} of metrics")
+            samples.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(samples)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = time.perf_counter() - started
+    stats = latency_stats(latencies, duration)
+    stats['mean_us'] = round(sum(latencies) / len(latencies) * 1e6, 2) if latencies else None
+
+    # Time until every queued record is on disk
+    flush_started = time.perf_counter()
+    if hasattr(handler, 'stop'):
+        handler.stop()
+    stats['drain_ms'] = round((time.perf_counter() - flush_started) * 1000, 1)
+    stats['dropped'] = getattr(handler, 'dropped', 0)
+    return stats
+
+# Child process: serve a trivial route with werkzeug's threaded server
+def serve(port):
+    from flask import Flask
+    from logconfig import configure_logging
+    from werkzeug.serving import make_server
+    configure_logging()
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+def run_mode(mode, args, log_dir):
+    env = dict(os.environ, LOG_FILE=os.path.join(log_dir, f"{mode}.log"), ACCESS_LOG_SAMPLE='1.0')
+    env.update(MODES[mode])
+    output = subprocess.check_output([
+        sys.executable, __file__, '--child', 'calls', '--requests', str(args.requests), '--threads', str(args.threads)
+    ], env=env, cwd=ROOT, stderr=subprocess.DEVNULL)
+    result = {'calls': json.loads(output.decode().strip().splitlines()[-1])}
+
+    server = subprocess.Popen([sys.executable, __file__, '--child', 'serve', '--port', str(args.port)],
+                              env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_for_server(base_url, '/ping')
+        http_load(base_url, ['/ping'] * 200, concurrency=args.threads)
+        result['server'] = http_load(base_url, ['/ping'] * args.http_requests, concurrency=args.threads)
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure logging overhead per request for each logging setup")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated among {', '.join(MODES)}")
+    parser.add_argument('--requests', type=int, default=20000, help="Simulated requests in the call benchmark")
+    parser.add_argument('--http-requests', type=int, default=3000, help="Requests against the werkzeug server")
+    parser.add_argument('--threads', type=int, default=8, help="Request threads / client connections")
+    parser.add_argument('--port', type=int, default=5096)
+    parser.add_argument('--output', default='bench_logging_results.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'calls':
+        print(json.dumps(measure_calls(args.requests, args.threads)))
+        sys.exit(0)
+    if args.child == 'serve':
+        serve(args.port)
+        sys.exit(0)
+
+    results = {'meta': run_metadata(requests=args.requests, threads=args.threads), 'results': {}}
+    with tempfile.TemporaryDirectory() as log_dir:
+        for mode in args.modes.split(','):
+            results['results'][mode] = run_mode(mode, args, log_dir)
+
+    print(f"\n{'mode':<14} {'mean us':>9} {'p99 us':>9} {'drain ms':>9} {'dropped':>8}   "
+          f"{'http p50 ms':>11} {'http p99 ms':>11} {'req/s':>9}")
+    for mode, result in results['results'].items():
+        calls, server = result['calls'], result['server']
+        print(f"{mode:<14} {calls['mean_us'] or 0:>9.2f} {(calls['p99_ms'] or 0) * 1000:>9.1f} "
+              f"{calls['drain_ms']:>9.1f} {calls['dropped']:>8}   {server['p50_ms'] or 0:>11.3f} "
+              f"{server['p99_ms'] or 0:>11.3f} {server['throughput_rps'] or 0:>9.1f}")
+    save_results(args.output, results)
@@ -0,0 +1,104 @@
+# Throughput scaling of the gunicorn deployment across CPU cores.
+#
+# Starts gunicorn with gunicorn.conf.py and 1, 2, 4, ... workers (up to the
+# number of cores) against the same database, drives a mix of API routes at a
+# fixed concurrency and reports throughput, latency, scaling efficiency against
+# the single-worker run, time to first response and peak RSS. The import time
+# of the app module is measured too, since it bounds how fast workers restart.
+#
+#     python benchmarks/bench_scaling.py --db monitoring_bench_100k
+#     python benchmarks/bench_scaling.py --workers 1,2,4,8 --worker-class gevent
+from common import ROOT, UNCACHED_ENV, http_load, peak_rss_mb, run_metadata, save_results, wait_for_server
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+# Route mix of a dashboard page load, minus the big chart page
+ROUTE_MIX = [
+    '/api/metrics?page=1&per_page=10',
+    '/api/notifications?page=1&per_page=10',
+    '/api/metrics/summary?days=7',
+    '/api/health',
+]
+
+# Default worker counts: powers of two up to the number of cores, plus the core count
+def default_worker_counts():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    return counts if counts[-1] == cores else counts + [cores]
+
+# Median wall time of importing the app module in a fresh interpreter
+def import_time(env, runs=5):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'import app'], env=env, cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return round(sorted(timings)[len(timings) // 2] * 1000, 1)
+
+def bench_workers(workers, args, env):
+    env = dict(env, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(args.threads),
+               GUNICORN_WORKER_CLASS=args.worker_class, GUNICORN_BIND=f"127.0.0.1:{args.port}",
+               GUNICORN_ACCESS_LOG='')
+    base_url = f"http://127.0.0.1:{args.port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(['gunicorn'], env=env, cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(base_url, '/api/health')
+        first_response = time.perf_counter() - started
+        paths = ROUTE_MIX * (args.requests // len(ROUTE_MIX))
+        http_load(base_url, ROUTE_MIX * args.warmup, concurrency=args.concurrency)
+        stats = http_load(base_url, paths, concurrency=args.concurrency)
+        stats['first_response_ms'] = round(first_response * 1000, 1)
+        stats['peak_rss_mb'] = peak_rss_mb(server.pid)
+        return stats
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure gunicorn throughput scaling across cores")
+    parser.add_argument('--workers', help="Comma separated worker counts (default: 1, 2, 4, ... up to the cores)")
+    parser.add_argument('--threads', type=int, default=8, help="Threads per gthread worker")
+    parser.add_argument('--worker-class', default='gthread', choices=['gthread', 'gevent', 'sync'])
+    parser.add_argument('--concurrency', type=int, default=64, help="Concurrent client connections")
+    parser.add_argument('--requests', type=int, default=4000, help="Measured requests per worker count")
+    parser.add_argument('--warmup', type=int, default=25, help="Unmeasured passes over the route mix")
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--db', default=os.getenv("DB_NAME", "monitoring_app"),
+                        help="Database to serve, e.g. one seeded by bench_endpoints.py")
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--output', default='bench_scaling_results.json')
+    args = parser.parse_args()
+
+    if not shutil.which('gunicorn'):
+        sys.exit("gunicorn is not installed")
+    counts = [int(count) for count in args.workers.split(',')] if args.workers else default_worker_counts()
+    env = dict(os.environ, DB_NAME=args.db, MONGO_URI=args.connection, **UNCACHED_ENV)
+
+    results = {'meta': run_metadata(db=args.db, worker_class=args.worker_class, threads=args.threads,
+                                    concurrency=args.concurrency),
+               'import_ms': import_time(env),
+               'results': {}}
+    print(f"import app: {results['import_ms']} ms")
+    print(f"\n{'workers':>8} {'req/s':>9} {'speedup':>8} {'efficiency':>11} {'p50 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7} {'first ms':>9} {'RSS MB':>8}")
+    single = None
+    for workers in counts:
+        stats = bench_workers(workers, args, env)
+        single = single or (stats['throughput_rps'] if workers == 1 else None)
+        if single and stats['throughput_rps']:
+            stats['speedup'] = round(stats['throughput_rps'] / single, 2)
+            stats['efficiency'] = round(stats['speedup'] / workers, 2)
+        results['results'][str(workers)] = stats
+        print(f"{workers:>8} {stats['throughput_rps'] or 0:>9.1f} {stats.get('speedup') or 0:>8.2f} "
+              f"{stats.get('efficiency') or 0:>11.0%} {stats['p50_ms'] or 0:>9.2f} {stats['p99_ms'] or 0:>9.2f} "
+              f"{stats['errors']:>7} {stats['first_response_ms']:>9.1f} {stats['peak_rss_mb'] or 0:>8.1f}")
+    save_results(args.output, results)
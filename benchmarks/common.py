@@ -0,0 +1,160 @@
+from datetime import datetime
+from urllib.parse import urlsplit
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+# Repository root, so benchmark scripts can import the app modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Environment that turns off every layer serving requests without MongoDB,
+# so benchmarks measure the query paths unless a cache is explicitly wanted
+UNCACHED_ENV = {
+    'RESPONSE_CACHE': 'none',
+    'SINGLE_FLIGHT_TIMEOUT': '0',
+}
+
+# Helper function to compute the value at percentile p of sorted samples
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+# Summarize latencies (seconds) measured over a wall-clock duration
+def latency_stats(latencies, duration, errors=0):
+    samples = sorted(latencies)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+        'p95_ms': round(percentile(samples, 95) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None,
+        'max_ms': round(samples[-1] * 1000, 3) if samples else None,
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+    }
+
+# Peak resident set size of a process and its children in MB (Linux only)
+def peak_rss_mb(pid):
+    total_kb = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total_kb += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pids += [int(child) for child in children.read().split()]
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1) if total_kb else None
+
+# Drive a list of paths against an HTTP server with `concurrency` keep-alive
+# connections; returns latency stats for the whole run
+def http_load(base_url, paths, concurrency=1, headers=None):
+    target = urlsplit(base_url)
+    pending = list(reversed(paths))
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def worker():
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        while True:
+            with lock:
+                if not pending:
+                    break
+                path = pending.pop()
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if response.status >= 500:
+                        errors[0] += 1
+                    else:
+                        latencies.append(elapsed)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+                with lock:
+                    errors[0] += 1
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latency_stats(latencies, time.perf_counter() - started, errors[0])
+
+# Wait until an HTTP server answers on path, or fail after timeout seconds
+def wait_for_server(base_url, path='/', timeout=30):
+    target = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port, timeout=2)
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+            return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start within {timeout}s")
+
+# Metadata recorded with every result file so runs can be compared
+def run_metadata(**extra):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    meta = {
+        'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    meta.update(extra)
+    return meta
+
+def save_results(path, results):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print(f"Results saved to {path}")
+
+# Print p95 latency changes of every route against a stored baseline and
+# return the routes that regressed by more than `threshold` (a ratio)
+def compare_with_baseline(results, baseline_path, threshold=0.2):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = []
+    print(f"\nComparison with {baseline_path} (p95 ms)")
+    for size, modes in results['results'].items():
+        for mode, routes in modes.items():
+            base_routes = baseline.get('results', {}).get(size, {}).get(mode, {})
+            for route, stats in routes.items():
+                base = base_routes.get(route)
+                if not base or not base.get('p95_ms') or not stats.get('p95_ms'):
+                    continue
+                change = stats['p95_ms'] / base['p95_ms'] - 1
+                flag = '  REGRESSION' if change > threshold else ''
+                print(f"  {size:>6} {mode:<7} {route:<28} {base['p95_ms']:>10.2f} -> "
+                      f"{stats['p95_ms']:>10.2f} ({change:+.0%}){flag}")
+                if change > threshold:
+                    regressions.append((size, mode, route))
+    return regressions
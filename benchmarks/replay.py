@@ -0,0 +1,215 @@
+# Replay recorded traffic against a running server.
+#
+# Reads werkzeug or gunicorn access logs (such as app.log) or an NDJSON request
+# capture, then re-issues the GET requests against a target while preserving
+# the recorded inter-arrival times, optionally sped up, and reports latency
+# histograms per route.
+#
+#     python benchmarks/replay.py app.log --target http://localhost:5000 --speedup 10
+#     python benchmarks/replay.py capture.ndjson --speedup 0 --concurrency 64 --output replay.json
+from common import latency_stats, run_metadata, save_results
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+import argparse
+import http.client
+import json
+import re
+import sys
+import threading
+import time
+
+# "GET /api/metrics?page=1 HTTP/1.1" 200 -- possibly wrapped in ANSI colours by werkzeug
+REQUEST_LINE = re.compile(r'"(?:\x1b\[[0-9;]*m)*([A-Z]+) (\S+) HTTP/[0-9.]+(?:\x1b\[[0-9;]*m)*" (\d{3})')
+# Leading asctime of the app log format: 2025-04-29 15:50:06,785
+LOG_TIME = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3})')
+# Bracketed access log time: [29/Apr/2025 15:50:06] (werkzeug) or [29/Apr/2025:15:50:06 +0000] (gunicorn)
+ACCESS_TIME = re.compile(r'\[(\d{2}/\w{3}/\d{4})[ :](\d{2}:\d{2}:\d{2})(?: [+-]\d{4})?\]')
+
+# Latency histogram bucket upper bounds in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Helper function to turn a timestamp field of a capture into epoch seconds
+def parse_capture_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+# Parse one access log line into (epoch seconds, method, path, status), or None
+def parse_log_line(line):
+    request = REQUEST_LINE.search(line)
+    if not request:
+        return None
+    method, path, status = request.group(1), request.group(2), int(request.group(3))
+    logged = LOG_TIME.match(line)
+    if logged:
+        moment = datetime.strptime(logged.group(1), "%Y-%m-%d %H:%M:%S").timestamp() + int(logged.group(2)) / 1000
+    else:
+        accessed = ACCESS_TIME.search(line)
+        if not accessed:
+            return None
+        moment = datetime.strptime(f"{accessed.group(1)} {accessed.group(2)}", "%d/%b/%Y %H:%M:%S").timestamp()
+    return moment, method, path, status
+
+# Parse one NDJSON capture record with path (or url), method and timestamp
+def parse_capture_line(line):
+    record = json.loads(line)
+    path = record.get('path') or record.get('url')
+    if not path:
+        return None
+    if '://' in path:
+        parts = urlsplit(path)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+    moment = record.get('timestamp', record.get('time', record.get('ts')))
+    return (parse_capture_time(moment) if moment is not None else None,
+            record.get('method', 'GET').upper(), path, record.get('status'))
+
+# Load a workload as a time-ordered list of (offset seconds, path). Idle gaps
+# longer than max_gap seconds (e.g. between two days of logs) are shortened.
+def load_workload(paths, exclude=None, limit=None, max_gap=60.0):
+    events, skipped = [], 0
+    for source in paths:
+        with open(source, encoding='utf-8', errors='replace') as lines:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = parse_capture_line(line) if line.startswith('{') else parse_log_line(line)
+                except (ValueError, KeyError):
+                    event = None
+                if event is None:
+                    continue
+                moment, method, path, _ = event
+                # Only reads can be replayed: request bodies are not recorded
+                if method != 'GET' or (exclude and re.search(exclude, path)):
+                    skipped += 1
+                    continue
+                events.append((moment, path))
+
+    # Records without a time are replayed back to back after the previous one
+    last = 0.0
+    timed = []
+    for moment, path in events:
+        last = moment if moment is not None else last
+        timed.append((last, path))
+    timed.sort(key=lambda event: event[0])
+    if limit:
+        timed = timed[:limit]
+
+    workload, offset, previous = [], 0.0, None
+    for moment, path in timed:
+        if previous is not None:
+            offset += min(moment - previous, max_gap)
+        previous = moment
+        workload.append((offset, path))
+    return workload, skipped
+
+# Route name used to group results: the path without its query string
+def route_of(path):
+    return urlsplit(path).path
+
+def histogram(latencies):
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for latency in latencies:
+        ms = latency * 1000
+        index = next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))
+        counts[index] += 1
+    labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+    return dict(zip(labels, counts))
+
+# Replay the workload; speedup 0 sends as fast as the concurrency allows
+def replay(workload, target, speedup=1.0, concurrency=16, timeout=60):
+    parts = urlsplit(target)
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, errors, statuses, lag = {}, {}, {}, []
+
+    def connection():
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        return local.connection
+
+    def send(path, due):
+        route = route_of(path)
+        started = time.perf_counter()
+        # How far behind schedule the request starts, e.g. when all workers are busy
+        with lock:
+            lag.append(max(0.0, started - due))
+        try:
+            conn = connection()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.setdefault(route, []).append(elapsed)
+                counts = statuses.setdefault(route, {})
+                counts[str(response.status)] = counts.get(str(response.status), 0) + 1
+        except (OSError, http.client.HTTPException):
+            local.__dict__.pop('connection', None)
+            with lock:
+                errors[route] = errors.get(route, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, path in workload:
+            due = started + offset / speedup if speedup > 0 else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, path, due)
+    duration = time.perf_counter() - started
+
+    routes = {}
+    for route in sorted(set(latencies) | set(errors)):
+        stats = latency_stats(latencies.get(route, []), duration, errors.get(route, 0))
+        stats['statuses'] = statuses.get(route, {})
+        stats['histogram'] = histogram(latencies.get(route, []))
+        routes[route] = stats
+    overall = latency_stats([value for values in latencies.values() for value in values],
+                            duration, sum(errors.values()))
+    overall['max_schedule_lag_ms'] = round(max(lag) * 1000, 3) if lag else 0
+    return {'routes': routes, 'overall': overall, 'duration_s': round(duration, 3)}
+
+def print_report(report):
+    for route, stats in report['routes'].items():
+        print(f"\n{route}  n={stats['requests']} errors={stats['errors']} "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms "
+              f"statuses={stats['statuses']}")
+        peak = max(stats['histogram'].values()) or 1
+        for label, count in stats['histogram'].items():
+            if count:
+                print(f"  {label:>9} {count:>7} {'#' * max(1, round(40 * count / peak))}")
+    overall = report['overall']
+    print(f"\nTotal {overall['requests']} requests in {report['duration_s']}s "
+          f"({overall['throughput_rps']} req/s), {overall['errors']} errors, "
+          f"p95 {overall['p95_ms']}ms, max schedule lag {overall['max_schedule_lag_ms']}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay access logs or request captures against a server")
+    parser.add_argument('sources', nargs='+', help="werkzeug/gunicorn access logs or NDJSON captures")
+    parser.add_argument('--target', default='http://localhost:5000')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help="Time compression factor; 0 replays as fast as possible (default: 1)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Maximum requests in flight")
+    parser.add_argument('--exclude', help="Regex of paths to skip, e.g. '^/static/'")
+    parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+    parser.add_argument('--max-gap', type=float, default=60.0,
+                        help="Shorten idle gaps longer than this many seconds (default: 60)")
+    parser.add_argument('--output', help="Save the report as JSON")
+    args = parser.parse_args()
+
+    workload, skipped = load_workload(args.sources, args.exclude, args.limit, args.max_gap)
+    if not workload:
+        sys.exit("No replayable requests found")
+    span = workload[-1][0]
+    print(f"Replaying {len(workload)} requests recorded over {span:.1f}s "
+          f"({skipped} skipped) against {args.target} at {args.speedup}x")
+
+    report = replay(workload, args.target, args.speedup, args.concurrency)
+    print_report(report)
+    if args.output:
+        report['meta'] = run_metadata(sources=args.sources, target=args.target,
+                                      speedup=args.speedup, concurrency=args.concurrency)
+        save_results(args.output, report)
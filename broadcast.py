@@ -0,0 +1,292 @@
+from bson import ObjectId
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from export import EXPORT_FIELDS, export_row
+from pymongo.errors import OperationFailure, PyMongoError
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Server error codes: change streams on a standalone server, and a resume
+# token that has fallen off the oplog
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+# Sent instead of the dropped events when a client fell too far behind, or
+# when inserts may have been missed; the client reloads over the REST API
+RESYNC_EVENT = 'event: resync\ndata: {}\n\n'
+
+# Helper function to encode an inserted document as one Server-Sent Event,
+# formatted like the rows of the JSON API
+def format_event(collection_name, doc):
+    data = json.dumps(export_row(doc, EXPORT_FIELDS[collection_name]), separators=(',', ':'))
+    return f"event: {collection_name}\ndata: {data}\n\n"
+
+# Bounded buffer of encoded events for one connected client. A client that
+# lets `buffer_size` events pile up loses them and gets a single resync event
+# instead, so a slow reader never holds more than the buffer in memory.
+class Subscription:
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self.overflowed = False
+        self._events = deque()
+        self._ready = threading.Condition()
+
+    # Buffer an event; returns how many events were dropped
+    def push(self, event):
+        with self._ready:
+            if self.overflowed:
+                return 1
+            if len(self._events) >= self.buffer_size:
+                dropped = len(self._events) + 1
+                self._events.clear()
+                self.overflowed = True
+                self._ready.notify()
+                return dropped
+            self._events.append(event)
+            self._ready.notify()
+            return 0
+
+    # Flag that events were missed without waiting for the buffer to fill
+    def resync(self):
+        with self._ready:
+            self._events.clear()
+            self.overflowed = True
+            self._ready.notify()
+
+    # Events buffered since the previous call, waiting up to `timeout` seconds
+    # for one; an empty list on timeout
+    def take(self, timeout):
+        with self._ready:
+            if not self._events and not self.overflowed:
+                self._ready.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                return [RESYNC_EVENT]
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+# Fans out inserts into the watched collections to every connected client.
+# Each process reads a single change stream, started by its first subscriber
+# (and again after a fork), and encodes each event once for all clients. On a
+# standalone server, which has no change streams, it polls for new _ids every
+# `poll_interval` seconds instead (see _poll).
+#
+# With `counters`, the name of the ChangeTracker collection, the stream also
+# carries the writes to the change counters. They follow the inserts they
+# count in the stream, so a listener that has seen version v of a collection
+# has seen every insert made before it.
+class ChangeBroadcaster:
+    def __init__(self, mongo, collections, buffer_size=256, max_clients=4, poll_interval=2, counters=None,
+                 poll_lookback=60):
+        self.mongo = mongo
+        self.collections = collections
+        self.counters = counters
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self.poll_interval = poll_interval
+        self.poll_lookback = poll_lookback
+        self.mode = None
+        self.stats = {'events': 0, 'dropped': 0, 'rejected': 0, 'resyncs': 0}
+        self._subscribers = set()
+        self._listeners = []
+        self._resume_token = None
+        self._opened = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Helper function to claim the reader thread for this process, with the
+    # lock held. True for the first caller of this process, or of a forked
+    # worker, which inherits no threads; that caller starts the thread.
+    def _claim(self):
+        if self._pid == os.getpid():
+            return False
+        self._subscribers = set()
+        self._resume_token = None
+        self._opened = threading.Event()
+        self._pid = os.getpid()
+        return True
+
+    def _start_thread(self):
+        threading.Thread(target=self._run, name='change-broadcaster', daemon=True).start()
+
+    # Register a client; None when this process already serves max_clients
+    # (max_clients=0 disables the stream)
+    def subscribe(self):
+        if self.max_clients <= 0:
+            return None
+        with self._lock:
+            start = self._claim()
+            if len(self._subscribers) >= self.max_clients:
+                self.stats['rejected'] += 1
+                return None
+            subscription = Subscription(self.buffer_size)
+            self._subscribers.add(subscription)
+        if start:
+            self._start_thread()
+        return subscription
+
+    # Register an in-process consumer of the raw inserted documents, such as
+    # the hot window. It is called on the reader thread with
+    # listener.insert(collection_name, doc), listener.changed(collection_name,
+    # version) for each change counter write, and listener.resync() after a gap.
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # Start reading changes in this process without a client. Waits up to
+    # `wait` seconds for the change stream (or the polling baseline) to be
+    # open, after which no insert is missed; returns whether it is open.
+    def start(self, wait=0):
+        with self._lock:
+            start = self._claim()
+        if start:
+            self._start_thread()
+        return self._opened.wait(wait)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def clients(self):
+        return len(self._subscribers)
+
+    def publish(self, collection_name, doc):
+        for listener in self._listeners:
+            listener.insert(collection_name, doc)
+        if not self._subscribers:
+            return
+        event = format_event(collection_name, doc)
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats['events'] += 1
+        dropped = sum(subscription.push(event) for subscription in subscribers)
+        if dropped:
+            with self._lock:
+                self.stats['dropped'] += dropped
+
+    def publish_version(self, collection_name, version):
+        for listener in self._listeners:
+            listener.changed(collection_name, version)
+
+    # Tell every client to reload, after a gap in the events
+    def resync_all(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats['resyncs'] += 1
+        for subscription in subscribers:
+            subscription.resync()
+        for listener in self._listeners:
+            listener.resync()
+
+    def _run(self):
+        delay = 1
+        while True:
+            started = time.monotonic()
+            try:
+                if self.mode == 'poll':
+                    self._poll()
+                else:
+                    self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams need a replica set; polling for new documents instead")
+                    self.mode = 'poll'
+                    continue
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None
+                logger.error(f"Change stream failed: {e}")
+            except PyMongoError as e:
+                logger.error(f"Change stream failed: {e}")
+            except Exception as e:
+                logger.error(f"Change broadcaster stopped unexpectedly: {e}")
+            # Without a resume token, inserts made while reconnecting are lost
+            if self._resume_token is None:
+                self._opened.clear()
+                self.resync_all()
+            # Back off while failing repeatedly, start over after a long healthy run
+            delay = 1 if time.monotonic() - started > 60 else delay
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _watch(self):
+        match = {'operationType': 'insert', 'ns.coll': {'$in': self.collections}}
+        if self.counters:
+            match = {'$or': [match, {'operationType': {'$in': ['insert', 'update', 'replace']},
+                                     'ns.coll': self.counters}]}
+        with self.mongo.db.watch([{'$match': match}], resume_after=self._resume_token) as stream:
+            self.mode = 'change_stream'
+            self._opened.set()
+            for change in stream:
+                self._resume_token = stream.resume_token
+                if change['ns']['coll'] == self.counters:
+                    self._counted(change)
+                else:
+                    self.publish(change['ns']['coll'], change['fullDocument'])
+
+    # Helper function to publish the version set by a change counter write
+    def _counted(self, change):
+        if change['operationType'] == 'update':
+            version = change['updateDescription']['updatedFields'].get('version')
+        else:
+            version = change['fullDocument'].get('version')
+        if version is not None:
+            self.publish_version(change['documentKey']['_id'], version)
+
+    # Helper function to find the lowest _id the poller still checks
+    def _floor(self):
+        return ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.poll_lookback))
+
+    # Helper function to read the newest _id of a collection and the _ids
+    # above `floor`, the starting point of polling and of each resync
+    @staticmethod
+    def _baseline(collection, floor):
+        newest = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        if newest is None:
+            return None, deque()
+        recent = collection.find({'_id': {'$gt': floor, '$lte': newest['_id']}}, {'_id': 1}).sort('_id', 1)
+        return newest['_id'], deque(doc['_id'] for doc in recent)
+
+    # Fallback for standalone servers: new documents by ascending _id. Ids
+    # generated by different processes do not follow insertion order, so an
+    # insert can become visible below the newest _id already sent. Each poll
+    # therefore also counts the documents between the last `poll_lookback`
+    # seconds and the newest sent _id; more than were sent means some were
+    # skipped, and every client is told to resync. So is a poll that fills
+    # a whole page, which means polling has fallen behind.
+    def _poll(self):
+        floor = self._floor()
+        state = {name: self._baseline(self.mongo.db[name], floor) for name in self.collections}
+        self._opened.set()
+        while True:
+            floor = self._floor()
+            for name in self.collections:
+                collection = self.mongo.db[name]
+                last_id, sent = state[name]
+                query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+                docs = list(collection.find(query).sort('_id', 1).limit(self.buffer_size))
+                if len(docs) >= self.buffer_size:
+                    logger.warning(f"Polling fell behind on {name}; clients are told to resync")
+                    state[name] = self._baseline(collection, floor)
+                    self.resync_all()
+                    continue
+                for doc in docs:
+                    sent.append(doc['_id'])
+                    self.publish(name, doc)
+                if docs:
+                    last_id = docs[-1]['_id']
+                while sent and sent[0] <= floor:
+                    sent.popleft()
+                if last_id is not None and \
+                        collection.count_documents({'_id': {'$gt': floor, '$lte': last_id}}) > len(sent):
+                    logger.warning(f"Polling skipped {name} inserted out of _id order; clients are told to resync")
+                    state[name] = self._baseline(collection, floor)
+                    self.resync_all()
+                    continue
+                state[name] = last_id, sent
+            time.sleep(self.poll_interval)
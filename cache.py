@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, request
+from pymongo.errors import PyMongoError
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# In-process LRU backend, private to one worker
+class LRUBackend:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires, _ = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, tags):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl, frozenset(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if tag in entry[2]]:
+                del self._entries[key]
+
+# Backend stored in a MongoDB collection, shared by every gunicorn worker.
+# A TTL index reaps expired entries; reads also check the expiry themselves
+# because the TTL monitor only runs once a minute.
+class MongoBackend:
+    def __init__(self, collection):
+        self.collection = collection
+
+    # Create the TTL and invalidation indexes; run once per process by the app
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self.collection.create_index('tags')
+
+    def get(self, key):
+        entry = self.collection.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+        return (entry['status'], entry['mimetype'], entry['body']) if entry else None
+
+    def set(self, key, value, ttl, tags):
+        status, mimetype, body = value
+        self.collection.replace_one({'_id': key}, {
+            'status': status,
+            'mimetype': mimetype,
+            'body': body,
+            'tags': list(tags),
+            'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+        }, upsert=True)
+
+    def invalidate(self, tag):
+        self.collection.delete_many({'tags': tag})
+
+# Response cache for read endpoints, keyed by route plus normalized query args,
+# or by key_func() when given (such as ChangeTracker.key, which adds the
+# collection versions)
+class ResponseCache:
+    def __init__(self, backend=None, key_func=None):
+        self.backend = backend
+        self.key_func = key_func or self.key
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    # Helper function to build a key that ignores query argument order
+    @staticmethod
+    def key():
+        args = sorted(request.args.items(multi=True))
+        return f"{request.path}?{urlencode(args)}"
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self.stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+            counters[outcome] += 1
+
+    # Decorator caching successful responses of a view for ttl seconds.
+    # Tags name the collections the response depends on.
+    def cached(self, endpoint, ttl, tags):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or ttl <= 0:
+                    return view(*args, **kwargs)
+
+                key = self.key_func()
+                try:
+                    entry = self.backend.get(key)
+                except PyMongoError as e:
+                    logger.warning(f"Response cache read failed: {e}")
+                    entry = None
+                if entry is not None:
+                    self._count(endpoint, 'hits')
+                    status, mimetype, body = entry
+                    response = Response(body, status=status, mimetype=mimetype)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self._count(endpoint, 'misses')
+                response = view(*args, **kwargs)
+                if (isinstance(response, Response) and response.status_code == 200
+                        and not response.cache_control.no_store):
+                    try:
+                        self.backend.set(key, (response.status_code, response.mimetype, response.get_data()), ttl, tags)
+                    except PyMongoError as e:
+                        logger.warning(f"Response cache write failed: {e}")
+                    response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    # Drop every cached response depending on a collection
+    def invalidate(self, tag):
+        if self.backend is not None:
+            self.backend.invalidate(tag)
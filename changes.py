@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, g, request
+import hashlib
+import time
+
+# Per-collection change counters stored in MongoDB. Every writer bumps the
+# counter of the collections it modifies, and HTTP validators (ETag and
+# Last-Modified) are derived from the counters instead of the response body,
+# so a conditional GET can be answered before running the expensive query.
+class ChangeTracker:
+    def __init__(self, collection):
+        self.collection = collection
+
+    # Record a write to a collection
+    def bump(self, name):
+        self.collection.update_one(
+            {'_id': name},
+            {'$inc': {'version': 1}, '$currentDate': {'updated_at': True}},
+            upsert=True
+        )
+
+    # Make sure every tracked collection has a counter so Last-Modified is defined
+    def init(self, names):
+        for name in names:
+            self.collection.update_one(
+                {'_id': name},
+                {'$setOnInsert': {'version': 0, 'updated_at': datetime.utcnow()}},
+                upsert=True
+            )
+
+    # Current (version, updated_at) of the given collections in one query
+    def versions(self, names):
+        found = {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': list(names)}})}
+        return [(found.get(name, {}).get('version', 0), found.get(name, {}).get('updated_at')) for name in names]
+
+    # Version of a collection read by conditional() for the current request.
+    # A body served from a cache or an in-memory copy must be at least this
+    # recent, since the validators are derived from it. None outside a
+    # conditional view.
+    @staticmethod
+    def current(name):
+        return g.get('change_versions', {}).get(name)
+
+    # Key of the current request for the response cache and coalescing: path,
+    # normalized arguments and the versions and time window read by
+    # conditional(), so a body computed before a write is never served under
+    # the validators of a later version
+    @staticmethod
+    def key():
+        return g.change_key
+
+    # Decorator adding strong ETag/Last-Modified validators to a JSON view and
+    # answering matching If-None-Match/If-Modified-Since requests with 304.
+    # Responses that also depend on the clock (sliding windows) pass window,
+    # in seconds, so validators change at least that often.
+    def conditional(self, tags, window=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                versions = self.versions(tags)
+                state = f"{request.path}?{urlencode(sorted(request.args.items(multi=True)))}|{versions}"
+                if window:
+                    state += f"|{int(time.time() // window)}"
+                g.change_key = state
+                g.change_versions = {name: version for name, (version, _) in zip(tags, versions)}
+                etag = hashlib.sha1(state.encode()).hexdigest()
+
+                updated = [updated_at for _, updated_at in versions if updated_at is not None]
+                last_modified = max(updated).replace(tzinfo=timezone.utc, microsecond=0) if updated else None
+
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains(etag)
+                else:
+                    not_modified = (window is None and last_modified is not None
+                                    and request.if_modified_since is not None
+                                    and last_modified <= request.if_modified_since)
+                if not_modified:
+                    response = Response(status=304)
+                else:
+                    response = view(*args, **kwargs)
+                    # Responses marked no-store (such as partial results) get no validators
+                    if (not isinstance(response, Response) or response.status_code != 200
+                            or response.cache_control.no_store):
+                        return response
+
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                # Let browsers keep the body but revalidate on every use
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            return wrapper
+        return decorator
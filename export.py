@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+# Export formats: format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Export columns per collection, in CSV column order
+EXPORT_FIELDS = {
+    'metrics': ['timestamp', 'host', 'uptime', 'users_connected', 'activity'],
+    'notifications': ['timestamp', 'event_type', 'description'],
+}
+
+# Helper function to format a document the same way the JSON API does
+def export_row(doc, fields):
+    row = {field: doc.get(field) for field in fields}
+    row['timestamp'] = doc['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+    return row
+
+# Serialize documents from a server-side cursor as NDJSON or CSV. Rows are
+# buffered into chunks of chunk_size lines so the WSGI server is not handed one
+# tiny write per document; memory stays bounded by the chunk and cursor batch.
+def stream_documents(cursor, fields, fmt, chunk_size=1000):
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(row, separators=(',', ':')))
+            buffer.write('\n')
+
+    pending = 0
+    for doc in cursor:
+        write(export_row(doc, fields))
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
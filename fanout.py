@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+# Runs independent blocking calls, such as the MongoDB queries behind one
+# request, side by side on a bounded thread pool shared by the whole process,
+# so the request takes as long as its slowest query instead of their sum.
+# The pool is created on first use, and again in a forked worker, which
+# inherits no threads. With max_workers=1 calls run one after the other in the
+# calling thread.
+class FanOut:
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fanout')
+                    self._pid = os.getpid()
+        return self._executor
+
+    # Run calls (name -> function) concurrently. Returns the results and the
+    # exceptions of the calls that failed, both keyed by name.
+    def run(self, calls):
+        results, errors = {}, {}
+        if self.max_workers <= 1:
+            for name, fn in calls.items():
+                try:
+                    results[name] = fn()
+                except Exception as e:
+                    errors[name] = e
+            return results, errors
+
+        futures = {name: self.executor().submit(fn) for name, fn in calls.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+        return results, errors
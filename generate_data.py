@@ -1,12 +1,14 @@
 from pymongo import MongoClient
 from datetime import datetime, timedelta
+from multiprocessing import Pool
+from cache import MongoBackend
+from changes import ChangeTracker
+from indexes import ensure_indexes
+from rollups import ROLLUPS, backfill
+import argparse
+import os
 import random
-
-# Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
-db = client.monitoring_app
-metrics_collection = db.metrics
-notifications_collection = db.notifications
+import time
 
 # Semplici descrizioni senza Faker
 descriptions = [
@@ -17,56 +19,154 @@ descriptions = [
     "Login attempt from unrecognized device."
 ]
 
-def generate_data(days=90):
-    start_date = datetime.now() - timedelta(days=days)
-    current_date = start_date
-    
-    print(f"Generating {days} days of data...")
+# Size of the time slices handed to the workers; each slice has its own
+# random stream so the output only depends on --seed, not on --workers
+CHUNK = timedelta(days=1)
+
+# Helper function to parse intervals such as 30s, 1m, 1h, 1d or plain seconds
+def parse_interval(value):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip().lower()
+    number, unit = (value[:-1], value[-1]) if value[-1:] in units else (value, 's')
+    try:
+        seconds = int(number) * units[unit]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid interval {value!r}; use e.g. 30s, 1m, 1h, 1d or seconds")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("interval must be positive")
+    return timedelta(seconds=seconds)
+
+# Generate the metrics and notifications of one time slice in memory
+def generate_chunk(chunk_index, chunk_start, chunk_end, interval, hosts, seed):
+    rng = random.Random(f"{seed}-{chunk_index}")
+    metrics, notifications = [], []
+    current = chunk_start
+    while current < chunk_end:
+        for host in range(hosts):
+            # Random time within the interval, like the original one-per-day data
+            timestamp = current + timedelta(seconds=rng.randrange(int(interval.total_seconds())))
+            activity = "Suspicious" if rng.random() < 0.1 else "Normal"
+            metrics.append({
+                "timestamp": timestamp,
+                "host": f"host-{host + 1:02d}",
+                "uptime": round(rng.uniform(90.0, 100.0), 2),
+                "users_connected": rng.randint(5, 50),
+                "activity": activity
+            })
+            # Create notification if suspicious
+            if activity == "Suspicious":
+                notifications.append({
+                    "timestamp": timestamp,
+                    "event_type": "Unauthorized Access Attempt",
+                    "description": rng.choice(descriptions)
+                })
+        current += interval
+    return metrics, notifications
+
+# Helper function to insert documents in batches of batch_size
+def insert_batches(collection, docs, batch_size):
+    for i in range(0, len(docs), batch_size):
+        collection.insert_many(docs[i:i + batch_size], ordered=False)
+
+# Worker state: one MongoClient per process, created after fork
+worker_db = None
+
+def init_worker(connection, db_name):
+    global worker_db
+    worker_db = MongoClient(connection)[db_name]
+
+# Generate and insert one time slice; returns the number of documents written
+def write_chunk(task):
+    chunk_index, chunk_start, chunk_end, interval, hosts, seed, batch_size = task
+    metrics, notifications = generate_chunk(chunk_index, chunk_start, chunk_end, interval, hosts, seed)
+    insert_batches(worker_db.metrics, metrics, batch_size)
+    insert_batches(worker_db.notifications, notifications, batch_size)
+    return len(metrics), len(notifications)
+
+def generate_data(db, connection, days=90, interval=timedelta(days=1), hosts=1,
+                  batch_size=10000, workers=1, seed=None, end=None):
+    end = end or datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    # Chunk boundaries follow the interval so slots never overlap between chunks
+    step = max(interval, CHUNK // interval * interval)
+    tasks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + step, end)
+        tasks.append((len(tasks), chunk_start, chunk_end, interval, hosts, seed, batch_size))
+        chunk_start = chunk_end
+
+    print(f"Generating {days} days of data every {interval} for {hosts} host(s) "
+          f"with {workers} worker(s), seed {seed}...")
     metrics_count = 0
     notifications_count = 0
+    started = time.monotonic()
+    last_report = started
 
-    while current_date <= datetime.now():
-        # Generate simplified random data
-        uptime = random.uniform(90.0, 100.0)
-        uptime = round(uptime, 2)
-        users = random.randint(5, 50)
-        activity = "Suspicious" if random.random() < 0.1 else "Normal"
-        
-        # Create timestamp with random time
-        hour = random.randint(0, 23)
-        minute = random.randint(0, 59)
-        timestamp = current_date.replace(hour=hour, minute=minute)
-        
-        # Insert metrics
-        metrics_data = {
-            "timestamp": timestamp,
-            "uptime": uptime,
-            "users_connected": users,
-            "activity": activity
-        }
-        
-        metrics_collection.insert_one(metrics_data)
-        metrics_count += 1
-        
-        # Create notification if suspicious
-        if activity == "Suspicious":
-            notification_data = {
-                "timestamp": timestamp,
-                "event_type": "Unauthorized Access Attempt",
-                "description": random.choice(descriptions)
-            }
-            notifications_collection.insert_one(notification_data)
-            notifications_count += 1
-            
-        current_date += timedelta(days=1)
-    
-    print(f"Successfully generated {metrics_count} metrics and {notifications_count} notifications")
+    with Pool(workers, initializer=init_worker, initargs=(connection, db.name)) as pool:
+        for metrics_written, notifications_written in pool.imap_unordered(write_chunk, tasks):
+            metrics_count += metrics_written
+            notifications_count += notifications_written
+            now = time.monotonic()
+            if now - last_report >= 1:
+                rate = (metrics_count + notifications_count) / (now - started)
+                print(f"  {metrics_count} metrics, {notifications_count} notifications ({rate:,.0f} docs/sec)")
+                last_report = now
+
+    elapsed = time.monotonic() - started
+    rate = (metrics_count + notifications_count) / elapsed if elapsed else 0
+    print(f"Successfully generated {metrics_count} metrics and {notifications_count} notifications "
+          f"in {elapsed:.1f}s ({rate:,.0f} docs/sec)")
+
+    # Rebuild the rollups for the generated range server side
+    backfill(db, start, end + timedelta(seconds=1))
+
+    # Let app workers know the collections changed so validators and the
+    # shared cache backend no longer serve the previous data
+    tracker = ChangeTracker(db.change_counters)
+    tracker.bump('metrics')
+    tracker.bump('notifications')
+    shared_cache = MongoBackend(db.response_cache)
+    shared_cache.invalidate('metrics')
+    shared_cache.invalidate('notifications')
+
+    return metrics_count, notifications_count
 
 if __name__ == "__main__":
-    # Clear existing data
-    metrics_collection.delete_many({})
-    notifications_collection.delete_many({})
-    print("Collections cleared")
-    
+    parser = argparse.ArgumentParser(description="Generate test metrics and notifications")
+    parser.add_argument('--days', type=int, default=90, help="Number of days of history (default: 90)")
+    parser.add_argument('--interval', type=parse_interval, default=timedelta(days=1),
+                        help="Time between metrics per host: e.g. 30s, 1m, 1h, 1d (default: 1d)")
+    parser.add_argument('--hosts', type=int, default=1, help="Number of hosts reporting metrics (default: 1)")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Documents per insert_many (default: 10000)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Parallel worker processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible data")
+    parser.add_argument('--end', type=lambda value: datetime.strptime(value, "%Y-%m-%d"),
+                        help="Generate data up to this date, YYYY-MM-DD (default: now)")
+    parser.add_argument('--reset', action='store_true', help="Clear existing data first")
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--db', default=os.getenv("DB_NAME", "monitoring_app"))
+    args = parser.parse_args()
+
+    # Connect to MongoDB
+    client = MongoClient(args.connection)
+    db = client[args.db]
+
+    if args.reset:
+        # Clear existing data
+        db.metrics.delete_many({})
+        db.notifications.delete_many({})
+        for collection_name, _, _ in ROLLUPS.values():
+            db[collection_name].delete_many({})
+        print("Collections cleared")
+
+    # Indexes are created before loading so the app can start on the data immediately
+    ensure_indexes(db)
+
     # Generate new data
-    generate_data(90)
\ No newline at end of file
+    generate_data(db, args.connection, days=args.days, interval=args.interval, hosts=args.hosts,
+                  batch_size=args.batch_size, workers=args.workers, seed=args.seed, end=args.end)
@@ -0,0 +1,95 @@
+# Gunicorn settings for production, picked up automatically from the working
+# directory:
+#
+#     gunicorn                                   # gthread workers, see below
+#     GUNICORN_WORKER_CLASS=gevent gunicorn      # cooperative workers
+#
+# Every setting can be overridden from the environment or the command line.
+from gunicorn.glogging import Logger
+import multiprocessing
+import os
+
+# The module-level app of app.py, built by create_app() on import
+wsgi_app = os.getenv("GUNICORN_APP", "app:app")
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}")
+
+# Requests mostly wait on MongoDB, so each worker runs several threads. One
+# worker per core keeps the per-worker caches and connection pools few and warm;
+# the threads absorb the I/O wait.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# gevent workers serve many requests per worker on greenlets (pip install gevent);
+# worker_connections bounds the greenlets per worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Import the app once in the master so workers fork ready to serve. This is
+# safe because importing the app does no I/O: each worker connects to MongoDB
+# after the fork. gevent patches the standard library in each worker, which
+# must happen before the app is imported, so preloading is off for it.
+preload_app = os.getenv("GUNICORN_PRELOAD", str(worker_class != 'gevent')).lower() == 'true'
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers periodically, with jitter so they do not restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+# "-" enables the access log; set to an empty value to disable it. Lines go
+# through the app's background logging pipeline (see logconfig.py), where
+# ACCESS_LOG_SAMPLE can thin out successful requests.
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+
+# The master and every worker log from their own process, so they must not
+# share one rotating log file. Without LOG_FILE the log goes to the console
+# only (stderr, which gunicorn and Docker collect); a LOG_FILE without {pid} or
+# {worker} gets {worker}, giving the master and each worker slot its own file
+# such as app.master.log and app.0.log. Slots are reused when max_requests
+# recycles a worker, so the number of files stays bounded, unlike with {pid}.
+log_file = os.getenv("LOG_FILE")
+if log_file is None:
+    os.environ['LOG_FILE'] = ''
+elif log_file and '{pid}' not in log_file and '{worker}' not in log_file:
+    name, extension = os.path.splitext(log_file)
+    os.environ['LOG_FILE'] = f"{name}.{{worker}}{extension}"
+os.environ['LOG_WORKER'] = 'master'
+
+# Give each new worker the lowest slot no live worker holds; runs in the master
+def pre_fork(server, worker):
+    taken = {getattr(sibling, 'log_slot', None) for sibling in server.WORKERS.values()}
+    worker.log_slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+# Runs in the worker before it logs through the app's pipeline
+def post_fork(server, worker):
+    os.environ['LOG_WORKER'] = str(worker.log_slot)
+
+class PipelineLogger(Logger):
+    def setup(self, cfg):
+        super().setup(cfg)
+        if cfg.accesslog:
+            from logconfig import attach
+            attach(self.access_log)
+
+logger_class = PipelineLogger
+
+# Connect each new worker to MongoDB and start its health checks before it
+# accepts requests, so the first request does not pay for it. If MongoDB is
+# unreachable the worker still starts and connects on its first request instead.
+def post_worker_init(worker):
+    from pymongo.errors import PyMongoError
+    from app import health_monitor, mongo
+    try:
+        mongo.client
+    except PyMongoError as e:
+        worker.log.warning(f"MongoDB not reachable at worker start: {e}")
+    health_monitor.current()
+
+# With PROMETHEUS_MULTIPROC_DIR set, /metrics aggregates the series of every
+# worker; the files of exited workers must be marked dead
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -0,0 +1,74 @@
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Background health checker. A daemon thread pings MongoDB and reads its
+# uptime and the estimated collection sizes every `interval` seconds, so health
+# and readiness probes are answered from memory however often they are polled.
+# Each process runs its own thread, started on first use (and again after a fork).
+class HealthMonitor:
+    def __init__(self, mongo, collections, interval=10, max_age=None):
+        self.mongo = mongo
+        self.collections = collections
+        self.interval = interval
+        # A snapshot older than this means the refresher is stuck
+        self.max_age = max_age or 3 * interval
+        self._snapshot = None
+        self._refreshed = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Run one check and store its result
+    def refresh(self):
+        started = time.perf_counter()
+        snapshot = {'checked_at': time.time()}
+        try:
+            self.mongo.client.admin.command('ping')
+            snapshot['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            snapshot['db_uptime_seconds'] = self.mongo.db.command('serverStatus')['uptime']
+            # Collection metadata, not a scan: cheap however large the collection
+            snapshot['counts'] = {name: self.mongo.db[name].estimated_document_count()
+                                  for name in self.collections}
+            snapshot['ok'] = True
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+            snapshot['ok'] = False
+            snapshot['error'] = str(e)
+        self._snapshot = snapshot
+        self._refreshed.set()
+        return snapshot
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._snapshot = None
+                    self._refreshed = threading.Event()
+                    threading.Thread(target=self._run, name='health-refresher', daemon=True).start()
+                    self._pid = os.getpid()
+
+    # Latest snapshot, waiting up to `wait` seconds for the first one; None if
+    # no check has completed yet
+    def current(self, wait=0):
+        self._ensure_started()
+        if wait:
+            self._refreshed.wait(wait)
+        return self._snapshot
+
+    # Whether the latest snapshot is recent and MongoDB answered the ping
+    def ready(self, snapshot):
+        return (snapshot is not None and snapshot['ok']
+                and time.time() - snapshot['checked_at'] <= self.max_age)
+
+    @staticmethod
+    def format_time(snapshot):
+        return datetime.fromtimestamp(snapshot['checked_at']).strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,561 @@
+from bson import ObjectId
+from datetime import datetime, timedelta
+from queries import PAGE_SORT
+from sketches import LN_GAMMA, MIN_VALUE, ZERO_KEY
+import logging
+import os
+import re
+import threading
+import time
+
+# NumPy is optional; without it the hot window is unavailable and every read
+# goes to MongoDB
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Per-process in-memory copy of the most recent metrics, kept as sorted
+# columnar arrays: epoch milliseconds, the two halves of the ObjectId, uptime,
+# connected users and dictionary-encoded activity and host. Pages and summaries
+# of recent windows are answered with searchsorted and vectorized reductions
+# instead of MongoDB queries and BSON decoding.
+#
+# The window is loaded in the background on first use, and kept current from
+# the inserts of this process and from the change broadcaster, which sees the
+# inserts of every process. That needs a change stream: when the broadcaster
+# polls (standalone server) the window is disabled, since polling can lag or
+# resync and other processes' inserts would be missing for a whole reload. All metrics with a timestamp at or after
+# `coverage` are held, so a query is answered only when its result cannot
+# depend on older metrics; anything else returns None and goes to MongoDB.
+# The window also tracks the change counter version of the metrics it holds
+# (from `tracker` on load, then from the broadcaster), and callers skip it
+# for requests whose validators name a later version (see caught_up).
+# Old metrics are evicted by age, and the oldest ones beyond the memory budget.
+
+EPOCH = datetime(1970, 1, 1)
+
+# Fields of a metric document the window can hold
+FIELDS = {'_id', 'timestamp', 'uptime', 'users_connected', 'activity', 'host'}
+
+# Bytes per metric: timestamp, ObjectId, uptime, users, activity and host
+ROW_BYTES = 8 + 4 + 8 + 8 + 4 + 1 + 2
+COLUMNS = ('ts', 'id_hi', 'id_lo', 'uptime', 'users', 'activity', 'host')
+NO_HOST = -1
+
+# Pending inserts merged into the arrays without waiting for a read
+MERGE_BATCH = 4096
+# Documents decoded per chunk while loading
+LOAD_CHUNK = 50000
+# Seconds a load waits for the change stream to open
+OPEN_TIMEOUT = 10
+
+# Raised for documents the window cannot represent; the window is disabled
+class Unsupported(Exception):
+    pass
+
+# Helper function to convert a datetime to epoch milliseconds, truncated the
+# way BSON stores it
+def to_millis(timestamp):
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+# Helper function to split an ObjectId into its big-endian high and low parts,
+# which compare in the same order as the ObjectId
+def split_id(oid):
+    if not isinstance(oid, ObjectId):
+        raise Unsupported(f"_id of type {type(oid).__name__}")
+    binary = oid.binary
+    return int.from_bytes(binary[:4], 'big'), int.from_bytes(binary[4:], 'big')
+
+# Helper function to compare a column with a value for a query operator
+def compare(column, op, value):
+    if op == '$gte':
+        return column >= value
+    if op == '$gt':
+        return column > value
+    if op == '$lte':
+        return column <= value
+    if op == '$lt':
+        return column < value
+    raise Unsupported(f"operator {op}")
+
+class HotWindow:
+    def __init__(self, mongo, broadcaster, days=30, max_bytes=64 * 1024 * 1024, reload_interval=3600, tracker=None):
+        self.mongo = mongo
+        self.broadcaster = broadcaster
+        self.tracker = tracker
+        self.days = days
+        self.max_rows = max(max_bytes // ROW_BYTES, 1)
+        self.reload_interval = reload_interval
+        self.state = None
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'evicted': 0}
+        self._cols = None
+        self._coverage = None
+        self._version = None
+        self._pending = []
+        self._backlog = None
+        self._loading = False
+        self._gap = False
+        self._loaded_at = 0
+        self._activities, self._activity_codes = [], {}
+        self._hosts, self._host_codes = [], {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._codes_lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    # Listener interface of the change broadcaster
+    def insert(self, collection_name, doc):
+        if collection_name == 'metrics':
+            self.append([doc])
+
+    def changed(self, collection_name, version):
+        if collection_name == 'metrics':
+            with self._lock:
+                if self._version is None or version > self._version:
+                    self._version = version
+
+    # Whether every insert counted up to this metrics change version has
+    # reached the window; None (no version read for the request) always is
+    def caught_up(self, version):
+        return version is None or (self._version is not None and self._version >= version)
+
+    # Inserts were missed: stop answering until reloaded
+    def resync(self):
+        with self._lock:
+            self._gap = True
+            if self.state == 'ready':
+                self.state = 'stale'
+
+    # Add metrics written by this process; duplicates of documents also
+    # delivered by the broadcaster are dropped when merging
+    def append(self, docs):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            # Kept for the load in progress, if any
+            if self._backlog is not None:
+                self._backlog.extend(docs)
+            if self.state == 'ready':
+                self._pending.extend(docs)
+                if len(self._pending) >= MERGE_BATCH:
+                    self._merge()
+
+    # Encode metric documents into columns, sorted by (timestamp, _id)
+    def _encode(self, docs):
+        try:
+            return self._sorted(self._columns(docs))
+        except (KeyError, TypeError, ValueError) as e:
+            raise Unsupported(f"document ({e!r})")
+
+    def _columns(self, docs):
+        columns = {name: [] for name in COLUMNS}
+        for doc in docs:
+            extra = doc.keys() - FIELDS
+            if extra:
+                raise Unsupported(f"field(s) {', '.join(sorted(extra))}")
+            id_hi, id_lo = split_id(doc['_id'])
+            users = doc['users_connected']
+            if not isinstance(users, int) or not 0 <= users < 2 ** 31:
+                raise Unsupported(f"users_connected {users!r}")
+            columns['ts'].append(to_millis(doc['timestamp']))
+            columns['id_hi'].append(id_hi)
+            columns['id_lo'].append(id_lo)
+            columns['uptime'].append(doc['uptime'])
+            columns['users'].append(users)
+            columns['activity'].append(self._code(doc['activity'], self._activities, self._activity_codes, 255))
+            host = doc.get('host')
+            columns['host'].append(NO_HOST if host is None else self._code(host, self._hosts, self._host_codes, 32767))
+        return {
+            'ts': np.array(columns['ts'], dtype=np.int64),
+            'id_hi': np.array(columns['id_hi'], dtype=np.uint32),
+            'id_lo': np.array(columns['id_lo'], dtype=np.uint64),
+            'uptime': np.array(columns['uptime'], dtype=np.float64),
+            'users': np.array(columns['users'], dtype=np.int32),
+            'activity': np.array(columns['activity'], dtype=np.uint8),
+            'host': np.array(columns['host'], dtype=np.int16),
+        }
+
+    # Helper function to dictionary-encode a string value. Codes are only
+    # ever added, so lookups need no lock.
+    def _code(self, value, values, codes, limit):
+        code = codes.get(value)
+        if code is None:
+            with self._codes_lock:
+                code = codes.get(value)
+                if code is None:
+                    if not isinstance(value, str) or len(values) >= limit:
+                        raise Unsupported(f"value {value!r}")
+                    values.append(value)
+                    code = codes[value] = len(values) - 1
+        return code
+
+    # Sort columns by (timestamp, _id) and drop repeated documents
+    @staticmethod
+    def _sorted(cols):
+        order = np.lexsort((cols['id_lo'], cols['id_hi'], cols['ts']))
+        cols = {name: column[order] for name, column in cols.items()}
+        keep = np.ones(len(cols['ts']), dtype=bool)
+        keep[1:] = ((cols['ts'][1:] != cols['ts'][:-1])
+                    | (cols['id_hi'][1:] != cols['id_hi'][:-1])
+                    | (cols['id_lo'][1:] != cols['id_lo'][:-1]))
+        if keep.all():
+            return cols
+        return {name: column[keep] for name, column in cols.items()}
+
+    # Merge encoded rows into sorted columns. Only the suffix from the oldest
+    # new row on is re-sorted, which is short for recent inserts.
+    def _combine(self, cols, new):
+        new_ts = new['ts']
+        if not len(new_ts):
+            return cols
+        start = int(np.searchsorted(cols['ts'], new_ts[0], 'left'))
+        if start == len(cols['ts']):
+            return {name: np.concatenate((cols[name], new[name])) for name in COLUMNS}
+        suffix = self._sorted({name: np.concatenate((cols[name][start:], new[name])) for name in COLUMNS})
+        return {name: np.concatenate((cols[name][:start], suffix[name])) for name in COLUMNS}
+
+    # Fold pending inserts into the arrays and evict by age and size; with
+    # the lock held
+    def _merge(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            try:
+                new = self._encode(pending)
+            except Unsupported as e:
+                self._disable(e)
+                return
+            # Metrics older than the window are not kept
+            new = {name: column[new['ts'] >= self._coverage] for name, column in new.items()}
+            self._cols = self._combine(self._cols, new)
+        self._evict()
+
+    def _evict(self):
+        ts = self._cols['ts']
+        # By age, in steps of a hundredth of the window to avoid copying the
+        # arrays on every read
+        cutoff = to_millis(datetime.now() - timedelta(days=self.days))
+        if cutoff - self._coverage > self.days * 864000:
+            self._coverage = cutoff
+        # By size, keeping every metric from the new coverage on
+        if len(ts) > self.max_rows:
+            self._coverage = max(self._coverage, int(ts[len(ts) - self.max_rows - 1]) + 1)
+        start = int(np.searchsorted(ts, self._coverage, 'left'))
+        if start:
+            self._cols = {name: column[start:].copy() for name, column in self._cols.items()}
+            self.stats['evicted'] += start
+
+    def _disable(self, reason):
+        logger.warning(f"Hot window disabled, serving metrics from MongoDB: unsupported {reason}")
+        self.state = 'disabled'
+        self._cols = None
+        self._pending = []
+        self._backlog = None
+
+    # Load the window from MongoDB, newest first up to the memory budget, then
+    # fold in the inserts that arrived meanwhile
+    def _load(self):
+        try:
+            if not self.broadcaster.start(wait=OPEN_TIMEOUT):
+                logger.warning("Hot window not loaded: the change stream did not open")
+                return
+            if self.broadcaster.mode != 'change_stream':
+                logger.warning("Hot window disabled, serving metrics from MongoDB: no change stream")
+                with self._lock:
+                    self.state = 'disabled'
+                    self._backlog = None
+                return
+            # Read after the stream opened and before the documents, which
+            # are then at least this recent
+            if self.tracker is not None:
+                self.changed('metrics', self.tracker.versions(['metrics'])[0][0])
+            with self._lock:
+                self._backlog = []
+                self._gap = False
+            start = datetime.now() - timedelta(days=self.days)
+            cursor = self.mongo.db.metrics.find({'timestamp': {'$gte': start}}) \
+                .sort(PAGE_SORT).limit(self.max_rows).batch_size(LOAD_CHUNK)
+            chunks, chunk = [], []
+            for doc in cursor:
+                chunk.append(doc)
+                if len(chunk) >= LOAD_CHUNK:
+                    chunks.append(self._encode(chunk))
+                    chunk = []
+            chunks.append(self._encode(chunk))
+            cols = self._sorted({name: np.concatenate([c[name] for c in chunks]) for name in COLUMNS})
+            rows = len(cols['ts'])
+            # A full load may have stopped inside a millisecond; start after it
+            coverage = int(cols['ts'][0]) + 1 if rows >= self.max_rows else to_millis(start)
+
+            with self._lock:
+                backlog, self._backlog = self._backlog, None
+                # Inserts may have been missed while loading; load again
+                if self._gap:
+                    logger.warning("Hot window load interrupted by a gap in the change stream")
+                    return
+                self._cols, self._coverage = cols, coverage
+                self._pending = backlog
+                self.state = 'ready'
+                self._loaded_at = time.monotonic()
+                self.stats['loads'] += 1
+                self._merge()
+            logger.info(f"Hot window loaded {rows} metrics (pid {os.getpid()})")
+        except Unsupported as e:
+            with self._lock:
+                self._disable(e)
+        except Exception as e:
+            logger.error(f"Hot window load failed: {e}")
+            with self._lock:
+                self._backlog = None
+        finally:
+            with self._lock:
+                self._loading = False
+
+    # Current arrays and coverage, or None when the window cannot answer yet.
+    # Starts a background load when the window is missing or due for reload.
+    def _snapshot(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.state, self._cols, self._pending, self._backlog = 'loading', None, [], None
+                self._version = None
+                self._loading = False
+            if self.state == 'disabled':
+                return None
+            due = self.state != 'ready' or time.monotonic() - self._loaded_at > self.reload_interval
+            if due and not self._loading:
+                self._loading = True
+                threading.Thread(target=self._load, name='hot-window-load', daemon=True).start()
+            if self.state != 'ready':
+                return None
+            self._merge()
+            if self.state != 'ready':
+                return None
+            return self._cols, self._coverage
+
+    # Row mask of a query over the columns. Supports the filters built in
+    # queries.py: timestamp ranges, activity keywords and keyset cursors.
+    def _mask(self, cols, query):
+        mask = np.ones(len(cols['ts']), dtype=bool)
+        for field, condition in query.items():
+            if field == '$and':
+                for part in condition:
+                    mask &= self._mask(cols, part)
+            elif field == '$or':
+                matched = np.zeros(len(mask), dtype=bool)
+                for part in condition:
+                    matched |= self._mask(cols, part)
+                mask &= matched
+            elif field == 'timestamp':
+                if isinstance(condition, dict):
+                    for op, value in condition.items():
+                        mask &= compare(cols['ts'], op, to_millis(value))
+                else:
+                    mask &= cols['ts'] == to_millis(condition)
+            elif field == '_id':
+                mask &= self._id_mask(cols, condition)
+            elif field == 'activity':
+                mask &= np.isin(cols['activity'], self._activity_matches(condition))
+            else:
+                raise Unsupported(f"filter on {field}")
+        return mask
+
+    @staticmethod
+    def _id_mask(cols, condition):
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        mask = np.ones(len(cols['ts']), dtype=bool)
+        for op, value in condition.items():
+            hi, lo = split_id(value)
+            same = cols['id_hi'] == hi
+            if op == '$eq':
+                mask &= same & (cols['id_lo'] == lo)
+            else:
+                mask &= compare(cols['id_hi'], op.rstrip('e'), hi) | (same & compare(cols['id_lo'], op, lo))
+        return mask
+
+    # Helper function to find the activity codes a condition matches
+    def _activity_matches(self, condition):
+        if isinstance(condition, str):
+            return [code for code, value in enumerate(self._activities) if value == condition]
+        if set(condition) - {'$regex', '$options'}:
+            raise Unsupported(f"activity filter {condition}")
+        flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+        try:
+            pattern = re.compile(condition['$regex'], flags)
+        except re.error as e:
+            raise Unsupported(f"regex ({e})")
+        return [code for code, value in enumerate(self._activities) if pattern.search(value)]
+
+    # Helper function to find the lowest timestamp (in ms) a query can match
+    @staticmethod
+    def _lower_bound(query):
+        bound = None
+        for field, condition in query.items():
+            if field == '$and':
+                bounds = [HotWindow._lower_bound(part) for part in condition]
+            elif field == '$or':
+                bounds = [HotWindow._lower_bound(part) for part in condition]
+                bounds = [None] if None in bounds else [min(bounds)]
+            elif field == 'timestamp' and isinstance(condition, dict):
+                bounds = [to_millis(value) + (op == '$gt') for op, value in condition.items() if op in ('$gte', '$gt')]
+            elif field == 'timestamp':
+                bounds = [to_millis(condition)]
+            else:
+                continue
+            for value in bounds:
+                if value is not None and (bound is None or value > bound):
+                    bound = value
+        return bound
+
+    # Helper function to find the highest timestamp (in ms) a query can match
+    @staticmethod
+    def _upper_bound(query):
+        bound = None
+        for field, condition in query.items():
+            if field == '$and':
+                bounds = [HotWindow._upper_bound(part) for part in condition]
+            elif field == 'timestamp' and isinstance(condition, dict):
+                bounds = [to_millis(value) - (op == '$lt') for op, value in condition.items() if op in ('$lte', '$lt')]
+            elif field == 'timestamp':
+                bounds = [to_millis(condition)]
+            else:
+                continue
+            for value in bounds:
+                if value is not None and (bound is None or value < bound):
+                    bound = value
+        return bound
+
+    # Indices of the rows matching a query, ascending, and whether they are
+    # all of its matches. The timestamp range is located with searchsorted
+    # and only the rows inside it are filtered.
+    def _select(self, cols, coverage, query):
+        lower, upper = self._lower_bound(query), self._upper_bound(query)
+        complete = lower is not None and lower >= coverage
+        start = int(np.searchsorted(cols['ts'], coverage if lower is None else max(lower, coverage), 'left'))
+        end = len(cols['ts']) if upper is None else int(np.searchsorted(cols['ts'], upper, 'right'))
+        if end <= start:
+            return np.empty(0, dtype=np.int64), complete
+        window = {name: column[start:end] for name, column in cols.items()}
+        return np.flatnonzero(self._mask(window, query)) + start, complete
+
+    # Helper function to count an answered or missed read
+    def _count(self, answered):
+        with self._lock:
+            self.stats['hits' if answered else 'misses'] += 1
+
+    def _read(self, fn):
+        snapshot = self._snapshot()
+        result = None
+        if snapshot is not None:
+            try:
+                result = fn(*snapshot)
+            except Unsupported:
+                result = None
+            except Exception as e:
+                logger.error(f"Hot window read failed, serving from MongoDB: {e}")
+                result = None
+        self._count(result is not None)
+        return result
+
+    # Documents of a page in PAGE_SORT order (newest first), as find() with
+    # skip and limit returns them; None when MongoDB must answer
+    def find(self, query, skip, limit):
+        def page(cols, coverage):
+            rows, complete = self._select(cols, coverage, query)
+            if not complete and len(rows) < skip + limit:
+                return None
+            return [self._document(cols, i) for i in rows[::-1][skip:skip + limit]]
+        return self._read(page)
+
+    # Number of documents matching a query; None unless all of them are held
+    def count(self, query):
+        def total(cols, coverage):
+            rows, complete = self._select(cols, coverage, query)
+            return len(rows) if complete else None
+        return self._read(total)
+
+    def _document(self, cols, i):
+        oid = ObjectId(int(cols['id_hi'][i]).to_bytes(4, 'big') + int(cols['id_lo'][i]).to_bytes(8, 'big'))
+        doc = {
+            '_id': oid,
+            'timestamp': EPOCH + timedelta(milliseconds=int(cols['ts'][i])),
+            'uptime': float(cols['uptime'][i]),
+            'users_connected': int(cols['users'][i]),
+            'activity': self._activities[cols['activity'][i]],
+        }
+        if cols['host'][i] != NO_HOST:
+            doc['host'] = self._hosts[cols['host'][i]]
+        return doc
+
+    # Rows with start <= timestamp <= end, or None unless all of them are held
+    def _range(self, cols, coverage, start, end):
+        if to_millis(start) < coverage:
+            return None
+        lo = int(np.searchsorted(cols['ts'], to_millis(start), 'left'))
+        hi = int(np.searchsorted(cols['ts'], to_millis(end), 'right'))
+        return {name: column[lo:hi] for name, column in cols.items()}
+
+    # Summary statistics of a time range, shaped like rollups.combine_totals
+    def summary(self, start, end):
+        def totals(cols, coverage):
+            rows = self._range(cols, coverage, start, end)
+            if rows is None:
+                return None
+            count = len(rows['ts'])
+            suspicious = self._activity_codes.get('Suspicious')
+            return {
+                'total_records': count,
+                'avg_uptime': float(rows['uptime'].mean()) if count else 0,
+                'suspicious_count': int(np.count_nonzero(rows['activity'] == suspicious)) if suspicious is not None else 0,
+                'max_users': int(rows['users'].max()) if count else 0,
+                'avg_users': float(rows['users'].mean(dtype=np.float64)) if count else 0,
+            }
+        return self._read(totals)
+
+    # Percentile sketches of a time range, shaped like sketches.merge_sketches
+    def sketches(self, start, end):
+        def bins(cols, coverage):
+            rows = self._range(cols, coverage, start, end)
+            if rows is None:
+                return None
+            return {
+                'users_sketch': self._sketch(rows['users'].astype(np.float64)),
+                'downtime_sketch': self._sketch(100 - rows['uptime']),
+            }
+        return self._read(bins)
+
+    # Helper function to bin values like sketches.sketch_key, vectorized
+    @staticmethod
+    def _sketch(values):
+        zero = values <= MIN_VALUE
+        keys, counts = np.unique(np.ceil(np.log(values[~zero]) / LN_GAMMA).astype(np.int64), return_counts=True)
+        bins = {str(key): int(count) for key, count in zip(keys, counts)}
+        if zero.any():
+            bins[ZERO_KEY] = int(np.count_nonzero(zero))
+        return bins
+
+    # Size and state of this process's window, for /api/hotwindow/stats
+    def describe(self):
+        with self._lock:
+            current = self._pid == os.getpid()
+            rows = len(self._cols['ts']) if current and self._cols is not None else 0
+            coverage = None
+            if rows:
+                coverage = (EPOCH + timedelta(milliseconds=self._coverage)).strftime("%Y-%m-%d %H:%M:%S")
+            return {
+                'pid': os.getpid(),
+                'state': (self.state if current else None) or 'unloaded',
+                'rows': rows,
+                'bytes': rows * ROW_BYTES,
+                'max_rows': self.max_rows,
+                'coverage_start': coverage,
+                'version': self._version if current else None,
+                'pending': len(self._pending) if current else 0,
+                **self.stats,
+            }
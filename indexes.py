@@ -0,0 +1,77 @@
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Indexes required by the query shapes in app.py, per collection.
+# Keys are compared by specification, so an equivalent index created under
+# another name is accepted.
+REQUIRED_INDEXES = {
+    'metrics': [
+        # Date range filters plus the paginated sort on (timestamp, _id)
+        {'keys': [('timestamp', -1), ('_id', -1)], 'name': 'timestamp_-1__id_-1'},
+        # Suspicious activity counts within a date range
+        {'keys': [('activity', 1), ('timestamp', -1)], 'name': 'activity_1_timestamp_-1'},
+    ],
+    'notifications': [
+        {'keys': [('timestamp', -1), ('_id', -1)], 'name': 'timestamp_-1__id_-1'},
+    ],
+}
+
+# Helper function to list the key specifications already present on a collection
+def existing_index_keys(collection):
+    return {
+        tuple((field, int(direction)) for field, direction in info['key'])
+        for info in collection.index_information().values()
+    }
+
+# Create any missing required index and return the ones still missing afterwards
+def ensure_indexes(db, create=True):
+    missing = []
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = existing_index_keys(collection)
+        for spec in specs:
+            keys = tuple(spec['keys'])
+            if keys in existing:
+                logger.info(f"Index {spec['name']} present on {collection_name}")
+                continue
+            if not create:
+                logger.warning(f"Index {spec['name']} missing on {collection_name}")
+                missing.append((collection_name, spec['name']))
+                continue
+            try:
+                collection.create_index(spec['keys'], name=spec['name'])
+                logger.info(f"Created index {spec['name']} on {collection_name}")
+            except PyMongoError as e:
+                logger.error(f"Failed to create index {spec['name']} on {collection_name}: {e}")
+                missing.append((collection_name, spec['name']))
+    return missing
+
+# Verify the required indexes over a short-lived connection, creating missing
+# ones when allowed, and raise RuntimeError if any is still missing. Used to
+# refuse to start before serving anything.
+def require_indexes(uri, db_name, create=True, **options):
+    client = MongoClient(uri, **options)
+    try:
+        missing = ensure_indexes(client[db_name], create=create)
+    finally:
+        client.close()
+    if missing:
+        raise RuntimeError(f"Required indexes missing: {', '.join(f'{c}.{n}' for c, n in missing)}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Create or verify the indexes required by the monitoring app")
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--db', default=os.getenv("DB_NAME", "monitoring_app"))
+    parser.add_argument('--check', action='store_true', help="Only verify, do not create missing indexes")
+    args = parser.parse_args()
+
+    missing = ensure_indexes(MongoClient(args.connection)[args.db], create=not args.check)
+    if missing:
+        raise SystemExit(f"Missing indexes: {', '.join(f'{c}.{n}' for c, n in missing)}")
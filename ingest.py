@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError
+import json
+
+ACTIVITIES = ('Normal', 'Suspicious')
+
+# Largest integer BSON can store
+MAX_INT64 = 2 ** 63 - 1
+
+# Notification derived from a suspicious metric, as generate_data.py does
+SUSPICIOUS_EVENT_TYPE = "Unauthorized Access Attempt"
+SUSPICIOUS_DESCRIPTION = "Suspicious activity detected."
+
+# Helper function to decode a batch body: a JSON array or NDJSON, one document per line
+def parse_batch(body, content_type):
+    text = body.decode('utf-8')
+    if 'ndjson' in (content_type or '') or not text.lstrip().startswith('['):
+        items = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError(f"Line {number}: invalid JSON ({e})")
+        return items
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of documents")
+    return items
+
+# Helper function to parse "YYYY-MM-DD HH:MM:SS" or ISO 8601 timestamps.
+# Timestamps with an offset are converted to naive UTC; naive ones are kept as is.
+def parse_timestamp(value):
+    if not isinstance(value, str):
+        raise ValueError("timestamp must be a string")
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+# Validate one metric and return the document to insert; raises ValueError
+def validate_metric(item):
+    if not isinstance(item, dict):
+        raise ValueError("metric must be an object")
+    uptime = item.get('uptime')
+    users = item.get('users_connected')
+    activity = item.get('activity', 'Normal')
+    if isinstance(uptime, bool) or not isinstance(uptime, (int, float)) or not 0 <= uptime <= 100:
+        raise ValueError("uptime must be a number between 0 and 100")
+    # Larger integers would make the whole insert fail
+    if isinstance(users, bool) or not isinstance(users, int) or not 0 <= users <= MAX_INT64:
+        raise ValueError("users_connected must be a non-negative 64-bit integer")
+    if activity not in ACTIVITIES:
+        raise ValueError(f"activity must be one of {', '.join(ACTIVITIES)}")
+    metric = {
+        'timestamp': parse_timestamp(item.get('timestamp')),
+        'uptime': float(uptime),
+        'users_connected': users,
+        'activity': activity
+    }
+    # Optional name of the reporting host
+    if 'host' in item:
+        if not isinstance(item['host'], str):
+            raise ValueError("host must be a string")
+        metric['host'] = item['host']
+    return metric
+
+# Validate one notification and return the document to insert; raises ValueError
+def validate_notification(item):
+    if not isinstance(item, dict):
+        raise ValueError("notification must be an object")
+    event_type = item.get('event_type')
+    description = item.get('description')
+    if not isinstance(event_type, str) or not event_type:
+        raise ValueError("event_type must be a non-empty string")
+    if not isinstance(description, str):
+        raise ValueError("description must be a string")
+    return {
+        'timestamp': parse_timestamp(item.get('timestamp')),
+        'event_type': event_type,
+        'description': description
+    }
+
+# Notification raised for a suspicious metric
+def derive_notification(metric):
+    return {
+        'timestamp': metric['timestamp'],
+        'event_type': SUSPICIOUS_EVENT_TYPE,
+        'description': SUSPICIOUS_DESCRIPTION
+    }
+
+# Validate a batch, returning the valid documents, their positions in the
+# batch and a list of {index, error} for the rejected items
+def validate_batch(items, validate):
+    docs, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            docs.append(validate(item))
+            positions.append(index)
+        except (ValueError, TypeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    return docs, positions, errors
+
+# Unordered insert_many of validated documents. Returns the inserted documents
+# and per-item errors mapped back to their position in the original batch.
+def insert_batch(collection, docs, positions):
+    if not docs:
+        return [], []
+    try:
+        collection.insert_many(docs, ordered=False)
+        return docs, []
+    except BulkWriteError as e:
+        failed = {error['index']: error for error in e.details.get('writeErrors', [])}
+        errors = [{'index': positions[i], 'error': error.get('errmsg', 'write failed')}
+                  for i, error in failed.items()]
+        # Write concern failures are not tied to a single document
+        errors += [{'index': None, 'error': error.get('errmsg', 'write concern failed')}
+                   for error in e.details.get('writeConcernErrors', [])]
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        return inserted, errors
@@ -0,0 +1,135 @@
+from flask import g, request
+from prometheus_client import Gauge, Histogram
+from prometheus_flask_exporter import PrometheusMetrics
+from pymongo import monitoring
+import logconfig
+import os
+import re
+import threading
+
+# Prometheus instrumentation: request latency, size and in-flight requests per
+# route, MongoDB command latency per command and collection, and the share of
+# each request spent in MongoDB (the rest is Python work and serialization).
+
+# Helper function to read histogram buckets from an environment variable
+def buckets_from_env(variable, default):
+    value = os.getenv(variable)
+    if not value:
+        return default
+    return tuple(sorted(float(bound) for bound in value.split(',')))
+
+# Histogram buckets in seconds (request and MongoDB command latency) and bytes
+# (response size), overridable with comma separated lists
+LATENCY_BUCKETS = buckets_from_env("METRICS_LATENCY_BUCKETS", (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+SIZE_BUCKETS = buckets_from_env("METRICS_SIZE_BUCKETS", (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+
+# Paths that are not instrumented
+EXCLUDED_PATHS = ['^/static/', '^/metrics$']
+
+# Per-route series added to the exporter's request counters and latency histogram
+IN_FLIGHT = Gauge('flask_http_requests_in_flight', 'Requests being served', ['endpoint'],
+                  multiprocess_mode='livesum')
+RESPONSE_SIZE = Histogram('flask_http_response_size_bytes', 'Response body size in bytes',
+                          ['endpoint'], buckets=SIZE_BUCKETS)
+DB_TIME = Histogram('flask_http_request_db_seconds', 'Time spent in MongoDB commands per request',
+                    ['endpoint'], buckets=LATENCY_BUCKETS)
+# Records the logging pipeline dropped because its queue was full, summed over
+# the live processes; refreshed on every request, scrapes included
+LOG_DROPPED = Gauge('log_records_dropped', 'Log records dropped because the logging queue was full',
+                    multiprocess_mode='livesum')
+
+# Command listener recording the duration of every MongoDB command, labelled
+# with the command name and the collection it targets. The time is also added
+# to a per-thread total so each request can report how long it spent in
+# MongoDB: pymongo publishes command events on the thread running the command.
+class CommandMetrics(monitoring.CommandListener):
+    duration = Histogram(
+        'mongodb_command_duration_seconds', 'MongoDB command latency in seconds',
+        ['command', 'collection'], buckets=LATENCY_BUCKETS
+    )
+
+    def __init__(self):
+        self._collections = {}
+        self._local = threading.local()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names its collection separately; database commands have none
+            collection = event.command.get('collection', '')
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        self._observe(event)
+
+    def _observe(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        seconds = event.duration_micros / 1e6
+        self.duration.labels(event.command_name, collection).observe(seconds)
+        self._local.seconds = getattr(self._local, 'seconds', 0.0) + seconds
+
+    # MongoDB time of the current thread since the previous call
+    def take_thread_time(self):
+        seconds = getattr(self._local, 'seconds', 0.0)
+        self._local.seconds = 0.0
+        return seconds
+
+    # Charge MongoDB time spent on another thread to the current one
+    def add_thread_time(self, seconds):
+        self._local.seconds = getattr(self._local, 'seconds', 0.0) + seconds
+
+    # Wrap fn to return (result, MongoDB seconds spent in it), for work handed
+    # to another thread; the running total of the calling thread is kept
+    def measured(self, fn):
+        def call():
+            before = self.take_thread_time()
+            try:
+                return fn(), self.take_thread_time()
+            finally:
+                self.add_thread_time(before)
+        return call
+
+# Wire the /metrics endpoint and the per-route series into an app. Under
+# gunicorn with PROMETHEUS_MULTIPROC_DIR set, series are aggregated across
+# workers (see child_exit in gunicorn.conf.py).
+def init_metrics(app, command_metrics):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        metrics = GunicornInternalPrometheusMetrics(app, group_by='endpoint', buckets=LATENCY_BUCKETS,
+                                                    excluded_paths=EXCLUDED_PATHS)
+    else:
+        metrics = PrometheusMetrics(app, group_by='endpoint', buckets=LATENCY_BUCKETS,
+                                    excluded_paths=EXCLUDED_PATHS)
+    excluded = [re.compile(pattern) for pattern in EXCLUDED_PATHS]
+
+    @app.before_request
+    def start_request():
+        LOG_DROPPED.set(getattr(logconfig.root_handler, 'dropped', 0))
+        if any(pattern.match(request.path) for pattern in excluded):
+            return
+        command_metrics.take_thread_time()
+        g.metrics_in_flight = IN_FLIGHT.labels(request.endpoint)
+        g.metrics_in_flight.inc()
+
+    @app.after_request
+    def record_response(response):
+        if 'metrics_in_flight' in g:
+            DB_TIME.labels(request.endpoint).observe(command_metrics.take_thread_time())
+            # Streamed responses (exports) have no length up front, and
+            # computing one would buffer the whole body
+            if not response.is_streamed:
+                RESPONSE_SIZE.labels(request.endpoint).observe(response.calculate_content_length() or 0)
+        return response
+
+    @app.teardown_request
+    def end_request(exception=None):
+        in_flight_child = g.pop('metrics_in_flight', None)
+        if in_flight_child is not None:
+            in_flight_child.dec()
+
+    return metrics
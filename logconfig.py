@@ -0,0 +1,204 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+
+# Logging pipeline. Request threads only put records on an in-memory queue;
+# a background listener thread per process formats them and does the file and
+# console I/O. Output is plain text or one JSON object per line, the log file
+# can rotate by size or time, and successful requests in the access logs
+# (werkzeug, gunicorn) can be sampled.
+#
+#     LOG_LEVEL=INFO
+#     LOG_FORMAT=text            # or json
+#     LOG_FILE=app.log           # empty for console only; {pid} is replaced
+#                                # by the process id and {worker} by LOG_WORKER
+#                                # (gunicorn.conf.py makes it per worker slot)
+#     LOG_ROTATE=size            # size, time or none
+#     LOG_MAX_BYTES=10485760     # size rotation threshold
+#     LOG_ROTATE_WHEN=midnight   # time rotation interval (TimedRotatingFileHandler)
+#     LOG_BACKUP_COUNT=5
+#     LOG_QUEUE=True             # False writes from the calling thread
+#     LOG_QUEUE_SIZE=10000       # INFO records beyond this are dropped, not waited
+#                                # for; WARNING and above are written directly
+#     ACCESS_LOG_SAMPLE=1.0      # share of 1xx-3xx access log lines kept
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Loggers carrying one line per HTTP request
+ACCESS_LOGGERS = ('werkzeug', 'gunicorn.access')
+
+# Attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+# One JSON object per line with the standard fields, any extra= fields and,
+# for gunicorn access lines, the request fields
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': ANSI_ESCAPE.sub('', record.getMessage()),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        if record.name == 'gunicorn.access' and isinstance(record.args, dict):
+            entry['http'] = {
+                'method': record.args.get('m'),
+                'path': record.args.get('U'),
+                'query': record.args.get('q') or None,
+                'status': int(record.args.get('s')) if str(record.args.get('s')).isdigit() else None,
+                'bytes': record.args.get('B'),
+                'duration_ms': round(record.args.get('D', 0) / 1000, 3),
+                'remote': record.args.get('h')
+            }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# Keeps every access log line for 4xx/5xx responses and a random share of the rest
+class AccessLogSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1:
+            return True
+        args = record.args
+        if isinstance(args, dict):
+            status = str(args.get('s', ''))  # gunicorn atoms
+        elif isinstance(args, tuple) and len(args) >= 2:
+            status = str(args[1])  # werkzeug: request line, status, size
+        else:
+            return True
+        return status[:1] in ('4', '5') or random.random() < self.rate
+
+# QueueListener whose stop() waits for room in a full queue instead of failing
+class DrainingListener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+# QueueHandler that does not make the caller wait for the output: records are
+# not formatted here, and a forked process starts its own listener on first use
+# because threads do not survive fork(). When the queue is full, records below
+# WARNING (INFO and sampled access lines) are dropped and counted; warnings and
+# errors are written from the calling thread instead, so they are never lost.
+class BackgroundHandler(QueueHandler):
+    def __init__(self, make_handlers, queue_size):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.make_handlers = make_handlers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self._listener = DrainingListener(self.queue, *self.make_handlers(), respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            listener = self._listener
+            if record.levelno >= logging.WARNING and listener is not None:
+                listener.handle(record)
+            else:
+                self.dropped += 1
+
+    # Flush queued records and stop the listener thread
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+            self._listener = None
+            self._pid = None
+
+# Build the output handlers (console and optional rotating file) from the environment
+def output_handlers():
+    formatter = JSONFormatter() if os.getenv("LOG_FORMAT", "text").lower() == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+
+    log_file = os.getenv("LOG_FILE", "app.log")
+    if log_file:
+        # Each process appending to and rotating one shared file loses and
+        # duplicates lines; with {pid} or {worker} in the name every process
+        # has its own
+        log_file = log_file.replace('{pid}', str(os.getpid())).replace('{worker}', os.getenv("LOG_WORKER", "main"))
+        rotate = os.getenv("LOG_ROTATE", "size").lower()
+        backups = int(os.getenv("LOG_BACKUP_COUNT", 5))
+        if rotate == 'size':
+            handlers.append(RotatingFileHandler(log_file, maxBytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                                                backupCount=backups))
+        elif rotate == 'time':
+            handlers.append(TimedRotatingFileHandler(log_file, when=os.getenv("LOG_ROTATE_WHEN", "midnight"),
+                                                     backupCount=backups))
+        else:
+            handlers.append(logging.FileHandler(log_file))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+# The handler installed on the root logger by configure_logging
+root_handler = None
+
+# Route the root logger and the access loggers through the logging pipeline.
+# Safe to call more than once; later calls keep the existing pipeline.
+def configure_logging():
+    global root_handler
+    if root_handler is not None:
+        return root_handler
+
+    if os.getenv("LOG_QUEUE", "True").lower() == 'true':
+        root_handler = BackgroundHandler(output_handlers, int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+        atexit.register(root_handler.stop)
+        handlers = [root_handler]
+    else:
+        handlers = output_handlers()
+        root_handler = handlers[0]
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for handler in handlers:
+        root.addHandler(handler)
+
+    sampler = AccessLogSampler(float(os.getenv("ACCESS_LOG_SAMPLE", 1.0)))
+    for name in ACCESS_LOGGERS:
+        logging.getLogger(name).addFilter(sampler)
+    return root_handler
+
+# Send a logger that has its own handlers (gunicorn's access log) through the
+# pipeline instead
+def attach(logger):
+    configure_logging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.propagate = True
@@ -0,0 +1,204 @@
+from pymongo import MongoClient, monitoring
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Connection checkout wait histogram bucket upper bounds in milliseconds
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000]
+
+# Pool settings from environment variables, as MongoClient keyword arguments.
+# Unset variables keep the pymongo defaults.
+def pool_options():
+    options = {}
+    for option, variable in [('maxPoolSize', 'MONGO_MAX_POOL_SIZE'),
+                             ('minPoolSize', 'MONGO_MIN_POOL_SIZE'),
+                             ('maxIdleTimeMS', 'MONGO_MAX_IDLE_TIME_MS'),
+                             ('waitQueueTimeoutMS', 'MONGO_WAIT_QUEUE_TIMEOUT_MS')]:
+        value = os.getenv(variable)
+        if value:
+            options[option] = int(value)
+    # Comma separated, in order of preference: zstd, snappy or zlib. zstd and
+    # snappy need the zstandard and python-snappy packages.
+    compressors = os.getenv("MONGO_COMPRESSORS")
+    if compressors:
+        options['compressors'] = compressors
+    return options
+
+# Connection pool listener turning pool events into counters, so that time spent
+# waiting for a pooled connection can be told apart from time spent in MongoDB.
+# Counters are per process, like the pool itself.
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, address):
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {
+                'open': 0, 'in_use': 0, 'peak_in_use': 0, 'waiting': 0, 'peak_waiting': 0,
+                'checkouts': 0, 'failed_checkouts': {}, 'timeouts': 0,
+                'wait_ms_total': 0.0, 'wait_ms_max': 0.0,
+                'wait_histogram': [0] * (len(WAIT_BUCKETS_MS) + 1),
+                'created': 0, 'closed': 0, 'clears': 0
+            }
+        return pool
+
+    def _wait(self, pool, duration):
+        if duration is None:
+            return
+        ms = duration * 1000
+        pool['wait_ms_total'] += ms
+        pool['wait_ms_max'] = max(pool['wait_ms_max'], ms)
+        index = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if ms <= bound), len(WAIT_BUCKETS_MS))
+        pool['wait_histogram'][index] += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['waiting'] += 1
+            pool['peak_waiting'] = max(pool['peak_waiting'], pool['waiting'])
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['waiting'] -= 1
+            pool['checkouts'] += 1
+            pool['in_use'] += 1
+            pool['peak_in_use'] = max(pool['peak_in_use'], pool['in_use'])
+            self._wait(pool, event.duration)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['waiting'] -= 1
+            pool['failed_checkouts'][event.reason] = pool['failed_checkouts'].get(event.reason, 0) + 1
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                pool['timeouts'] += 1
+            self._wait(pool, event.duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pool(event.address)['in_use'] -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['open'] += 1
+            pool['created'] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['open'] -= 1
+            pool['closed'] += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event.address)['clears'] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    # Snapshot of the counters of every server pool
+    def snapshot(self):
+        labels = [f"<={bound}ms" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            pools = {}
+            for address, pool in self._pools.items():
+                waits = pool['checkouts'] + sum(pool['failed_checkouts'].values())
+                stats = dict(pool, failed_checkouts=dict(pool['failed_checkouts']))
+                stats['wait_ms_avg'] = round(pool['wait_ms_total'] / waits, 3) if waits else 0.0
+                stats['wait_ms_total'] = round(pool['wait_ms_total'], 3)
+                stats['wait_ms_max'] = round(pool['wait_ms_max'], 3)
+                stats['wait_histogram'] = dict(zip(labels, pool['wait_histogram']))
+                pools[address] = stats
+            return pools
+
+# MongoDB handle shared by the app modules. The client is created on first use
+# in each process rather than at import time: a MongoClient must not be used
+# across fork(), so under gunicorn (with or without --preload) every worker
+# opens its own client and connection pool after it has been forked.
+class Mongo:
+    def __init__(self, uri=None, db_name=None, **options):
+        self.uri = uri
+        self.db_name = db_name
+        self.options = options
+        self._client = None
+        self._pid = None
+        self._ready_pid = None
+        self._on_connect = []
+        self._lock = threading.RLock()
+        self._app_bound = False
+
+    # Read the connection settings of a Flask app. The handle is shared by the
+    # whole process, so a later app, or one initialized after the client has
+    # connected, must use the same settings instead of silently replacing them.
+    def init_app(self, app):
+        uri, db_name = app.config['MONGO_URI'], app.config['DB_NAME']
+        with self._lock:
+            if (self._app_bound or self._client is not None) and (uri, db_name) != (self.uri, self.db_name):
+                raise RuntimeError(f"MongoDB is already configured for database {self.db_name!r} in this process; "
+                                   f"an app using a different MONGO_URI or DB_NAME ({db_name!r}) needs its own process")
+            self.uri, self.db_name = uri, db_name
+            self._app_bound = True
+        app.extensions['mongo'] = self
+
+    # Register a function called with the database once per process, right
+    # after connecting and before any other thread gets the client
+    def on_connect(self, fn):
+        self._on_connect.append(fn)
+        return fn
+
+    @property
+    def client(self):
+        if self._ready_pid != os.getpid():
+            with self._lock:
+                # Re-entrant calls from on_connect functions get the new client
+                if self._pid != os.getpid():
+                    self._connect()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    # Collection handle that resolves the client on each use, for objects
+    # built at import time such as the change tracker
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def _connect(self):
+        client = MongoClient(self.uri, **self.options)
+        try:
+            client.admin.command('ping')
+            logger.info(f"Successfully connected to MongoDB (pid {os.getpid()})")
+            self._client, self._pid = client, os.getpid()
+            for fn in self._on_connect:
+                fn(client[self.db_name])
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB: {e}")
+            self._client = self._pid = None
+            client.close()
+            raise
+        self._ready_pid = os.getpid()
+
+class LazyCollection:
+    def __init__(self, mongo, name):
+        self.mongo = mongo
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.mongo.db[self.name], attr)
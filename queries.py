@@ -0,0 +1,189 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from totals import COUNT_MODES
+import base64
+import json
+
+# Query building and result formatting shared by the sync (app.py) and
+# async (asgi.py) serving modes. Nothing here performs I/O.
+
+# Sort order shared by all paginated endpoints; _id breaks timestamp ties so
+# that keyset cursors resume at an exact position
+PAGE_SORT = [('timestamp', -1), ('_id', -1)]
+
+# Helper function to parse date parameters
+def parse_date_param(date_str):
+    if not date_str:
+        return None
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+# Helper function to build the timestamp filter shared by list and export endpoints
+def build_date_query(start_date, end_date):
+    query = {}
+    if start_date or end_date:
+        query['timestamp'] = {}
+        if start_date:
+            query['timestamp']['$gte'] = start_date
+        if end_date:
+            # Include the entire end date
+            query['timestamp']['$lte'] = end_date + timedelta(days=1) - timedelta(seconds=1)
+    return query
+
+# Helper function to build the metrics filter from the date range and keyword
+def build_metrics_query(start_date, end_date, keyword):
+    query = build_date_query(start_date, end_date)
+    if keyword:
+        query['activity'] = {'$regex': keyword, '$options': 'i'}
+    return query
+
+# Helper function to build the notifications filter from the date range and keyword
+def build_notifications_query(start_date, end_date, keyword):
+    query = build_date_query(start_date, end_date)
+    if keyword:
+        query['$or'] = [
+            {'event_type': {'$regex': keyword, '$options': 'i'}},
+            {'description': {'$regex': keyword, '$options': 'i'}}
+        ]
+    return query
+
+# Helper function to build an opaque keyset cursor from the last document of a page
+def encode_cursor(doc):
+    payload = json.dumps({
+        'ts': doc['timestamp'].isoformat(),
+        'id': str(doc['_id'])
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+# Helper function to turn a cursor back into a range predicate on (timestamp, _id)
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = datetime.fromisoformat(payload['ts'])
+        last_id = ObjectId(payload['id'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        return None
+    return {'$or': [
+        {'timestamp': {'$lt': timestamp}},
+        {'timestamp': timestamp, '_id': {'$lt': last_id}}
+    ]}
+
+# Parse the query arguments of a list endpoint. Returns (params, error) where
+# error is a client-facing message for a 400 response.
+def parse_list_args(args, build_query):
+    page = int(args.get('page', 1))
+    per_page = int(args.get('per_page', 10))
+    cursor = args.get('cursor')
+    # Totals are skipped by default in cursor mode
+    count_mode = args.get('count', 'none' if cursor is not None else 'approx')
+    if count_mode not in COUNT_MODES:
+        return None, f"count must be one of {', '.join(COUNT_MODES)}"
+
+    # Resume after the cursor position when one is given
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        return None, 'Invalid cursor'
+
+    query = build_query(
+        parse_date_param(args.get('start_date')),
+        parse_date_param(args.get('end_date')),
+        args.get('keyword', '')
+    )
+    return {
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'keyset': cursor is not None,
+        'after': after,
+        'count_mode': count_mode
+    }, None
+
+# Parse the arguments of /api/dashboard. Both tables share the filters and
+# page size but have their own page (metrics_page, notifications_page).
+# Returns (metrics_params, notifications_params, error).
+def parse_dashboard_args(args):
+    table_args = {key: value for key, value in args.items() if key != 'cursor'}
+    metrics_params, error = parse_list_args(
+        dict(table_args, page=args.get('metrics_page', 1)), build_metrics_query)
+    if error:
+        return None, None, error
+    notifications_params, error = parse_list_args(
+        dict(table_args, page=args.get('notifications_page', 1)), build_notifications_query)
+    return metrics_params, notifications_params, error
+
+# Filter, skip and limit of the find() for one page. One extra document is
+# fetched to know whether another page exists.
+def page_find_args(query, page, per_page, keyset=False, after=None):
+    if keyset:
+        if after:
+            query = {'$and': [query, after]} if query else after
+        return query, 0, per_page + 1
+    return query, (page - 1) * per_page, per_page + 1
+
+# Turn the documents fetched by page_find_args into the page and its pagination block
+def build_page(docs, total, page, per_page, keyset=False):
+    has_more = len(docs) > per_page
+    docs = docs[:per_page]
+
+    pagination = {
+        'per_page': per_page,
+        'next_cursor': encode_cursor(docs[-1]) if has_more else None,
+        'has_more': has_more
+    }
+    if not keyset:
+        pagination['page'] = page
+    if not keyset or total is not None:
+        pagination['total'] = total
+        pagination['pages'] = (total + per_page - 1) // per_page if total is not None else None
+
+    # Format timestamps and drop internal ids
+    for doc in docs:
+        del doc['_id']
+        doc['timestamp'] = doc['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+
+    return docs, pagination
+
+# Helper function to read the summary window length, as /api/metrics/summary does
+def parse_summary_days(args):
+    days = int(args.get('days', 30))
+    if days <= 0 or days > 365:
+        days = 30  # Default to 30 days if invalid
+    return days
+
+# Maximum number of percentiles one summary request can ask for
+MAX_PERCENTILES = 10
+
+# Parse the optional percentiles= argument of the summary, e.g. "50,95,99".
+# Returns (percentiles, error) where percentiles is an empty list when none
+# were asked for and error is a client-facing message for a 400 response.
+def parse_percentiles(args):
+    raw = args.get('percentiles', '')
+    if not raw:
+        return [], None
+    try:
+        percentiles = sorted({float(value) for value in raw.split(',')})
+    except ValueError:
+        return None, 'percentiles must be a comma-separated list of numbers'
+    if len(percentiles) > MAX_PERCENTILES or not all(0 <= p <= 100 for p in percentiles):
+        return None, f"percentiles takes at most {MAX_PERCENTILES} values between 0 and 100"
+    return percentiles, None
+
+# Helper function to build the summary response body
+def summary_body(days, start_date, end_date, summary, percentiles=None):
+    body = {
+        'period_days': days,
+        'total_records': summary['total_records'],
+        'avg_uptime': round(summary['avg_uptime'], 2),
+        'suspicious_activities': summary['suspicious_count'],
+        'max_concurrent_users': summary['max_users'],
+        'avg_users': round(summary['avg_users'], 2),
+        'data_start': start_date.strftime("%Y-%m-%d"),
+        'data_end': end_date.strftime("%Y-%m-%d")
+    }
+    if percentiles is not None:
+        body['percentiles'] = percentiles
+    return body
@@ -0,0 +1,330 @@
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import PyMongoError
+from datetime import datetime, timedelta
+from sketches import (MISSING_SKETCH, backfill_sketch_stages, query_sketch_pipeline, raw_sketch_pipeline,
+                      rollup_sketch_pipeline, sketch_key, sketch_values)
+import argparse
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pre-aggregated metric buckets: rollup name -> (collection, bucket size, $dateTrunc unit)
+ROLLUPS = {
+    '1h': ('metrics_rollup_1h', timedelta(hours=1), 'hour'),
+    '1d': ('metrics_rollup_1d', timedelta(days=1), 'day'),
+}
+
+# Helper function to find the start of the bucket containing a timestamp
+def bucket_start(timestamp, size):
+    if size == timedelta(days=1):
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+# Helper function to find the first bucket boundary at or after a timestamp
+def bucket_ceil(timestamp, size):
+    start = bucket_start(timestamp, size)
+    return start if start == timestamp else start + size
+
+# Build the upserts that fold a batch of metric documents into every rollup
+def rollup_updates(metrics, size):
+    buckets = {}
+    for metric in metrics:
+        start = bucket_start(metric['timestamp'], size)
+        bucket = buckets.setdefault(start, {
+            'count': 0, 'uptime_sum': 0.0, 'users_sum': 0, 'suspicious': 0,
+            'uptime_min': metric['uptime'], 'uptime_max': metric['uptime'],
+            'users_min': metric['users_connected'], 'users_max': metric['users_connected'],
+            'sketches': {},
+        })
+        bucket['count'] += 1
+        bucket['uptime_sum'] += metric['uptime']
+        bucket['users_sum'] += metric['users_connected']
+        bucket['suspicious'] += 1 if metric['activity'] == 'Suspicious' else 0
+        bucket['uptime_min'] = min(bucket['uptime_min'], metric['uptime'])
+        bucket['uptime_max'] = max(bucket['uptime_max'], metric['uptime'])
+        bucket['users_min'] = min(bucket['users_min'], metric['users_connected'])
+        bucket['users_max'] = max(bucket['users_max'], metric['users_connected'])
+        for field, value in sketch_values(metric).items():
+            path = f"{field}.{sketch_key(value)}"
+            bucket['sketches'][path] = bucket['sketches'].get(path, 0) + 1
+
+    return [
+        UpdateOne({'_id': start}, {
+            '$inc': {
+                'count': bucket['count'],
+                'uptime_sum': bucket['uptime_sum'],
+                'users_sum': bucket['users_sum'],
+                'suspicious': bucket['suspicious'],
+                **bucket['sketches'],
+            },
+            '$min': {'uptime_min': bucket['uptime_min'], 'users_min': bucket['users_min']},
+            '$max': {'uptime_max': bucket['uptime_max'], 'users_max': bucket['users_max']},
+        }, upsert=True)
+        for start, bucket in buckets.items()
+    ]
+
+# Incrementally update the rollup collections after metrics have been written
+def update_rollups(db, metrics):
+    if not metrics:
+        return
+    for collection_name, size, _ in ROLLUPS.values():
+        db[collection_name].bulk_write(rollup_updates(metrics, size), ordered=False)
+
+# Rebuild the rollup buckets from the raw metrics collection, server side.
+# The range is widened to whole buckets so partially covered ones stay exact.
+def backfill(db, start_date=None, end_date=None):
+    for collection_name, size, unit in ROLLUPS.values():
+        bucket_range = {}
+        if start_date:
+            bucket_range['$gte'] = bucket_start(start_date, size)
+        if end_date:
+            bucket_range['$lt'] = bucket_ceil(end_date, size)
+        query = {'timestamp': bucket_range} if bucket_range else {}
+
+        # Drop the buckets being rebuilt so they are not counted twice
+        db[collection_name].delete_many({'_id': bucket_range} if bucket_range else {})
+
+        db.metrics.aggregate([
+            {'$match': query},
+            {'$group': {
+                '_id': {'$dateTrunc': {'date': '$timestamp', 'unit': unit}},
+                'count': {'$sum': 1},
+                'uptime_sum': {'$sum': '$uptime'},
+                'users_sum': {'$sum': '$users_connected'},
+                'suspicious': {'$sum': {'$cond': [{'$eq': ['$activity', 'Suspicious']}, 1, 0]}},
+                'uptime_min': {'$min': '$uptime'},
+                'uptime_max': {'$max': '$uptime'},
+                'users_min': {'$min': '$users_connected'},
+                'users_max': {'$max': '$users_connected'},
+            }},
+            {'$merge': {'into': collection_name, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ], allowDiskUse=True)
+
+        # Then add the percentile sketches to the rebuilt buckets
+        db.metrics.aggregate([
+            {'$match': query},
+            *backfill_sketch_stages({'$dateTrunc': {'date': '$timestamp', 'unit': unit}}),
+            {'$merge': {'into': collection_name, 'whenMatched': 'merge', 'whenNotMatched': 'discard'}}
+        ], allowDiskUse=True)
+        logger.info(f"Backfilled {db[collection_name].estimated_document_count()} buckets into {collection_name}")
+
+# Pipeline summing the metric counts of the buckets of a rollup collection
+# that start before the watermark
+def rollup_count_pipeline(watermark):
+    return [
+        {'$match': {'_id': {'$lt': watermark}}},
+        {'$group': {'_id': None, 'count': {'$sum': '$count'}}}
+    ]
+
+# How far the check watermark stays behind the clock. Ingest inserts metrics
+# before folding them into the rollups, so the newest buckets are briefly
+# behind under steady ingest and are left out of the comparison.
+WATERMARK_LAG = timedelta(hours=1)
+
+# Seconds before a failed check is repeated, however long `interval` is
+STALE_RECHECK_INTERVAL = 30
+
+# Whether the rollups agree with the raw metrics. Buckets that were never
+# backfilled, or metrics written without updating them, would make summaries
+# and series read from the rollups silently wrong, so until every rollup counts
+# as many metrics as the metrics collection holds before the watermark, queries
+# aggregate the raw metrics instead. Checked on connect and again every
+# `interval` seconds, so running the backfill command brings the rollups back
+# into use.
+class RollupCheck:
+    def __init__(self, interval=300):
+        self.interval = interval
+        # Names of the rollups that disagree; None until a check completes
+        self.stale = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def due(self):
+        if self._checked_at is None:
+            return True
+        interval = self.interval if self.stale == [] else min(self.interval, STALE_RECHECK_INTERVAL)
+        return time.monotonic() - self._checked_at >= interval
+
+    # Store the result of a check from the metrics count and the summed bucket
+    # counts per rollup name; returns whether the rollups can be used
+    def record(self, metrics_count, rollup_counts):
+        stale = [name for name, count in rollup_counts.items() if count != metrics_count]
+        if stale and stale != self.stale:
+            logger.warning(f"Rollups {', '.join(stale)} do not match the {metrics_count} metrics; "
+                           f"summaries and series read the raw metrics until `python rollups.py` rebuilds them")
+        elif not stale and self.stale:
+            logger.info("Rollups match the metrics again; summaries and series read them")
+        self.stale = stale
+        self._checked_at = time.monotonic()
+        return not stale
+
+    # Start of the day WATERMARK_LAG before now; only metrics and buckets
+    # before it are compared. Day-aligned, so both rollups cover the same span.
+    @staticmethod
+    def watermark(now=None):
+        return bucket_start((now or datetime.now()) - WATERMARK_LAG, timedelta(days=1))
+
+    # A check that failed keeps the previous answer until the next one is due
+    def record_error(self, error):
+        logger.error(f"Error checking rollups: {error}")
+        self._checked_at = time.monotonic()
+
+    def check(self, db):
+        watermark = self.watermark()
+        rollup_counts = {
+            name: next(db[collection_name].aggregate(rollup_count_pipeline(watermark)), {}).get('count', 0)
+            for name, (collection_name, _, _) in ROLLUPS.items()
+        }
+        return self.record(db.metrics.count_documents({'timestamp': {'$lt': watermark}}), rollup_counts)
+
+    # Whether summaries may read the rollups, checking again when due; unused
+    # until a check has succeeded
+    def usable(self, db):
+        if self.due():
+            with self._lock:
+                if self.due():
+                    try:
+                        self.check(db)
+                    except PyMongoError as e:
+                        self.record_error(e)
+        return self.stale == []
+
+# Pipeline computing totals over raw metrics in a time range
+def raw_totals_pipeline(time_range):
+    return [
+        {'$match': {'timestamp': time_range}},
+        {'$group': {
+            '_id': None,
+            'count': {'$sum': 1},
+            'uptime_sum': {'$sum': '$uptime'},
+            'users_sum': {'$sum': '$users_connected'},
+            'users_max': {'$max': '$users_connected'},
+            'suspicious': {'$sum': {'$cond': [{'$eq': ['$activity', 'Suspicious']}, 1, 0]}},
+        }}
+    ]
+
+# Pipeline computing totals over the rollup buckets that start inside [start, end)
+def rollup_totals_pipeline(start, end):
+    return [
+        {'$match': {'_id': {'$gte': start, '$lt': end}}},
+        {'$group': {
+            '_id': None,
+            'count': {'$sum': '$count'},
+            'uptime_sum': {'$sum': '$uptime_sum'},
+            'users_sum': {'$sum': '$users_sum'},
+            'users_max': {'$max': '$users_max'},
+            'suspicious': {'$sum': '$suspicious'},
+        }}
+    ]
+
+# Split [start, end] into raw edges and bucket-aligned spans: whole days are
+# read from the daily rollup, whole hours around them from the hourly rollup
+# and only the unaligned remainders from the raw metrics collection
+def plan_ranges(start, end):
+    hour, day = ROLLUPS['1h'][1], ROLLUPS['1d'][1]
+    hour_start, hour_end = bucket_ceil(start, hour), bucket_start(end, hour)
+    if hour_end <= hour_start:
+        return [('raw', {'$gte': start, '$lte': end})]
+
+    ranges = [('raw', {'$gte': start, '$lt': hour_start})]
+    day_start, day_end = bucket_ceil(hour_start, day), bucket_start(hour_end, day)
+    if day_end > day_start:
+        ranges += [
+            ('1h', hour_start, day_start),
+            ('1d', day_start, day_end),
+            ('1h', day_end, hour_end),
+        ]
+    else:
+        ranges.append(('1h', hour_start, hour_end))
+    ranges.append(('raw', {'$gte': hour_end, '$lte': end}))
+    return ranges
+
+# The (collection, pipeline) aggregations whose totals make up a summary
+def summary_aggregations(start, end, use_rollups=True):
+    ranges = plan_ranges(start, end) if use_rollups else [('raw', {'$gte': start, '$lte': end})]
+    aggregations = []
+    for source, *bounds in ranges:
+        if source == 'raw':
+            aggregations.append(('metrics', raw_totals_pipeline(*bounds)))
+        elif bounds[0] < bounds[1]:
+            aggregations.append((ROLLUPS[source][0], rollup_totals_pipeline(*bounds)))
+    return aggregations
+
+# Combine the totals of every aggregation into the summary statistics
+def combine_totals(parts):
+    totals = {'count': 0, 'uptime_sum': 0.0, 'users_sum': 0, 'users_max': None, 'suspicious': 0}
+    for part in parts:
+        if not part or not part.get('count'):
+            continue
+        for field in ('count', 'uptime_sum', 'users_sum', 'suspicious'):
+            totals[field] += part[field]
+        if totals['users_max'] is None or part['users_max'] > totals['users_max']:
+            totals['users_max'] = part['users_max']
+
+    count = totals['count']
+    return {
+        'total_records': count,
+        'avg_uptime': totals['uptime_sum'] / count if count else 0,
+        'suspicious_count': totals['suspicious'],
+        'max_users': totals['users_max'] or 0,
+        'avg_users': totals['users_sum'] / count if count else 0,
+    }
+
+# Summary statistics for metrics with start <= timestamp <= end
+def summarize(db, start, end, use_rollups=True):
+    return combine_totals(
+        next(db[collection_name].aggregate(pipeline), None)
+        for collection_name, pipeline in summary_aggregations(start, end, use_rollups)
+    )
+
+# The (collection, pipeline) aggregations whose bins make up the percentile
+# sketches of a window, split like summary_aggregations
+def sketch_aggregations(start, end, use_rollups=True):
+    ranges = plan_ranges(start, end) if use_rollups else [('raw', {'$gte': start, '$lte': end})]
+    aggregations = []
+    for source, *bounds in ranges:
+        if source == 'raw':
+            aggregations.append(('metrics', raw_sketch_pipeline(*bounds)))
+        elif bounds[0] < bounds[1]:
+            aggregations.append((ROLLUPS[source][0], rollup_sketch_pipeline(*bounds)))
+    return aggregations
+
+# Split the results of one sketch aggregation into its bins and the pipeline
+# sketching, from the raw metrics, the rollup buckets it reported as missing
+# their sketches (None when there are none)
+def missing_sketches(collection_name, docs):
+    size = next((size for name, size, _ in ROLLUPS.values() if name == collection_name), None)
+    bins, ranges = [], []
+    for doc in docs:
+        if doc['_id']['f'] == MISSING_SKETCH:
+            ranges.append({'timestamp': {'$gte': doc['_id']['k'], '$lt': doc['_id']['k'] + size}})
+        else:
+            bins.append(doc)
+    return bins, query_sketch_pipeline({'$or': ranges}) if ranges else None
+
+# Sketch bins of the metrics with start <= timestamp <= end, for merge_sketches
+def sketch_bins(db, start, end, use_rollups=True):
+    result = []
+    for collection_name, pipeline in sketch_aggregations(start, end, use_rollups):
+        bins, fallback = missing_sketches(collection_name, db[collection_name].aggregate(pipeline))
+        result.extend(bins)
+        if fallback is not None:
+            result.extend(db.metrics.aggregate(fallback))
+    return result
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Rebuild the metrics rollup collections from raw metrics")
+    parser.add_argument('--connection', default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument('--db', default=os.getenv("DB_NAME", "monitoring_app"))
+    parser.add_argument('--start', help="Only rebuild buckets from this date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Only rebuild buckets before this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d") if args.start else None
+    end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else None
+    backfill(MongoClient(args.connection)[args.db], start, end)
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta, timezone
+import math
+from rollups import ROLLUPS, plan_ranges
+
+# Downsampled metric series for the dashboard charts. A window is cut into at
+# most `points` buckets of a round size, and each bucket reports the count,
+# average, minimum and maximum of uptime and connected users. Buckets of an
+# hour or more are read from the rollup collections, and only the unaligned
+# edges of the window from raw metrics, so a year costs about as much as a day.
+
+# Bucket sizes in increasing order, as $dateTrunc (unit, binSize)
+STEPS = [
+    ('minute', 1), ('minute', 2), ('minute', 5), ('minute', 10), ('minute', 15), ('minute', 30),
+    ('hour', 1), ('hour', 2), ('hour', 3), ('hour', 6), ('hour', 12),
+    ('day', 1), ('day', 2), ('day', 7), ('day', 14), ('day', 30),
+]
+UNIT_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Default and maximum number of points per series
+DEFAULT_POINTS = 200
+MAX_POINTS = 1000
+
+# Accumulated fields of a bucket: raw metric field -> rollup field, per statistic
+SUMS = {'count': None, 'uptime_sum': 'uptime', 'users_sum': 'users_connected'}
+MINS = {'uptime_min': 'uptime', 'users_min': 'users_connected'}
+MAXES = {'uptime_max': 'uptime', 'users_max': 'users_connected'}
+
+# Helper function to read the number of points, clamped to 1..MAX_POINTS
+def parse_points(args):
+    try:
+        points = int(args.get('points', DEFAULT_POINTS))
+    except ValueError:
+        points = DEFAULT_POINTS
+    return min(max(points, 1), MAX_POINTS)
+
+# Smallest bucket size giving at most `points` buckets over the window. A
+# window that doesn't start on a bucket boundary touches one partial bucket
+# more than it spans.
+def choose_step(start, end, points):
+    window = (end - start).total_seconds()
+    for unit, bin_size in STEPS:
+        if math.ceil(window / (UNIT_SECONDS[unit] * bin_size)) + 1 <= points:
+            return unit, bin_size
+    return STEPS[-1]
+
+# Pipeline grouping raw metrics in a time range into buckets
+def raw_series_pipeline(time_range, unit, bin_size):
+    group = {'_id': {'$dateTrunc': {'date': '$timestamp', 'unit': unit, 'binSize': bin_size}}}
+    group.update({field: {'$sum': f"${source}" if source else 1} for field, source in SUMS.items()})
+    group.update({field: {'$min': f"${source}"} for field, source in MINS.items()})
+    group.update({field: {'$max': f"${source}"} for field, source in MAXES.items()})
+    return [{'$match': {'timestamp': time_range}}, {'$group': group}]
+
+# Pipeline regrouping the rollup buckets that start inside [start, end)
+def rollup_series_pipeline(start, end, unit, bin_size):
+    group = {'_id': {'$dateTrunc': {'date': '$_id', 'unit': unit, 'binSize': bin_size}}}
+    group.update({field: {'$sum': f"${field}"} for field in SUMS})
+    group.update({field: {'$min': f"${field}"} for field in MINS})
+    group.update({field: {'$max': f"${field}"} for field in MAXES})
+    return [{'$match': {'_id': {'$gte': start, '$lt': end}}}, {'$group': group}]
+
+# The (collection, pipeline) aggregations whose buckets make up a series.
+# Rollup buckets only nest inside buckets at least as large as themselves.
+def series_aggregations(start, end, unit, bin_size, use_rollups=True):
+    if not use_rollups or unit == 'minute':
+        return [('metrics', raw_series_pipeline({'$gte': start, '$lte': end}, unit, bin_size))]
+    aggregations = []
+    for source, *bounds in plan_ranges(start, end):
+        if source == 'raw':
+            aggregations.append(('metrics', raw_series_pipeline(*bounds, unit, bin_size)))
+        elif bounds[0] < bounds[1]:
+            if source == '1d' and unit == 'hour':
+                source = '1h'
+            aggregations.append((ROLLUPS[source][0], rollup_series_pipeline(*bounds, unit, bin_size)))
+    return aggregations
+
+# Merge the buckets returned by every aggregation into compact parallel
+# arrays, oldest first. Times are bucket starts in Unix seconds, reading the
+# stored timestamps as UTC.
+def series_body(days, start, end, unit, bin_size, parts):
+    buckets = {}
+    for doc in parts:
+        bucket = buckets.get(doc['_id'])
+        if bucket is None:
+            buckets[doc['_id']] = dict(doc)
+            continue
+        for field in SUMS:
+            bucket[field] += doc[field]
+        for field in MINS:
+            bucket[field] = min(bucket[field], doc[field])
+        for field in MAXES:
+            bucket[field] = max(bucket[field], doc[field])
+
+    ordered = [buckets[key] for key in sorted(buckets)]
+    return {
+        'period_days': days,
+        'data_start': start.strftime("%Y-%m-%d %H:%M:%S"),
+        'data_end': end.strftime("%Y-%m-%d %H:%M:%S"),
+        'step_seconds': UNIT_SECONDS[unit] * bin_size,
+        't': [int(bucket['_id'].replace(tzinfo=timezone.utc).timestamp()) for bucket in ordered],
+        'count': [bucket['count'] for bucket in ordered],
+        'uptime_avg': [round(bucket['uptime_sum'] / bucket['count'], 2) for bucket in ordered],
+        'uptime_min': [bucket['uptime_min'] for bucket in ordered],
+        'uptime_max': [bucket['uptime_max'] for bucket in ordered],
+        'users_avg': [round(bucket['users_sum'] / bucket['count'], 1) for bucket in ordered],
+        'users_min': [bucket['users_min'] for bucket in ordered],
+        'users_max': [bucket['users_max'] for bucket in ordered],
+    }
+
+# Window of the last `days` days and its bucket size for `points` points
+def series_window(days, points):
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    return (start, end) + choose_step(start, end, points)
+
+# Downsampled series of the last `days` days in at most `points` buckets
+def fetch_series(db, days, points, use_rollups=True):
+    start, end, unit, bin_size = series_window(days, points)
+    parts = [
+        doc
+        for collection_name, pipeline in series_aggregations(start, end, unit, bin_size, use_rollups)
+        for doc in db[collection_name].aggregate(pipeline)
+    ]
+    return series_body(days, start, end, unit, bin_size, parts)
@@ -0,0 +1,80 @@
+from functools import wraps
+from flask import Response
+import threading
+
+# Raised when a follower gives up waiting for the in-flight call it joined
+class SingleFlightTimeout(Exception):
+    pass
+
+# One in-flight call: followers block on the event until the leader finishes
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+# Coalesces concurrent identical calls within one worker: the first caller
+# (leader) runs the function, callers arriving while it is in flight wait for
+# it and share its result or exception. Nothing is kept once the call returns,
+# so this never serves stale data and is independent of any cache.
+class SingleFlight:
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self.stats = {'leaders': 0, 'shared': 0, 'timeouts': 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+            else:
+                call.followers += 1
+                self.stats['shared'] += 1
+
+        if not leader:
+            # Followers wait at most `timeout` seconds; the leader keeps running
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise SingleFlightTimeout(f"Timed out after {self.timeout}s waiting for {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    # Decorator coalescing concurrent requests that map to the same key_func().
+    # Responses are shared as (body, status, headers) so each caller gets its own
+    # Response object.
+    def coalesce(self, key_func):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.timeout <= 0:
+                    return view(*args, **kwargs)
+
+                def run():
+                    response = view(*args, **kwargs)
+                    if isinstance(response, tuple):
+                        body, status = response
+                        return body.get_data(), status, body.headers.to_wsgi_list()
+                    return response.get_data(), response.status_code, response.headers.to_wsgi_list()
+
+                body, status, headers = self.do(key_func(), run)
+                return Response(body, status=status, headers=headers)
+            return wrapper
+        return decorator
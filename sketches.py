@@ -0,0 +1,149 @@
+import math
+
+# Mergeable quantile sketches of the metric distributions. A sketch is a
+# histogram over logarithmically sized bins, so any quantile read from it is
+# within RELATIVE_ACCURACY of the exact value (the DDSketch construction).
+# Sketches merge by adding bin counts, which lets the rollup upserts maintain
+# one per bucket with $inc, and lets a query merge any number of buckets.
+# Uptime is sketched as downtime (100 - uptime), so the error is relative to
+# the small distance from 100% that the low uptime percentiles are about.
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LN_GAMMA = math.log(GAMMA)
+
+# Values at or below MIN_VALUE are counted in the zero bin
+MIN_VALUE = 1e-6
+ZERO_KEY = 'z'
+
+# Sketch field of a rollup bucket -> the sketched value, as an aggregation
+# expression over a raw metric
+SKETCHES = {
+    'users_sketch': '$users_connected',
+    'downtime_sketch': {'$subtract': [100, '$uptime']},
+}
+
+# Helper function to compute the sketched values of a raw metric, as SKETCHES does
+def sketch_values(metric):
+    return {
+        'users_sketch': metric['users_connected'],
+        'downtime_sketch': 100 - metric['uptime'],
+    }
+
+# Bin key of a value. Keys are strings so they can be used as field names.
+def sketch_key(value):
+    if value <= MIN_VALUE:
+        return ZERO_KEY
+    return str(math.ceil(math.log(value) / LN_GAMMA))
+
+# The same bin key computed server side, for a value expression
+def key_expression(value):
+    return {'$cond': [
+        {'$lte': [value, MIN_VALUE]},
+        ZERO_KEY,
+        {'$toString': {'$toInt': {'$ceil': {'$divide': [{'$ln': value}, LN_GAMMA]}}}}
+    ]}
+
+# Helper function to find the value a bin stands for, within RELATIVE_ACCURACY
+# of every value counted in it
+def bin_value(key):
+    if key == ZERO_KEY:
+        return 0.0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+# Value at quantile q (0..1) of a sketch given as {bin key: count};
+# None for an empty sketch
+def quantile(bins, q):
+    total = sum(bins.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    keys = sorted(bins, key=lambda key: -math.inf if key == ZERO_KEY else int(key))
+    for key in keys:
+        seen += bins[key]
+        if seen > rank:
+            return bin_value(key)
+    return bin_value(keys[-1])
+
+# Field name of the marker rollup_sketch_pipeline returns for each bucket
+# whose sketches do not account for all of its metrics
+MISSING_SKETCH = 'missing'
+
+# Pipeline sketching the raw metrics in a time range; one document per
+# non-empty bin: {'_id': {'f': sketch field, 'k': bin key}, 'n': count}
+def raw_sketch_pipeline(time_range):
+    return query_sketch_pipeline({'timestamp': time_range})
+
+# Same for the raw metrics matching any query
+def query_sketch_pipeline(query):
+    return [
+        {'$match': query},
+        {'$project': {'_id': 0, 'bins': [
+            {'f': field, 'k': key_expression(value)} for field, value in SKETCHES.items()
+        ]}},
+        {'$unwind': '$bins'},
+        {'$group': {'_id': {'f': '$bins.f', 'k': '$bins.k'}, 'n': {'$sum': 1}}}
+    ]
+
+# Pipeline merging the sketches of the rollup buckets that start inside
+# [start, end), in the same shape as raw_sketch_pipeline. Buckets written
+# before the sketches existed have none, or fewer bins than metrics; for each
+# of them a {'f': MISSING_SKETCH, 'k': bucket start} marker is returned
+# instead, for the caller to sketch the bucket from the raw metrics.
+def rollup_sketch_pipeline(start, end):
+    complete = {'$and': [
+        {'$eq': [{'$sum': {'$map': {'input': {'$objectToArray': {'$ifNull': [f"${field}", {}]}}, 'in': '$$this.v'}}},
+                 '$count']}
+        for field in SKETCHES
+    ]}
+    return [
+        {'$match': {'_id': {'$gte': start, '$lt': end}}},
+        {'$project': {'_id': 0, 'bins': {'$cond': [complete, {'$concatArrays': [
+            {'$map': {
+                'input': {'$objectToArray': {'$ifNull': [f"${field}", {}]}},
+                'in': {'f': field, 'k': '$$this.k', 'n': '$$this.v'}
+            }}
+            for field in SKETCHES
+        ]}, [{'f': MISSING_SKETCH, 'k': '$_id', 'n': 1}]]}}},
+        {'$unwind': '$bins'},
+        {'$group': {'_id': {'f': '$bins.f', 'k': '$bins.k'}, 'n': {'$sum': '$bins.n'}}}
+    ]
+
+# Pipeline stages turning the metrics of each rollup bucket into its sketch
+# fields, for rebuilding buckets server side; `bucket` is the bucket start
+def backfill_sketch_stages(bucket):
+    return [
+        {'$project': {'_id': 0, 'bucket': bucket, 'bins': [
+            {'f': field, 'k': key_expression(value)} for field, value in SKETCHES.items()
+        ]}},
+        {'$unwind': '$bins'},
+        {'$group': {'_id': {'b': '$bucket', 'f': '$bins.f', 'k': '$bins.k'}, 'n': {'$sum': 1}}},
+        {'$group': {'_id': {'b': '$_id.b', 'f': '$_id.f'}, 'bins': {'$push': {'k': '$_id.k', 'v': '$n'}}}},
+        {'$group': {'_id': '$_id.b', 'sketches': {'$push': {'k': '$_id.f', 'v': {'$arrayToObject': '$bins'}}}}},
+        {'$replaceWith': {'$mergeObjects': [{'_id': '$_id'}, {'$arrayToObject': '$sketches'}]}}
+    ]
+
+# Merge the bins returned by every sketch aggregation into one sketch per field
+def merge_sketches(parts):
+    sketches = {field: {} for field in SKETCHES}
+    for doc in parts:
+        bins = sketches[doc['_id']['f']]
+        bins[doc['_id']['k']] = bins.get(doc['_id']['k'], 0) + doc['n']
+    return sketches
+
+# Percentiles (0..100) of connected users and uptime from the merged sketches.
+# Uptime pN is read from the downtime sketch at 1 - N/100.
+def percentiles_body(sketches, percentiles):
+    users, uptime = {}, {}
+    for p in percentiles:
+        name = f"p{p:g}"
+        value = quantile(sketches['users_sketch'], p / 100)
+        users[name] = round(value) if value is not None else None
+        value = quantile(sketches['downtime_sketch'], 1 - p / 100)
+        uptime[name] = round(100 - value, 2) if value is not None else None
+    return {
+        'users_connected': users,
+        'uptime': uptime,
+        'relative_error': RELATIVE_ACCURACY,
+    }
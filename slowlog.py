@@ -0,0 +1,201 @@
+from pymongo import monitoring
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Read commands that are explained when slow
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+
+# Commands flagged when slow; writes and getMore are logged but not explained
+TRACKED = EXPLAINABLE | {'getMore', 'insert', 'update', 'delete', 'findAndModify'}
+
+# Fields of a command that describe its shape: the first ones hold values
+# and are redacted, the others only name fields and are logged as is
+REDACTED_FIELDS = ('filter', 'query', 'pipeline', 'projection', 'updates', 'deletes')
+PLAIN_FIELDS = ('sort', 'key', 'hint')
+
+# Command fields added by the driver that explain does not accept
+DRIVER_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern', 'writeConcern'}
+
+# Keys whose value is an aggregation expression, where "$name" strings are
+# field paths (and "$$name" variables) rather than values. Anywhere else, such
+# as a $regex pattern in a filter, a string starting with "$" is a literal.
+EXPRESSION_KEYS = {
+    '$expr', '$group', '$project', '$addFields', '$set', '$unwind', '$replaceWith', '$replaceRoot',
+    '$bucket', '$bucketAuto', '$sortByCount',
+}
+
+# Replace every literal of a filter, pipeline or sort by "?" while keeping
+# field names, operators and the "$field" references of expressions, so log
+# lines can be grouped by query shape without leaking the values searched for
+def redact(value, expression=False):
+    if isinstance(value, dict):
+        return {
+            key: '?' if key == '$literal' else redact(item, expression or key in EXPRESSION_KEYS)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        shapes = [redact(item, expression) for item in value]
+        # Collapse lists of literals such as $in arrays
+        return ['?'] if shapes and all(shape == '?' for shape in shapes) else shapes
+    if expression and isinstance(value, str) and value.startswith('$'):
+        return value
+    return '?'
+
+# Collection targeted by a command, or None for database commands
+def command_collection(command_name, command):
+    collection = command.get(command_name)
+    if isinstance(collection, str):
+        return collection
+    return command.get('collection')
+
+# Number of documents returned or affected according to a command reply
+def returned_count(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if 'values' in reply:
+        return len(reply['values'])
+    return reply.get('n')
+
+# Stage names of a winning plan, outermost first, e.g. ["FETCH", "IXSCAN"]
+def plan_stages(plan):
+    stages = []
+    while isinstance(plan, dict):
+        plan = plan.get('queryPlan', plan)
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        inputs = plan.get('inputStages') or ([plan['inputStage']] if 'inputStage' in plan else [])
+        for extra in inputs[1:]:
+            stages += plan_stages(extra)
+        plan = inputs[0] if inputs else None
+    return stages
+
+# First sub-document of an explain output holding the given key; aggregate
+# explains nest the query planner output inside their first stage
+def find_section(explain, key):
+    if isinstance(explain, dict):
+        if key in explain:
+            return explain[key]
+        children = explain.values()
+    elif isinstance(explain, list):
+        children = explain
+    else:
+        return None
+    for child in children:
+        found = find_section(child, key)
+        if found is not None:
+            return found
+    return None
+
+# Digest of explain('executionStats'): plan stages and examined/returned counts
+def summarize_explain(explain):
+    stats = find_section(explain, 'executionStats') or {}
+    planner = find_section(explain, 'queryPlanner') or {}
+    stages = plan_stages(planner.get('winningPlan'))
+    returned = stats.get('nReturned')
+    keys = stats.get('totalKeysExamined')
+    docs = stats.get('totalDocsExamined')
+    return {
+        'plan': ' > '.join(stages),
+        'collscan': 'COLLSCAN' in stages,
+        'nReturned': returned,
+        'keysExamined': keys,
+        'docsExamined': docs,
+        'docsExaminedPerReturned': round(docs / max(returned, 1), 1) if docs is not None and returned is not None else None,
+        'executionTimeMillis': stats.get('executionTimeMillis')
+    }
+
+# Command listener logging MongoDB operations slower than a threshold with
+# their redacted shape, duration and number of documents returned. A sample of
+# slow queries is re-run with explain('executionStats') on a background thread,
+# at most once per shape per interval, to log the plan and how many keys and
+# documents it examined.
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self, threshold_ms=100, explain_rate=0.1, explain_interval=60, queue_size=32):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.explain_interval = explain_interval
+        self.mongo = None  # set once the Mongo handle exists, used to run explains
+        self.stats = {'slow': 0, 'explained': 0, 'explain_dropped': 0}
+        self._commands = {}
+        self._last_explained = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in TRACKED:
+            self._commands[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        started = self._commands.pop((event.connection_id, event.request_id), None)
+        if started is not None and event.duration_micros >= self.threshold_ms * 1000:
+            self._record(event, *started, returned_count(event.reply))
+
+    def failed(self, event):
+        started = self._commands.pop((event.connection_id, event.request_id), None)
+        if started is not None and event.duration_micros >= self.threshold_ms * 1000:
+            self._record(event, *started, None, error=event.failure.get('errmsg'))
+
+    def _record(self, event, database, command, returned, error=None):
+        shape = {field: redact(command[field]) for field in REDACTED_FIELDS if field in command}
+        shape.update({field: command[field] for field in PLAIN_FIELDS if field in command})
+        entry = {
+            'command': event.command_name,
+            'database': database,
+            'collection': command_collection(event.command_name, command),
+            'duration_ms': round(event.duration_micros / 1000, 1),
+            'nReturned': returned,
+            'shape': shape
+        }
+        if error:
+            entry['error'] = error
+        with self._lock:
+            self.stats['slow'] += 1
+        logger.warning(f"Slow query: {json.dumps(entry, default=str)}")
+
+        if (self.mongo is not None and event.command_name in EXPLAINABLE
+                and random.random() < self.explain_rate):
+            self._submit_explain(entry, command)
+
+    def _submit_explain(self, entry, command):
+        key = json.dumps([entry['database'], entry['collection'], entry['command'], entry['shape']],
+                         sort_keys=True, default=str)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_explained.get(key, -self.explain_interval) < self.explain_interval:
+                return
+            self._last_explained[key] = now
+            # Started lazily, and again in a forked worker, which has no threads
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                threading.Thread(target=self._explain_loop, name='slow-query-explain', daemon=True).start()
+                self._worker_pid = os.getpid()
+        explained = {field: value for field, value in command.items()
+                     if not field.startswith('$') and field not in DRIVER_FIELDS}
+        try:
+            self._queue.put_nowait((entry, explained))
+        except queue.Full:
+            with self._lock:
+                self.stats['explain_dropped'] += 1
+
+    def _explain_loop(self):
+        while True:
+            entry, command = self._queue.get()
+            try:
+                explain = self.mongo.client[entry['database']].command(
+                    {'explain': command, 'verbosity': 'executionStats'})
+                summary = summarize_explain(explain)
+                with self._lock:
+                    self.stats['explained'] += 1
+                log = logger.warning if summary['collscan'] else logger.info
+                log(f"Slow query explain: {json.dumps(dict(entry, explain=summary), default=str)}")
+            except Exception as e:
+                logger.error(f"Error explaining slow {entry['command']} on {entry['collection']}: {e}")
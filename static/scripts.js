@@ -5,25 +5,49 @@ const ITEMS_PER_PAGE = 10;
 let metricsChartInstance = null;
 let usersChartInstance = null;
 
+// Maximum number of points on the charts; the server averages metrics into
+// buckets so that the selected range fits
+const CHART_POINTS = 120;
+
+// Arrays of a chart series, and the origin of its buckets (2000-01-01 UTC, as
+// MongoDB's $dateTrunc) in Unix seconds
+const SERIES_FIELDS = ['t', 'count', 'uptime_avg', 'uptime_min', 'uptime_max', 'users_avg', 'users_min', 'users_max'];
+const SERIES_EPOCH = 946684800;
+
+// Series currently shown on the charts
+let chartSeries = null;
+
+// Live update stream, whether it has connected before, and the pending summary reload
+let liveStream = null;
+let liveStreamConnected = false;
+let summaryReloadTimer = null;
+
+// Last pagination block received per table, kept current by live updates
+const paginationState = {};
+
+// Last ETag and body received per URL, used for conditional requests
+const responseCache = new Map();
+
 // DOM Elements
 document.addEventListener("DOMContentLoaded", function () {
+    // Initialize charts
+    initCharts();
+    
     // Initialize the app
     initApp();
     
     // Set up event listeners
     setupEventListeners();
     
-    // Initialize charts
-    initCharts();
+    // Receive new data as it is written
+    connectLiveUpdates();
 });
 
 /**
  * Initialize the application
  */
 function initApp() {
-    loadDashboardSummary();
-    loadTables();
-    updateHealthStatus();
+    loadDashboard();
     
     // Initialize tooltips
     if (typeof bootstrap !== 'undefined') {
@@ -141,9 +165,27 @@ function initCharts() {
             maintainAspectRatio: false
         }
     });
+}
+
+/**
+ * Fetch JSON from the API, sending the ETag of the previous response so the
+ * server can answer 304 Not Modified when nothing changed
+ */
+async function fetchJSON(url) {
+    const cached = responseCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
     
-    // Load initial chart data
-    refreshCharts();
+    const response = await fetch(url, { headers });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        responseCache.set(url, { etag, data });
+    }
+    return data;
 }
 
 /**
@@ -152,12 +194,10 @@ function initCharts() {
 async function refreshCharts() {
     try {
         const days = document.getElementById('time-range').value;
-        const response = await fetch(`/api/metrics?per_page=100&page=1`);
-        const data = await response.json();
+        const data = await fetchJSON(`/api/metrics/series?days=${days}&points=${CHART_POINTS}`);
         
-        if (data && data.data) {
-            updateMetricsChart(data.data);
-            updateUsersChart(data.data);
+        if (data && data.t) {
+            renderCharts(data);
         }
     } catch (error) {
         console.error('Error loading chart data:', error);
@@ -165,48 +205,231 @@ async function refreshCharts() {
     }
 }
 
+/**
+ * Format a bucket start (Unix seconds) as a chart label, with the time of day
+ * when buckets are shorter than a day
+ */
+function chartLabel(time, step) {
+    const options = { month: 'short', day: 'numeric', timeZone: 'UTC' };
+    if (step < 86400) {
+        options.hour = '2-digit';
+        options.minute = '2-digit';
+    }
+    return new Date(time * 1000).toLocaleString('en-US', options);
+}
+
+/**
+ * Show a series on both charts
+ */
+function renderCharts(series) {
+    chartSeries = series;
+    updateMetricsChart(series);
+    updateUsersChart(series);
+}
+
 /**
  * Update the uptime metrics chart
  */
-function updateMetricsChart(data) {
-    // Sort by timestamp
-    const sortedData = [...data].sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+function updateMetricsChart(series) {
+    metricsChartInstance.data.labels = series.t.map(time => chartLabel(time, series.step_seconds));
+    metricsChartInstance.data.datasets[0].data = series.uptime_avg;
+    metricsChartInstance.update();
+}
+
+/**
+ * Update the users chart
+ */
+function updateUsersChart(series) {
+    usersChartInstance.data.labels = series.t.map(time => chartLabel(time, series.step_seconds));
+    usersChartInstance.data.datasets[0].data = series.users_avg;
+    usersChartInstance.update();
+}
+
+/**
+ * Fold a metric received from the live stream into the chart series: into the
+ * last bucket when it falls inside it, otherwise as a new bucket, dropping
+ * buckets that slid out of the selected range
+ */
+function addToSeries(metric) {
+    const series = chartSeries;
+    if (!series) {
+        return;
+    }
+    const step = series.step_seconds;
+    // Timestamps are shown as stored, so read them as UTC like the server does
+    const time = Date.parse(metric.timestamp.replace(' ', 'T') + 'Z') / 1000;
+    const bucket = SERIES_EPOCH + Math.floor((time - SERIES_EPOCH) / step) * step;
+    const last = series.t.length - 1;
+    
+    if (last >= 0 && bucket === series.t[last]) {
+        const count = series.count[last];
+        series.uptime_avg[last] = Math.round((series.uptime_avg[last] * count + metric.uptime) / (count + 1) * 100) / 100;
+        series.users_avg[last] = Math.round((series.users_avg[last] * count + metric.users_connected) / (count + 1) * 10) / 10;
+        series.uptime_min[last] = Math.min(series.uptime_min[last], metric.uptime);
+        series.uptime_max[last] = Math.max(series.uptime_max[last], metric.uptime);
+        series.users_min[last] = Math.min(series.users_min[last], metric.users_connected);
+        series.users_max[last] = Math.max(series.users_max[last], metric.users_connected);
+        series.count[last] = count + 1;
+    } else if (last < 0 || bucket > series.t[last]) {
+        const values = [bucket, 1, metric.uptime, metric.uptime, metric.uptime,
+            metric.users_connected, metric.users_connected, metric.users_connected];
+        SERIES_FIELDS.forEach((field, index) => series[field].push(values[index]));
+        
+        const oldest = time - series.period_days * 86400;
+        while (series.t.length && series.t[0] + step <= oldest) {
+            SERIES_FIELDS.forEach(field => series[field].shift());
+        }
+    } else {
+        // Late metric for an earlier bucket; it shows on the next reload
+        return;
+    }
+    renderCharts(series);
+}
+
+/**
+ * Subscribe to /api/stream and apply new metrics and notifications as they
+ * arrive, instead of polling the API
+ */
+function connectLiveUpdates() {
+    if (typeof EventSource === 'undefined') {
+        return;
+    }
+    liveStream = new EventSource('/api/stream');
+    
+    liveStream.addEventListener('open', function() {
+        // Anything written while disconnected was missed
+        if (liveStreamConnected) {
+            reloadAfterGap();
+        }
+        liveStreamConnected = true;
+    });
     
-    // Get the last 30 entries
-    const chartData = sortedData.slice(-30);
+    liveStream.addEventListener('metrics', function(event) {
+        const metric = JSON.parse(event.data);
+        addLiveRow(metric, 'metrics');
+        addToSeries(metric);
+        scheduleSummaryReload();
+    });
     
-    const labels = chartData.map(item => {
-        const date = new Date(item.timestamp);
-        return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+    liveStream.addEventListener('notifications', function(event) {
+        addLiveRow(JSON.parse(event.data), 'notifications');
     });
     
-    const uptimeData = chartData.map(item => item.uptime);
+    // The server dropped events because this page fell behind
+    liveStream.addEventListener('resync', reloadAfterGap);
     
-    metricsChartInstance.data.labels = labels;
-    metricsChartInstance.data.datasets[0].data = uptimeData;
-    metricsChartInstance.update();
+    liveStream.addEventListener('error', function() {
+        // The browser reconnects by itself unless the server refused the
+        // stream (for example when the worker has too many clients)
+        if (liveStream.readyState === EventSource.CLOSED) {
+            setTimeout(connectLiveUpdates, 30000);
+        }
+    });
 }
 
 /**
- * Update the users chart
+ * Reload everything over the REST API after live updates were missed
  */
-function updateUsersChart(data) {
-    // Sort by timestamp
-    const sortedData = [...data].sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-    
-    // Get the last 30 entries
-    const chartData = sortedData.slice(-30);
+function reloadAfterGap() {
+    loadDashboard();
+}
+
+/**
+ * Reload the summary a few seconds after new metrics, once per burst
+ */
+function scheduleSummaryReload() {
+    if (summaryReloadTimer) {
+        return;
+    }
+    summaryReloadTimer = setTimeout(() => {
+        summaryReloadTimer = null;
+        loadDashboardSummary();
+    }, 5000);
+}
+
+/**
+ * Whether a date range or keyword filter is applied to the tables
+ */
+function filtersActive() {
+    return Boolean(document.getElementById('start-date').value ||
+        document.getElementById('end-date').value ||
+        document.getElementById('search-keyword').value.trim());
+}
+
+/**
+ * Count a new document in a table's pagination and, on the first page, show it
+ * at the top. Filtered tables are left alone since the row may not match.
+ */
+function addLiveRow(item, tableType) {
+    if (filtersActive()) {
+        return;
+    }
     
-    const labels = chartData.map(item => {
-        const date = new Date(item.timestamp);
-        return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-    });
+    const pagination = paginationState[tableType];
+    if (pagination && pagination.total !== null && pagination.total !== undefined) {
+        pagination.total++;
+        pagination.pages = Math.ceil(pagination.total / pagination.per_page);
+        updatePagination(pagination, tableType);
+    }
     
-    const usersData = chartData.map(item => item.users_connected);
+    const currentPage = tableType === 'metrics' ? currentMetricsPage : currentNotificationsPage;
+    if (currentPage !== 1) {
+        return;
+    }
     
-    usersChartInstance.data.labels = labels;
-    usersChartInstance.data.datasets[0].data = usersData;
-    usersChartInstance.update();
+    const tableId = `${tableType}-table`;
+    const tableBody = document.querySelector(`#${tableId} tbody`);
+    // Replace the "No data found" placeholder
+    if (tableBody.querySelector('td[colspan]')) {
+        tableBody.innerHTML = '';
+    }
+    tableBody.insertBefore(buildRow(item, tableId), tableBody.firstChild);
+    while (tableBody.rows.length > ITEMS_PER_PAGE) {
+        tableBody.deleteRow(-1);
+    }
+}
+
+/**
+ * Load everything the dashboard shows (summary, health, both tables and the
+ * chart data) in a single request
+ */
+async function loadDashboard() {
+    try {
+        const days = document.getElementById('time-range').value;
+        const url = `/api/dashboard?days=${days}&points=${CHART_POINTS}&per_page=${ITEMS_PER_PAGE}` +
+            `&metrics_page=${currentMetricsPage}&notifications_page=${currentNotificationsPage}` +
+            filterParams();
+        
+        const data = await fetchJSON(url);
+        if (data.error) {
+            throw new Error(data.error);
+        }
+        
+        if (data.summary) {
+            renderSummary(data.summary);
+        }
+        if (data.health) {
+            renderHealth(data.health);
+        }
+        if (data.metrics) {
+            populateTable(data.metrics.data, 'metrics-table');
+            updatePagination(data.metrics.pagination, 'metrics');
+        }
+        if (data.notifications) {
+            populateTable(data.notifications.data, 'notifications-table');
+            updatePagination(data.notifications.pagination, 'notifications');
+        }
+        if (data.series) {
+            renderCharts(data.series);
+        }
+        if (data.errors) {
+            console.error('Dashboard parts failed:', data.errors);
+            showToast('Some dashboard data could not be loaded', 'error');
+        }
+    } catch (error) {
+        console.error('Error loading dashboard:', error);
+        showToast('Error loading dashboard', 'error');
+    }
 }
 
 /**
@@ -214,12 +437,7 @@ function updateUsersChart(data) {
  */
 async function refreshAllData() {
     try {
-        await Promise.all([
-            loadDashboardSummary(),
-            loadTables(),
-            updateHealthStatus(),
-            refreshCharts()
-        ]);
+        await loadDashboard();
         showToast('Data refreshed successfully', 'success');
     } catch (error) {
         console.error('Error refreshing data:', error);
@@ -233,30 +451,10 @@ async function refreshAllData() {
 async function loadDashboardSummary() {
     try {
         const days = document.getElementById('time-range').value;
-        const response = await fetch(`/api/metrics/summary?days=${days}`);
-        const data = await response.json();
+        const data = await fetchJSON(`/api/metrics/summary?days=${days}`);
         
         if (data) {
-            document.getElementById('avg-uptime').textContent = data.avg_uptime + '%';
-            document.getElementById('max-users').textContent = data.max_concurrent_users;
-            document.getElementById('avg-users').textContent = Math.round(data.avg_users);
-            document.getElementById('suspicious-count').textContent = data.suspicious_activities;
-            
-            // Update the progress bar
-            const uptimeBar = document.getElementById('uptime-progress');
-            uptimeBar.style.width = data.avg_uptime + '%';
-            uptimeBar.setAttribute('aria-valuenow', data.avg_uptime);
-            
-            // Set classes based on uptime value
-            if (data.avg_uptime >= 99) {
-                uptimeBar.className = 'progress-bar bg-success';
-            } else if (data.avg_uptime >= 95) {
-                uptimeBar.className = 'progress-bar bg-info';
-            } else if (data.avg_uptime >= 90) {
-                uptimeBar.className = 'progress-bar bg-warning';
-            } else {
-                uptimeBar.className = 'progress-bar bg-danger';
-            }
+            renderSummary(data);
         }
     } catch (error) {
         console.error('Error loading dashboard summary:', error);
@@ -264,6 +462,32 @@ async function loadDashboardSummary() {
     }
 }
 
+/**
+ * Show the summary statistics
+ */
+function renderSummary(data) {
+    document.getElementById('avg-uptime').textContent = data.avg_uptime + '%';
+    document.getElementById('max-users').textContent = data.max_concurrent_users;
+    document.getElementById('avg-users').textContent = Math.round(data.avg_users);
+    document.getElementById('suspicious-count').textContent = data.suspicious_activities;
+    
+    // Update the progress bar
+    const uptimeBar = document.getElementById('uptime-progress');
+    uptimeBar.style.width = data.avg_uptime + '%';
+    uptimeBar.setAttribute('aria-valuenow', data.avg_uptime);
+    
+    // Set classes based on uptime value
+    if (data.avg_uptime >= 99) {
+        uptimeBar.className = 'progress-bar bg-success';
+    } else if (data.avg_uptime >= 95) {
+        uptimeBar.className = 'progress-bar bg-info';
+    } else if (data.avg_uptime >= 90) {
+        uptimeBar.className = 'progress-bar bg-warning';
+    } else {
+        uptimeBar.className = 'progress-bar bg-danger';
+    }
+}
+
 /**
  * Load both data tables
  */
@@ -274,23 +498,29 @@ async function loadTables() {
     ]);
 }
 
+/**
+ * Query string for the date range and keyword filters, starting with "&"
+ */
+function filterParams() {
+    const startDate = document.getElementById('start-date').value;
+    const endDate = document.getElementById('end-date').value;
+    const keyword = document.getElementById('search-keyword').value.trim();
+    
+    let params = '';
+    if (startDate) params += `&start_date=${startDate}`;
+    if (endDate) params += `&end_date=${endDate}`;
+    if (keyword) params += `&keyword=${encodeURIComponent(keyword)}`;
+    return params;
+}
+
 /**
  * Fetch and display metrics data with pagination
  */
 async function loadMetricsTable() {
     try {
-        const startDate = document.getElementById('start-date').value;
-        const endDate = document.getElementById('end-date').value;
-        const keyword = document.getElementById('search-keyword').value.trim();
-        
-        let url = `/api/metrics?page=${currentMetricsPage}&per_page=${ITEMS_PER_PAGE}`;
+        const url = `/api/metrics?page=${currentMetricsPage}&per_page=${ITEMS_PER_PAGE}` + filterParams();
         
-        if (startDate) url += `&start_date=${startDate}`;
-        if (endDate) url += `&end_date=${endDate}`;
-        if (keyword) url += `&keyword=${encodeURIComponent(keyword)}`;
-        
-        const response = await fetch(url);
-        const data = await response.json();
+        const data = await fetchJSON(url);
         
         if (data && data.data) {
             populateTable(data.data, 'metrics-table');
@@ -307,18 +537,9 @@ async function loadMetricsTable() {
  */
 async function loadNotificationsTable() {
     try {
-        const startDate = document.getElementById('start-date').value;
-        const endDate = document.getElementById('end-date').value;
-        const keyword = document.getElementById('search-keyword').value.trim();
-        
-        let url = `/api/notifications?page=${currentNotificationsPage}&per_page=${ITEMS_PER_PAGE}`;
+        const url = `/api/notifications?page=${currentNotificationsPage}&per_page=${ITEMS_PER_PAGE}` + filterParams();
         
-        if (startDate) url += `&start_date=${startDate}`;
-        if (endDate) url += `&end_date=${endDate}`;
-        if (keyword) url += `&keyword=${encodeURIComponent(keyword)}`;
-        
-        const response = await fetch(url);
-        const data = await response.json();
+        const data = await fetchJSON(url);
         
         if (data && data.data) {
             populateTable(data.data, 'notifications-table');
@@ -334,6 +555,7 @@ async function loadNotificationsTable() {
  * Update the pagination controls based on data
  */
 function updatePagination(pagination, tableType) {
+    paginationState[tableType] = pagination;
     const currentPage = pagination.page;
     const totalPages = pagination.pages;
     
@@ -376,54 +598,70 @@ function populateTable(data, tableId) {
     }
     
     data.forEach(item => {
-        const row = document.createElement('tr');
-        
-        if (tableId === 'metrics-table') {
-            // Format the date
-            const timestamp = new Date(item.timestamp).toLocaleString();
-            
-            // Create cells
-            row.innerHTML = `
-                <td>${timestamp}</td>
-                <td>
-                    <div class="progress" style="height: 20px;">
-                        <div class="progress-bar ${getUptimeClass(item.uptime)}" 
-                             role="progressbar" 
-                             style="width: ${item.uptime}%" 
-                             aria-valuenow="${item.uptime}" 
-                             aria-valuemin="0" 
-                             aria-valuemax="100">
-                            ${item.uptime}%
-                        </div>
-                    </div>
-                </td>
-                <td>${item.users_connected}</td>
-                <td>
-                    <span class="badge ${item.activity === 'Suspicious' ? 'bg-danger' : 'bg-success'}">
-                        ${item.activity}
-                    </span>
-                </td>
-            `;
-        } else {
-            // Format the date for notifications
-            const timestamp = new Date(item.timestamp).toLocaleString();
-            
-            // Create cells
-            row.innerHTML = `
-                <td>${timestamp}</td>
-                <td>
-                    <span class="badge bg-warning text-dark">
-                        ${item.event_type}
-                    </span>
-                </td>
-                <td>${item.description}</td>
-            `;
-        }
-        
-        tableBody.appendChild(row);
+        tableBody.appendChild(buildRow(item, tableId));
     });
 }
 
+/**
+ * Build the table row for one metric or notification. Cells are built as DOM
+ * nodes with textContent so stored values are never parsed as HTML.
+ */
+function buildRow(item, tableId) {
+    const row = document.createElement('tr');
+    
+    // Format the date
+    const timestamp = new Date(item.timestamp).toLocaleString();
+    appendCell(row, timestamp);
+    
+    if (tableId === 'metrics-table') {
+        const uptime = Number(item.uptime);
+        const progress = document.createElement('div');
+        progress.className = 'progress';
+        progress.style.height = '20px';
+        const bar = document.createElement('div');
+        bar.className = `progress-bar ${getUptimeClass(uptime)}`;
+        bar.setAttribute('role', 'progressbar');
+        bar.style.width = `${uptime}%`;
+        bar.setAttribute('aria-valuenow', uptime);
+        bar.setAttribute('aria-valuemin', '0');
+        bar.setAttribute('aria-valuemax', '100');
+        bar.textContent = `${item.uptime}%`;
+        progress.appendChild(bar);
+        appendCell(row, progress);
+        
+        appendCell(row, item.users_connected);
+        appendCell(row, badge(item.activity, item.activity === 'Suspicious' ? 'bg-danger' : 'bg-success'));
+    } else {
+        appendCell(row, badge(item.event_type, 'bg-warning text-dark'));
+        appendCell(row, item.description);
+    }
+    
+    return row;
+}
+
+/**
+ * Append a cell holding a DOM node or, for any other value, its text
+ */
+function appendCell(row, content) {
+    const cell = document.createElement('td');
+    if (content instanceof Node) {
+        cell.appendChild(content);
+    } else {
+        cell.textContent = content;
+    }
+    row.appendChild(cell);
+}
+
+/**
+ * Create a Bootstrap badge showing text
+ */
+function badge(text, className) {
+    const span = document.createElement('span');
+    span.className = `badge ${className}`;
+    span.textContent = text;
+    return span;
+}
+
 /**
  * Get the appropriate Bootstrap class for uptime percentage
  */
@@ -463,42 +701,27 @@ function resetFilters() {
 }
 
 /**
- * Check and update system health status
+ * Show the system health status
  */
-async function updateHealthStatus() {
-    try {
-        const response = await fetch('/api/health');
-        const data = await response.json();
-        
-        const statusElement = document.getElementById('health-status');
-        const statusIconElement = document.getElementById('health-status-icon');
+function renderHealth(data) {
+    const statusElement = document.getElementById('health-status');
+    const statusIconElement = document.getElementById('health-status-icon');
+    
+    if (data.status === 'healthy') {
+        statusElement.textContent = 'Healthy';
+        statusElement.className = 'badge bg-success';
+        statusIconElement.className = 'fas fa-check-circle text-success';
         
-        if (data.status === 'healthy') {
-            statusElement.textContent = 'Healthy';
-            statusElement.className = 'badge bg-success';
-            statusIconElement.className = 'fas fa-check-circle text-success';
-            
-            // Update last checked time
-            document.getElementById('last-health-check').textContent = 
-                `Last checked: ${new Date().toLocaleTimeString()}`;
-        } else {
-            statusElement.textContent = 'Unhealthy';
-            statusElement.className = 'badge bg-danger';
-            statusIconElement.className = 'fas fa-exclamation-circle text-danger';
-            
-            // Show error details
-            console.error('Health check failed:', data.error);
-        }
-    } catch (error) {
-        console.error('Error checking system health:', error);
-        
-        // Update UI to show error
-        const statusElement = document.getElementById('health-status');
-        statusElement.textContent = 'Error';
+        // Update last checked time
+        document.getElementById('last-health-check').textContent = 
+            `Last checked: ${data.checked_at}`;
+    } else {
+        statusElement.textContent = 'Unhealthy';
         statusElement.className = 'badge bg-danger';
-        
-        const statusIconElement = document.getElementById('health-status-icon');
         statusIconElement.className = 'fas fa-exclamation-circle text-danger';
+        
+        // Show error details
+        console.error('Health check failed:', data.error);
     }
 }
 
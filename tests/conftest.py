@@ -0,0 +1,22 @@
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+import os
+import pytest
+
+# Tests using the mongo_db fixture run against a real mongod, given by
+# MONGO_TEST_URI, and are skipped when none is reachable
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI", "mongodb://localhost:27017/")
+
+@pytest.fixture
+def mongo_db():
+    client = MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        client.close()
+        pytest.skip(f"no mongod reachable at {MONGO_TEST_URI}")
+    name = f"monitoring_test_{os.getpid()}"
+    client.drop_database(name)
+    yield client[name]
+    client.drop_database(name)
+    client.close()
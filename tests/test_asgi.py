@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+import threading
+import time
+
+pytest.importorskip('asgiref')
+import asgi  # noqa: E402
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+# Slow WSGI app recording the threads it ran on
+def make_wsgi_app(threads):
+    def wsgi_app(environ, start_response):
+        threads.add(threading.get_ident())
+        time.sleep(0.3)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+    return wsgi_app
+
+async def call(app):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/export', 'query_string': b'', 'headers': [],
+             'http_version': '1.1', 'server': ('test', 80)}
+    await app(scope, receive, send)
+    return messages
+
+def test_delegated_requests_run_concurrently():
+    threads = set()
+    app = asgi.PooledWsgiToAsgi(make_wsgi_app(threads), max_workers=4)
+
+    async def run():
+        return await asyncio.gather(*(call(app) for _ in range(4)))
+
+    started = time.monotonic()
+    results = asyncio.run(run())
+    assert time.monotonic() - started < 1.0
+    assert len(threads) == 4
+    for messages in results:
+        assert messages[0]['status'] == 200 and messages[1]['body'] == b'ok'
+
+def test_delegated_response_is_closed_and_truncated_to_content_length():
+    closed = []
+
+    class Body:
+        def __iter__(self):
+            return iter([b'abc', b'def'])
+
+        def close(self):
+            closed.append(True)
+
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Length', '4')])
+        return Body()
+
+    messages = asyncio.run(call(asgi.PooledWsgiToAsgi(wsgi_app, max_workers=1)))
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == b'abcd'
+    assert messages[-1] == {'type': 'http.response.body'} and closed
+
+def test_request_key_encodes_arguments():
+    assert asgi.request_key('/api/metrics', MultiDict([('b', '2'), ('a', '1')])) == '/api/metrics?a=1&b=2'
+    assert asgi.request_key('/api/metrics', MultiDict([('a', '1&b=2')])) != \
+        asgi.request_key('/api/metrics', MultiDict([('a', '1'), ('b', '2')]))
+
+def test_stale_or_failed_health_is_not_ready():
+    fresh = {'ok': True, 'checked_at': time.time(), 'ping_ms': 1}
+    assert asgi.health_error(fresh) is None
+    assert asgi.health_error(dict(fresh, checked_at=time.time() - asgi.HEALTH_MAX_AGE - 1)) == 'Health check is stale'
+    assert asgi.health_error({'ok': False, 'error': 'down', 'checked_at': time.time()}) == 'down'
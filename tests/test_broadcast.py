@@ -0,0 +1,64 @@
+from bson import ObjectId
+from broadcast import ChangeBroadcaster
+from datetime import datetime, timedelta, timezone
+import time
+
+# Stand-in for the Mongo handle, over the test database
+class FakeMongo:
+    def __init__(self, db):
+        self.db = db
+
+# Listener recording what the broadcaster delivers
+class Recorder:
+    def __init__(self):
+        self.ids = []
+        self.resyncs = 0
+
+    def insert(self, collection_name, doc):
+        self.ids.append(doc['_id'])
+
+    def changed(self, collection_name, version):
+        pass
+
+    def resync(self):
+        self.resyncs += 1
+
+def polling(db, **options):
+    broadcaster = ChangeBroadcaster(FakeMongo(db), ['metrics'], poll_interval=0.05, **options)
+    broadcaster.mode = 'poll'
+    recorder = Recorder()
+    broadcaster.add_listener(recorder)
+    assert broadcaster.start(wait=5)
+    return broadcaster, recorder
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_poll_publishes_new_documents_in_id_order(mongo_db):
+    mongo_db.metrics.insert_one({'uptime': 1})
+    _, recorder = polling(mongo_db)
+    ids = mongo_db.metrics.insert_many([{'uptime': n} for n in range(5)]).inserted_ids
+    assert wait_for(lambda: recorder.ids == ids)
+    assert recorder.resyncs == 0
+
+def test_poll_resyncs_on_an_insert_below_the_newest_id(mongo_db):
+    # Generated by another process before this one's insert, visible after it
+    late = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=5))
+    _, recorder = polling(mongo_db)
+    newer = mongo_db.metrics.insert_one({'uptime': 1}).inserted_id
+    assert wait_for(lambda: recorder.ids == [newer])
+    mongo_db.metrics.insert_one({'_id': late, 'uptime': 2})
+    assert wait_for(lambda: recorder.resyncs == 1)
+    # The baseline is taken again and polling goes on
+    latest = mongo_db.metrics.insert_one({'uptime': 3}).inserted_id
+    assert wait_for(lambda: recorder.ids[-1] == latest)
+    assert recorder.resyncs == 1
+
+def test_poll_resyncs_when_a_page_is_full(mongo_db):
+    broadcaster, recorder = polling(mongo_db, buffer_size=3)
+    mongo_db.metrics.insert_many([{'uptime': n} for n in range(10)])
+    assert wait_for(lambda: recorder.resyncs == 1)
+    assert recorder.ids == [] and broadcaster.stats['resyncs'] == 1
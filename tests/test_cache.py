@@ -0,0 +1,96 @@
+from cache import LRUBackend, ResponseCache
+from flask import Flask, jsonify
+from totals import CountCache
+import time
+
+def test_lru_evicts_least_recently_used():
+    backend = LRUBackend(max_entries=2)
+    backend.set('a', 1, 60, ['metrics'])
+    backend.set('b', 2, 60, ['metrics'])
+    assert backend.get('a') == 1
+    backend.set('c', 3, 60, ['metrics'])
+    assert backend.get('b') is None and backend.get('a') == 1 and backend.get('c') == 3
+
+def test_lru_expires_entries():
+    backend = LRUBackend()
+    backend.set('a', 1, -1, [])
+    assert backend.get('a') is None
+
+def test_invalidate_drops_only_tagged_entries():
+    backend = LRUBackend()
+    backend.set('metrics', 1, 60, ['metrics'])
+    backend.set('dashboard', 2, 60, ['metrics', 'notifications'])
+    backend.set('notifications', 3, 60, ['notifications'])
+    backend.invalidate('metrics')
+    assert backend.get('metrics') is None and backend.get('dashboard') is None
+    assert backend.get('notifications') == 3
+
+def make_app(cache):
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/data')
+    @cache.cached('data', ttl=60, tags=['metrics'])
+    def data():
+        calls.append(1)
+        return jsonify({'calls': len(calls)})
+
+    @app.route('/partial')
+    @cache.cached('partial', ttl=60, tags=['metrics'])
+    def partial():
+        calls.append(1)
+        response = jsonify({'calls': len(calls), 'errors': {'summary': 'Failed to load summary'}})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @app.route('/failing')
+    @cache.cached('failing', ttl=60, tags=['metrics'])
+    def failing():
+        return jsonify({'error': 'nope'}), 500
+
+    return app, calls
+
+def test_cached_view_until_invalidated():
+    cache = ResponseCache(LRUBackend())
+    app, calls = make_app(cache)
+    client = app.test_client()
+    first = client.get('/data?b=2&a=1')
+    assert first.headers['X-Cache'] == 'MISS'
+    # Argument order does not matter
+    second = client.get('/data?a=1&b=2')
+    assert second.headers['X-Cache'] == 'HIT' and second.get_json() == {'calls': 1}
+    cache.invalidate('metrics')
+    assert client.get('/data?a=1&b=2').get_json() == {'calls': 2}
+    assert cache.stats['data'] == {'hits': 1, 'misses': 2}
+
+def test_errors_are_not_cached():
+    cache = ResponseCache(LRUBackend())
+    app, _ = make_app(cache)
+    client = app.test_client()
+    client.get('/failing')
+    assert client.get('/failing').status_code == 500
+    assert cache.stats['failing'] == {'hits': 0, 'misses': 2}
+
+def test_count_cache_invalidates_per_collection():
+    cache = CountCache(ttl=60)
+    metrics_key = CountCache.key('metrics', {'activity': 'Normal'})
+    notifications_key = CountCache.key('notifications', {})
+    cache.set(metrics_key, 10)
+    cache.set(notifications_key, 5)
+    cache.invalidate('metrics')
+    assert cache.get(metrics_key) is None and cache.get(notifications_key) == 5
+
+def test_count_cache_expires():
+    cache = CountCache(ttl=0.01)
+    key = CountCache.key('metrics', {})
+    cache.set(key, 10)
+    time.sleep(0.02)
+    assert cache.get(key) is None
+
+def test_no_store_responses_are_not_cached():
+    cache = ResponseCache(LRUBackend())
+    app, calls = make_app(cache)
+    client = app.test_client()
+    client.get('/partial')
+    assert client.get('/partial').get_json()['calls'] == 2
+    assert 'X-Cache' not in client.get('/partial').headers
@@ -0,0 +1,75 @@
+from cache import LRUBackend, ResponseCache
+from changes import ChangeTracker
+from datetime import datetime
+from flask import Flask, jsonify
+from singleflight import SingleFlight
+
+# Tracker with fixed counters instead of a MongoDB collection
+class FixedTracker(ChangeTracker):
+    def __init__(self):
+        super().__init__(None)
+        self.version = 1
+
+    def versions(self, names):
+        return [(self.version, datetime(2025, 1, 1)) for _ in names]
+
+def make_app():
+    app = Flask(__name__)
+    tracker, flight = FixedTracker(), SingleFlight()
+    cache = ResponseCache(LRUBackend(), key_func=ChangeTracker.key)
+    state = {'partial': False, 'calls': 0}
+
+    @app.route('/dashboard')
+    @tracker.conditional(['metrics'], window=10)
+    @flight.coalesce(lambda: 'dashboard')
+    def dashboard():
+        if not state['partial']:
+            return jsonify({'summary': {}})
+        response = jsonify({'errors': {'summary': 'Failed to load summary'}})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @app.route('/metrics')
+    @tracker.conditional(['metrics'])
+    @cache.cached('metrics', ttl=60, tags=['metrics'])
+    @flight.coalesce(ChangeTracker.key)
+    def metrics():
+        state['calls'] += 1
+        return jsonify({'calls': state['calls']})
+
+    return app, tracker, state
+
+def test_complete_responses_get_validators():
+    app, tracker, _ = make_app()
+    client = app.test_client()
+    response = client.get('/dashboard')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/dashboard', headers={'If-None-Match': etag}).status_code == 304
+    tracker.version += 1
+    assert client.get('/dashboard', headers={'If-None-Match': etag}).status_code == 200
+
+def test_partial_responses_get_no_validators():
+    app, _, state = make_app()
+    state['partial'] = True
+    response = app.test_client().get('/dashboard')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers and 'Last-Modified' not in response.headers
+    assert response.headers['Cache-Control'] == 'no-store'
+
+def test_cached_bodies_are_keyed_by_version():
+    app, tracker, state = make_app()
+    client = app.test_client()
+    first = client.get('/metrics?a=1&b=2')
+    assert client.get('/metrics?b=2&a=1').headers['X-Cache'] == 'HIT'
+    # A write in another worker leaves this worker's cache entry in place
+    tracker.version += 1
+    second = client.get('/metrics?a=1&b=2')
+    assert second.headers['X-Cache'] == 'MISS' and second.get_json() == {'calls': 2}
+    assert second.headers['ETag'] != first.headers['ETag']
+
+def test_arguments_are_encoded_in_the_key():
+    app, _, state = make_app()
+    client = app.test_client()
+    client.get('/metrics', query_string={'a': '1&b=2'})
+    assert client.get('/metrics', query_string={'a': '1', 'b': '2'}).get_json() == {'calls': 2}
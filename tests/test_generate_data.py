@@ -0,0 +1,16 @@
+from datetime import timedelta
+from generate_data import parse_interval
+import argparse
+import pytest
+
+def test_parse_interval_units():
+    assert parse_interval('30s') == timedelta(seconds=30)
+    assert parse_interval('1M') == timedelta(minutes=1)
+    assert parse_interval('2h') == timedelta(hours=2)
+    assert parse_interval('1d') == timedelta(days=1)
+    assert parse_interval('90') == timedelta(seconds=90)
+
+@pytest.mark.parametrize('value', ['', 'm', '5x', '1.5h', 'abc', '0', '-1m'])
+def test_parse_interval_rejects_bad_values(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_interval(value)
@@ -0,0 +1,207 @@
+from bson import ObjectId
+from datetime import datetime, timedelta
+from queries import PAGE_SORT, build_metrics_query, build_page, decode_cursor, encode_cursor, page_find_args
+from sketches import sketch_key, sketch_values
+import pytest
+import random
+import time
+
+pytest.importorskip('numpy')
+from hotwindow import HotWindow  # noqa: E402
+
+NOW = datetime.now().replace(microsecond=0)
+
+# Stand-ins for the Mongo handle and change broadcaster: the window loads
+# from a list of documents and the stream is always open
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, spec):
+        assert spec == PAGE_SORT
+        self.docs = sorted(self.docs, key=lambda doc: (doc['timestamp'], doc['_id']), reverse=True)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query):
+        start = query['timestamp']['$gte']
+        return FakeCursor([dict(doc) for doc in self.docs if doc['timestamp'] >= start])
+
+class FakeMongo:
+    def __init__(self, docs):
+        self.db = type('DB', (), {'metrics': FakeCollection(docs)})()
+
+class FakeBroadcaster:
+    mode = 'change_stream'
+
+    def start(self, wait=0):
+        return True
+
+class FakeTracker:
+    def __init__(self, version):
+        self.version = version
+
+    def versions(self, names):
+        return [(self.version, None) for _ in names]
+
+def make_docs(count=2000, days=60, seed=1):
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(count):
+        doc = {
+            '_id': ObjectId(),
+            # Whole seconds, with ties, like generated data
+            'timestamp': NOW - timedelta(seconds=rng.randrange(86400 * days) // 60 * 60),
+            'uptime': round(rng.uniform(90, 100), 2),
+            'users_connected': rng.randint(5, 50),
+            'activity': 'Suspicious' if rng.random() < 0.1 else 'Normal',
+        }
+        if rng.random() < 0.5:
+            doc['host'] = f"host-{rng.randint(1, 3):02d}"
+        docs.append(doc)
+    return docs
+
+def loaded(docs, **options):
+    window = HotWindow(FakeMongo(docs), FakeBroadcaster(), **options)
+    assert window.find({}, 0, 1) is None  # starts the background load
+    deadline = time.monotonic() + 5
+    while window.state != 'ready' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert window.state == 'ready'
+    return window
+
+# Reference evaluation of a page with MongoDB semantics: filter, PAGE_SORT, skip, limit
+def reference(docs, predicate, skip, limit):
+    matching = sorted((doc for doc in docs if predicate(doc)), key=lambda doc: (doc['timestamp'], doc['_id']),
+                      reverse=True)
+    return matching[skip:skip + limit]
+
+def day(days_ago):
+    return (NOW - timedelta(days=days_ago)).replace(hour=0, minute=0, second=0)
+
+CASES = [
+    (build_metrics_query(None, None, ''), lambda doc: True),
+    (build_metrics_query(None, None, 'susp'), lambda doc: doc['activity'] == 'Suspicious'),
+    (build_metrics_query(day(10), day(3), ''),
+     lambda doc: day(10) <= doc['timestamp'] <= day(3) + timedelta(days=1, seconds=-1)),
+    (build_metrics_query(day(20), None, 'NORM'),
+     lambda doc: doc['timestamp'] >= day(20) and doc['activity'] == 'Normal'),
+]
+
+@pytest.mark.parametrize('query,predicate', CASES)
+def test_pages_match_reference(query, predicate):
+    docs = make_docs()
+    window = loaded(docs, days=30)
+    for page, per_page in [(1, 10), (3, 25), (40, 25)]:
+        find_query, skip, limit = page_find_args(query, page, per_page)
+        found = window.find(find_query, skip, limit)
+        if found is None:
+            # Only pages reaching past the window may go to MongoDB
+            assert skip + limit > len(reference(docs, lambda doc: predicate(doc) and doc['timestamp'] >= NOW - timedelta(days=29), 0, 10 ** 6))
+            continue
+        assert found == reference(docs, predicate, skip, limit)
+
+def test_counts_only_when_complete():
+    docs = make_docs()
+    window = loaded(docs, days=30)
+    in_window = build_metrics_query(day(10), None, '')
+    assert window.count(in_window) == len([doc for doc in docs if doc['timestamp'] >= day(10)])
+    assert window.count(build_metrics_query(day(45), None, '')) is None
+    assert window.count({}) is None
+
+def test_keyset_pages_follow_cursor():
+    docs = make_docs()
+    window = loaded(docs, days=30)
+    after, seen = None, []
+    for _ in range(5):
+        find_query, skip, limit = page_find_args({}, 1, 20, keyset=True, after=after)
+        page = window.find(find_query, skip, limit)
+        rows, pagination = build_page([dict(doc) for doc in page], None, 1, 20, keyset=True)
+        seen += page[:20]
+        after = decode_cursor(pagination['next_cursor'])
+    assert seen == reference(docs, lambda doc: True, 0, 100)
+    assert encode_cursor(seen[-1]) == pagination['next_cursor']
+
+def test_summary_and_sketches_match_reference():
+    docs = make_docs()
+    window = loaded(docs, days=30)
+    start, end = NOW - timedelta(days=7), NOW
+    rows = [doc for doc in docs if start <= doc['timestamp'] <= end]
+    summary = window.summary(start, end)
+    assert summary['total_records'] == len(rows)
+    assert summary['suspicious_count'] == sum(doc['activity'] == 'Suspicious' for doc in rows)
+    assert summary['max_users'] == max(doc['users_connected'] for doc in rows)
+    assert summary['avg_uptime'] == pytest.approx(sum(doc['uptime'] for doc in rows) / len(rows))
+    bins = {'users_sketch': {}, 'downtime_sketch': {}}
+    for doc in rows:
+        for field, value in sketch_values(doc).items():
+            key = sketch_key(value)
+            bins[field][key] = bins[field].get(key, 0) + 1
+    assert window.sketches(start, end) == bins
+    assert window.summary(NOW - timedelta(days=40), end) is None
+
+def test_appends_are_deduplicated_and_budget_evicts_oldest():
+    docs = make_docs(count=500)
+    window = loaded(docs, days=30, max_bytes=200 * 35)
+    assert window.describe()['rows'] <= 200
+    new = {'_id': ObjectId(), 'timestamp': NOW + timedelta(seconds=1), 'uptime': 50.0, 'users_connected': 1,
+           'activity': 'Normal'}
+    window.append([new])
+    window.insert('metrics', dict(new))
+    page = window.find({}, 0, 2)
+    assert page[0] == new and page[1] != new
+    assert window.describe()['rows'] <= 200
+
+def test_unsupported_documents_disable_the_window():
+    docs = make_docs(count=50)
+    window = loaded(docs, days=30)
+    window.append([dict(docs[0], _id=ObjectId(), extra=1)])
+    assert window.find({}, 0, 1) is None
+    assert window.state == 'disabled'
+
+def test_polling_broadcaster_disables_the_window():
+    broadcaster = FakeBroadcaster()
+    broadcaster.mode = 'poll'
+    window = HotWindow(FakeMongo(make_docs(count=50)), broadcaster, days=30)
+    assert window.find({}, 0, 1) is None
+    deadline = time.monotonic() + 5
+    while window.state != 'disabled' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert window.state == 'disabled' and window.find({}, 0, 1) is None
+
+def test_gap_stops_answers_until_reloaded():
+    window = loaded(make_docs(count=50), days=30)
+    window.resync()
+    assert window.state == 'stale'
+    assert window.find({}, 0, 1) is None
+
+def test_tracks_the_change_version_it_holds():
+    window = loaded(make_docs(count=50), days=30, tracker=FakeTracker(3))
+    assert window.caught_up(None) and window.caught_up(3)
+    assert not window.caught_up(4)
+    window.changed('notifications', 9)
+    assert not window.caught_up(4)
+    window.changed('metrics', 4)
+    assert window.caught_up(4) and window.describe()['version'] == 4
+
+def test_window_matches_mongodb(mongo_db):
+    docs = make_docs(count=1500)
+    mongo_db.metrics.insert_many([dict(doc) for doc in docs])
+    window = loaded(docs, days=30)
+    for query, _ in CASES:
+        find_query, skip, limit = page_find_args(query, 2, 25)
+        expected = list(mongo_db.metrics.find(find_query).sort(PAGE_SORT).skip(skip).limit(limit))
+        assert window.find(find_query, skip, limit) == expected
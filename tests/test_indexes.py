@@ -0,0 +1,29 @@
+from conftest import MONGO_TEST_URI
+from indexes import REQUIRED_INDEXES, ensure_indexes, existing_index_keys, require_indexes
+import pytest
+
+def test_ensure_indexes_creates_every_required_index(mongo_db):
+    assert ensure_indexes(mongo_db) == []
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        existing = existing_index_keys(mongo_db[collection_name])
+        assert all(tuple(spec['keys']) in existing for spec in specs)
+    # Present indexes are left alone
+    assert ensure_indexes(mongo_db, create=False) == []
+
+def test_check_only_reports_missing_indexes(mongo_db):
+    assert ensure_indexes(mongo_db, create=False) == [
+        (collection_name, spec['name']) for collection_name, specs in REQUIRED_INDEXES.items() for spec in specs
+    ]
+    assert 'activity_1_timestamp_-1' not in mongo_db.metrics.index_information()
+
+def test_equivalent_index_under_another_name_is_accepted(mongo_db):
+    mongo_db.metrics.create_index([('timestamp', -1), ('_id', -1)], name='by_time')
+    missing = ensure_indexes(mongo_db, create=False)
+    assert ('metrics', 'timestamp_-1__id_-1') not in missing
+    assert ('metrics', 'activity_1_timestamp_-1') in missing
+
+def test_require_indexes_refuses_missing_indexes(mongo_db):
+    with pytest.raises(RuntimeError, match='metrics.activity_1_timestamp_-1'):
+        require_indexes(MONGO_TEST_URI, mongo_db.name, create=False, serverSelectionTimeoutMS=500)
+    require_indexes(MONGO_TEST_URI, mongo_db.name, create=True, serverSelectionTimeoutMS=500)
+    require_indexes(MONGO_TEST_URI, mongo_db.name, create=False, serverSelectionTimeoutMS=500)
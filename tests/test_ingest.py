@@ -0,0 +1,73 @@
+from datetime import datetime
+from ingest import derive_notification, insert_batch, parse_batch, parse_timestamp, validate_batch, validate_metric, validate_notification
+from pymongo.errors import BulkWriteError
+import pytest
+
+def test_parse_batch_array_and_ndjson():
+    assert parse_batch(b'[{"a": 1}, {"a": 2}]', 'application/json') == [{'a': 1}, {'a': 2}]
+    assert parse_batch(b'{"a": 1}\n\n{"a": 2}\n', 'application/x-ndjson') == [{'a': 1}, {'a': 2}]
+    with pytest.raises(ValueError, match='Line 2'):
+        parse_batch(b'{"a": 1}\n{oops\n', 'application/x-ndjson')
+    with pytest.raises(ValueError):
+        parse_batch(b'{"a": 1', 'application/json')
+
+def test_parse_timestamp_formats():
+    assert parse_timestamp('2024-03-01 12:30:00') == datetime(2024, 3, 1, 12, 30)
+    assert parse_timestamp('2024-03-01T12:30:00') == datetime(2024, 3, 1, 12, 30)
+    # Offsets are converted to UTC rather than dropped
+    assert parse_timestamp('2024-03-01T12:30:00+02:00') == datetime(2024, 3, 1, 10, 30)
+    assert parse_timestamp('2024-03-01T12:30:00Z') == datetime(2024, 3, 1, 12, 30)
+    assert parse_timestamp('2024-03-01T00:30:00-05:30') == datetime(2024, 3, 1, 6, 0)
+    assert parse_timestamp('2024-03-01T12:30:00+02:00').tzinfo is None
+    for value in (None, 1700000000, 'yesterday', ''):
+        with pytest.raises(ValueError):
+            parse_timestamp(value)
+
+def test_validate_metric():
+    metric = validate_metric({'timestamp': '2024-03-01 12:00:00', 'uptime': 99, 'users_connected': 10,
+                              'host': 'web-1'})
+    assert metric == {'timestamp': datetime(2024, 3, 1, 12), 'uptime': 99.0, 'users_connected': 10,
+                      'activity': 'Normal', 'host': 'web-1'}
+    assert isinstance(metric['uptime'], float)
+    base = {'timestamp': '2024-03-01 12:00:00', 'uptime': 99.5, 'users_connected': 10}
+    for change in ({'uptime': 101}, {'uptime': -1}, {'uptime': True}, {'uptime': '99'},
+                   {'users_connected': -1}, {'users_connected': 1.5}, {'users_connected': False},
+                   {'users_connected': 2 ** 63}, {'users_connected': 2 ** 70},
+                   {'activity': 'normal'}, {'host': 7}, {'timestamp': None}):
+        with pytest.raises(ValueError):
+            validate_metric(dict(base, **change))
+    assert validate_metric(dict(base, users_connected=2 ** 63 - 1))['users_connected'] == 2 ** 63 - 1
+    with pytest.raises(ValueError):
+        validate_metric(['not', 'an', 'object'])
+
+def test_validate_notification():
+    assert validate_notification({'timestamp': '2024-03-01 12:00:00', 'event_type': 'Login',
+                                  'description': ''}) == {
+        'timestamp': datetime(2024, 3, 1, 12), 'event_type': 'Login', 'description': ''}
+    for item in ({'timestamp': '2024-03-01 12:00:00', 'event_type': '', 'description': 'x'},
+                 {'timestamp': '2024-03-01 12:00:00', 'event_type': 'Login'},
+                 {'event_type': 'Login', 'description': 'x'}):
+        with pytest.raises(ValueError):
+            validate_notification(item)
+
+def test_validate_batch_keeps_positions():
+    items = [{'timestamp': '2024-03-01 12:00:00', 'uptime': 99, 'users_connected': 1},
+             {'uptime': 99},
+             {'timestamp': '2024-03-01 12:01:00', 'uptime': 98, 'users_connected': 2, 'activity': 'Suspicious'}]
+    docs, positions, errors = validate_batch(items, validate_metric)
+    assert positions == [0, 2]
+    assert [error['index'] for error in errors] == [1]
+    assert derive_notification(docs[1])['timestamp'] == docs[1]['timestamp']
+
+class FailingCollection:
+    def insert_many(self, docs, ordered):
+        assert ordered is False
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'errmsg': 'duplicate key'}],
+                              'writeConcernErrors': [{'errmsg': 'timeout'}]})
+
+def test_insert_batch_maps_errors_to_batch_positions():
+    docs = [{'n': 0}, {'n': 1}, {'n': 2}]
+    inserted, errors = insert_batch(FailingCollection(), docs, [0, 3, 5])
+    assert inserted == [{'n': 0}, {'n': 2}]
+    assert errors == [{'index': 3, 'error': 'duplicate key'}, {'index': None, 'error': 'timeout'}]
+    assert insert_batch(FailingCollection(), [], []) == ([], [])
@@ -0,0 +1,53 @@
+from logconfig import AccessLogSampler, BackgroundHandler
+import logging
+import threading
+
+# Output handler that holds records until released, so the queue fills up
+class BlockingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.blocked = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.blocked.set()
+        self.gate.wait()
+        self.records.append(record)
+
+def make_record(message, level=logging.INFO):
+    return logging.LogRecord('app', level, __file__, 1, message, None, None)
+
+def test_full_queue_drops_records_and_stop_drains_the_rest():
+    output = BlockingHandler()
+    handler = BackgroundHandler(lambda: [output], queue_size=5)
+    handler.handle(make_record("record 0"))
+    assert output.blocked.wait(5)
+    for i in range(1, 50):
+        handler.handle(make_record(f"record {i}"))
+    assert handler.dropped == 44 and handler.queue.full()
+    threading.Timer(0.1, output.gate.set).start()
+    handler.stop()
+    assert len(output.records) + handler.dropped == 50
+
+def test_full_queue_writes_warnings_directly():
+    output = BlockingHandler()
+    handler = BackgroundHandler(lambda: [output], queue_size=2)
+    handler.handle(make_record("record 0"))
+    assert output.blocked.wait(5)
+    for i in range(1, 10):
+        handler.handle(make_record(f"record {i}"))
+    warning = make_record("disk full", logging.ERROR)
+    writer = threading.Thread(target=handler.handle, args=(warning,))
+    writer.start()
+    output.gate.set()
+    writer.join(5)
+    handler.stop()
+    assert warning in output.records and handler.dropped == 7
+
+def test_access_sampler_keeps_errors():
+    sampler = AccessLogSampler(0)
+    record = logging.LogRecord('werkzeug', logging.INFO, __file__, 1, '%s %s %s', ('GET / HTTP/1.1', '200', '-'), None)
+    assert not sampler.filter(record)
+    record.args = ('GET / HTTP/1.1', '503', '-')
+    assert sampler.filter(record)
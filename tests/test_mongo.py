@@ -0,0 +1,30 @@
+from flask import Flask
+from mongo import Mongo
+import pytest
+
+def make_app(uri='mongodb://localhost:27017/', db_name='monitoring_app'):
+    app = Flask(__name__)
+    app.config.update(MONGO_URI=uri, DB_NAME=db_name)
+    return app
+
+def test_first_app_sets_the_connection_settings():
+    mongo = Mongo('mongodb://localhost:27017/', 'default')
+    app = make_app(db_name='monitoring_app')
+    mongo.init_app(app)
+    assert mongo.db_name == 'monitoring_app' and app.extensions['mongo'] is mongo
+
+def test_later_apps_must_agree():
+    mongo = Mongo('mongodb://localhost:27017/', 'monitoring_app')
+    mongo.init_app(make_app())
+    mongo.init_app(make_app())
+    with pytest.raises(RuntimeError):
+        mongo.init_app(make_app(db_name='other'))
+    with pytest.raises(RuntimeError):
+        mongo.init_app(make_app(uri='mongodb://elsewhere:27017/'))
+    assert mongo.db_name == 'monitoring_app'
+
+def test_connected_client_cannot_be_reconfigured():
+    mongo = Mongo('mongodb://localhost:27017/', 'monitoring_app')
+    mongo._client = object()
+    with pytest.raises(RuntimeError):
+        mongo.init_app(make_app(db_name='other'))
@@ -0,0 +1,57 @@
+from bson import ObjectId
+from datetime import datetime
+from queries import (PAGE_SORT, build_metrics_query, build_page, decode_cursor, encode_cursor, page_find_args,
+                     parse_list_args, parse_percentiles)
+
+def test_cursor_round_trip():
+    doc = {'_id': ObjectId(), 'timestamp': datetime(2025, 4, 30, 10, 0, 5, 123000)}
+    after = decode_cursor(encode_cursor(doc))
+    assert after == {'$or': [
+        {'timestamp': {'$lt': doc['timestamp']}},
+        {'timestamp': doc['timestamp'], '_id': {'$lt': doc['_id']}}
+    ]}
+
+def test_cursor_is_url_safe_without_padding():
+    token = encode_cursor({'_id': ObjectId(), 'timestamp': datetime(2025, 1, 1)})
+    assert '=' not in token and '+' not in token and '/' not in token
+
+def test_invalid_cursors_are_rejected():
+    assert decode_cursor('not-a-cursor') is None
+    assert decode_cursor('') is None
+    # Well-formed base64 JSON with a bad id
+    bad_id = encode_cursor({'_id': ObjectId(), 'timestamp': datetime(2025, 1, 1)})[:-6] + 'AAAAAA'
+    assert decode_cursor(bad_id) is None
+
+def test_keyset_page_combines_query_and_cursor():
+    query = build_metrics_query(datetime(2025, 1, 1), None, 'susp')
+    after = {'$or': []}
+    find_query, skip, limit = page_find_args(query, 3, 10, keyset=True, after=after)
+    assert find_query == {'$and': [query, after]}
+    assert (skip, limit) == (0, 11)
+    assert page_find_args(query, 3, 10) == (query, 20, 11)
+
+def test_build_page_sets_next_cursor_only_when_more():
+    docs = [{'_id': ObjectId(), 'timestamp': datetime(2025, 1, 1, 0, i)} for i in range(3, 0, -1)]
+    page, pagination = build_page([dict(doc) for doc in docs], None, 1, 2, keyset=True)
+    assert len(page) == 2 and pagination['has_more']
+    assert decode_cursor(pagination['next_cursor'])['$or'][1]['_id'] == {'$lt': docs[1]['_id']}
+    assert page[0] == {'timestamp': '2025-01-01 00:03:00'}
+
+    page, pagination = build_page([dict(doc) for doc in docs], 3, 1, 5)
+    assert pagination == {'per_page': 5, 'next_cursor': None, 'has_more': False, 'page': 1, 'total': 3, 'pages': 1}
+
+def test_parse_list_args_errors():
+    assert parse_list_args({'count': 'bogus'}, build_metrics_query)[1].startswith('count must be one of')
+    assert parse_list_args({'cursor': 'garbage'}, build_metrics_query)[1] == 'Invalid cursor'
+    params, error = parse_list_args({'cursor': ''}, build_metrics_query)
+    assert error is None and params['keyset'] and params['count_mode'] == 'none'
+
+def test_parse_percentiles():
+    assert parse_percentiles({}) == ([], None)
+    assert parse_percentiles({'percentiles': '99,50,95,50'}) == ([50.0, 95.0, 99.0], None)
+    assert parse_percentiles({'percentiles': '50,abc'})[1] is not None
+    assert parse_percentiles({'percentiles': '101'})[1] is not None
+    assert parse_percentiles({'percentiles': ','.join(str(p) for p in range(11))})[1] is not None
+
+def test_page_sort_breaks_timestamp_ties_by_id():
+    assert PAGE_SORT == [('timestamp', -1), ('_id', -1)]
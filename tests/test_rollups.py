@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+from rollups import (RollupCheck, backfill, combine_totals, missing_sketches, plan_ranges, rollup_updates, sketch_bins,
+                     summarize, update_rollups)
+from sketches import MISSING_SKETCH, merge_sketches
+import random
+
+HOUR, DAY = timedelta(hours=1), timedelta(days=1)
+
+# Helper function to turn a plan into (source, start, end, end inclusive) tuples
+def spans(ranges):
+    result = []
+    for source, *bounds in ranges:
+        if source == 'raw':
+            bound = bounds[0]
+            end_key = '$lte' if '$lte' in bound else '$lt'
+            result.append((source, bound['$gte'], bound[end_key], end_key == '$lte'))
+        else:
+            result.append((source, bounds[0], bounds[1], False))
+    return result
+
+def test_short_window_is_raw_only():
+    start = datetime(2025, 1, 1, 10, 5)
+    assert plan_ranges(start, start + timedelta(minutes=40)) == [
+        ('raw', {'$gte': start, '$lte': start + timedelta(minutes=40)})
+    ]
+
+def test_hours_without_whole_day():
+    start, end = datetime(2025, 1, 1, 10, 5), datetime(2025, 1, 1, 14, 30)
+    assert spans(plan_ranges(start, end)) == [
+        ('raw', start, datetime(2025, 1, 1, 11), False),
+        ('1h', datetime(2025, 1, 1, 11), datetime(2025, 1, 1, 14), False),
+        ('raw', datetime(2025, 1, 1, 14), end, True),
+    ]
+
+def test_days_with_hours_around_them():
+    start, end = datetime(2025, 1, 1, 10, 5), datetime(2025, 1, 4, 2, 30)
+    assert spans(plan_ranges(start, end)) == [
+        ('raw', start, datetime(2025, 1, 1, 11), False),
+        ('1h', datetime(2025, 1, 1, 11), datetime(2025, 1, 2), False),
+        ('1d', datetime(2025, 1, 2), datetime(2025, 1, 4), False),
+        ('1h', datetime(2025, 1, 4), datetime(2025, 1, 4, 2), False),
+        ('raw', datetime(2025, 1, 4, 2), end, True),
+    ]
+
+def test_plan_covers_window_exactly_once():
+    rng = random.Random(7)
+    for _ in range(200):
+        start = datetime(2025, 1, 1) + timedelta(minutes=rng.randrange(60 * 24 * 40))
+        end = start + timedelta(minutes=rng.randrange(1, 60 * 24 * 90))
+        pieces = spans(plan_ranges(start, end))
+        assert pieces[0][1] == start and pieces[-1][2] == end and pieces[-1][3]
+        for (_, _, previous_end, inclusive), (_, next_start, _, _) in zip(pieces, pieces[1:]):
+            assert previous_end == next_start and not inclusive
+        for source, piece_start, piece_end, _ in pieces:
+            size = {'1h': HOUR, '1d': DAY}.get(source)
+            if size:
+                assert piece_start <= piece_end
+                assert (piece_start - datetime(2025, 1, 1)) % size == timedelta(0)
+                assert (piece_end - datetime(2025, 1, 1)) % size == timedelta(0)
+
+def test_rollup_updates_fold_a_batch_per_bucket():
+    metrics = [
+        {'timestamp': datetime(2025, 1, 1, 10, 5), 'uptime': 99.5, 'users_connected': 10, 'activity': 'Normal'},
+        {'timestamp': datetime(2025, 1, 1, 10, 55), 'uptime': 98.0, 'users_connected': 30, 'activity': 'Suspicious'},
+        {'timestamp': datetime(2025, 1, 1, 11, 0), 'uptime': 100.0, 'users_connected': 20, 'activity': 'Normal'},
+    ]
+    updates = {op._filter['_id']: op._doc for op in rollup_updates(metrics, HOUR)}
+    first = updates[datetime(2025, 1, 1, 10)]
+    assert first['$inc']['count'] == 2 and first['$inc']['suspicious'] == 1
+    assert first['$inc']['uptime_sum'] == 197.5 and first['$inc']['users_sum'] == 40
+    assert first['$min'] == {'uptime_min': 98.0, 'users_min': 10}
+    assert first['$max'] == {'uptime_max': 99.5, 'users_max': 30}
+    assert sum(n for path, n in first['$inc'].items() if path.startswith('users_sketch.')) == 2
+    assert updates[datetime(2025, 1, 1, 11)]['$inc']['downtime_sketch.z'] == 1
+
+    daily = rollup_updates(metrics, DAY)
+    assert len(daily) == 1 and daily[0]._doc['$inc']['count'] == 3
+
+def test_combine_totals_skips_empty_parts():
+    parts = [None, {'count': 0}, {'count': 2, 'uptime_sum': 190.0, 'users_sum': 30, 'users_max': 20, 'suspicious': 1},
+             {'count': 1, 'uptime_sum': 100.0, 'users_sum': 60, 'users_max': 60, 'suspicious': 0}]
+    assert combine_totals(parts) == {
+        'total_records': 3, 'avg_uptime': 290.0 / 3, 'suspicious_count': 1, 'max_users': 60, 'avg_users': 30.0,
+    }
+    assert combine_totals([None])['total_records'] == 0
+
+def seed_metrics(db, count=3000):
+    rng = random.Random(11)
+    start = datetime(2025, 1, 1, 3, 17)
+    metrics = [{
+        'timestamp': start + timedelta(minutes=rng.randrange(60 * 24 * 10)),
+        'uptime': round(rng.uniform(90, 100), 2),
+        'users_connected': rng.randint(5, 50),
+        'activity': 'Suspicious' if rng.random() < 0.1 else 'Normal',
+    } for _ in range(count)]
+    db.metrics.insert_many(metrics)
+    return metrics
+
+def assert_summaries_equal(db):
+    for start, end in [(datetime(2025, 1, 2, 5, 30), datetime(2025, 1, 8, 17, 45)),
+                       (datetime(2025, 1, 3, 1, 10), datetime(2025, 1, 3, 1, 50))]:
+        raw = summarize(db, start, end, use_rollups=False)
+        rolled = summarize(db, start, end, use_rollups=True)
+        assert rolled['total_records'] == raw['total_records']
+        assert rolled['suspicious_count'] == raw['suspicious_count']
+        assert rolled['max_users'] == raw['max_users']
+        assert abs(rolled['avg_uptime'] - raw['avg_uptime']) < 1e-9
+
+def test_backfilled_rollups_match_raw(mongo_db):
+    seed_metrics(mongo_db)
+    backfill(mongo_db)
+    assert_summaries_equal(mongo_db)
+
+def test_incremental_rollups_match_backfill(mongo_db):
+    metrics = seed_metrics(mongo_db)
+    for i in range(0, len(metrics), 500):
+        update_rollups(mongo_db, metrics[i:i + 500])
+    incremental = {doc['_id']: doc for doc in mongo_db.metrics_rollup_1h.find()}
+    backfill(mongo_db)
+    rebuilt = {doc['_id']: doc for doc in mongo_db.metrics_rollup_1h.find()}
+    assert incremental.keys() == rebuilt.keys()
+    for key, doc in rebuilt.items():
+        for field in ('count', 'users_sum', 'suspicious', 'users_sketch', 'downtime_sketch'):
+            assert incremental[key][field] == doc[field]
+    assert_summaries_equal(mongo_db)
+
+def test_missing_sketches_are_read_from_raw_metrics():
+    hour = datetime(2025, 1, 1, 10)
+    docs = [{'_id': {'f': 'users_sketch', 'k': '12'}, 'n': 3}, {'_id': {'f': MISSING_SKETCH, 'k': hour}, 'n': 1}]
+    bins, fallback = missing_sketches('metrics_rollup_1h', docs)
+    assert bins == docs[:1]
+    assert fallback[0] == {'$match': {'$or': [{'timestamp': {'$gte': hour, '$lt': hour + HOUR}}]}}
+    assert missing_sketches('metrics_rollup_1d', docs[:1]) == (docs[:1], None)
+
+def test_buckets_without_sketches_fall_back_to_raw(mongo_db):
+    seed_metrics(mongo_db)
+    backfill(mongo_db)
+    # Buckets written before the sketches existed
+    mongo_db.metrics_rollup_1d.update_many({'_id': {'$lt': datetime(2025, 1, 5)}}, {'$unset': {'users_sketch': ''}})
+    mongo_db.metrics_rollup_1h.update_one({'_id': datetime(2025, 1, 6, 12)}, {'$set': {'downtime_sketch': {}}})
+    start, end = datetime(2025, 1, 2, 5, 30), datetime(2025, 1, 8, 17, 45)
+    assert merge_sketches(sketch_bins(mongo_db, start, end)) == \
+        merge_sketches(sketch_bins(mongo_db, start, end, use_rollups=False))
+
+def test_rollup_check_needs_every_rollup_to_match():
+    check = RollupCheck(interval=300)
+    assert check.due() and check.stale is None
+    assert not check.record(100, {'1h': 100, '1d': 40})
+    assert check.stale == ['1d']
+    assert check.record(100, {'1h': 100, '1d': 100})
+    assert check.stale == [] and not check.due()
+    check.record_error(RuntimeError('down'))
+    assert check.stale == []
+
+def test_rollup_check_watermark_is_a_day_boundary_an_hour_back():
+    assert RollupCheck.watermark(datetime(2025, 1, 2, 5, 30)) == datetime(2025, 1, 2)
+    assert RollupCheck.watermark(datetime(2025, 1, 2, 0, 30)) == datetime(2025, 1, 1)
+
+def test_rollup_check_rejects_unbackfilled_rollups(mongo_db):
+    seed_metrics(mongo_db)
+    check = RollupCheck()
+    assert not check.usable(mongo_db)
+    backfill(mongo_db)
+    assert check.check(mongo_db)
+
+def test_rollup_check_ignores_buckets_after_the_watermark(mongo_db):
+    seed_metrics(mongo_db)
+    backfill(mongo_db)
+    check = RollupCheck()
+    # Inserted, but not yet folded into the rollups by ingest
+    mongo_db.metrics.insert_one({'timestamp': datetime.now(), 'uptime': 99.0, 'users_connected': 5,
+                                 'activity': 'Normal'})
+    assert check.check(mongo_db)
+    mongo_db.metrics.insert_one({'timestamp': datetime(2025, 1, 5), 'uptime': 99.0, 'users_connected': 5,
+                                 'activity': 'Normal'})
+    assert not check.check(mongo_db)
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+import math
+from series import STEPS, UNIT_SECONDS, choose_step
+
+# Number of buckets of a step touched by [start, end), with buckets aligned on the epoch
+def buckets(start, end, unit, bin_size):
+    size = UNIT_SECONDS[unit] * bin_size
+    first = int(start.timestamp()) // size
+    last = (int(end.timestamp()) - 1) // size
+    return last - first + 1
+
+def test_unaligned_window_stays_within_points():
+    start = datetime(2025, 4, 30, 10, 17, 3)
+    end = start + timedelta(days=7)
+    assert choose_step(start, end, 7) == ('day', 2)
+    assert buckets(start, end, 'day', 1) == 8
+    assert buckets(start, end, 'day', 2) <= 7
+
+def test_smallest_step_within_points_is_chosen():
+    start = datetime(2025, 4, 30, 10, 17, 3)
+    for days, points in [(1, 24), (1, 200), (30, 31), (365, 1000)]:
+        end = start + timedelta(days=days)
+        unit, bin_size = choose_step(start, end, points)
+        assert buckets(start, end, unit, bin_size) <= points
+        smaller = STEPS[:STEPS.index((unit, bin_size))]
+        assert all(math.ceil((end - start).total_seconds() / (UNIT_SECONDS[u] * b)) + 1 > points for u, b in smaller)
+
+def test_windows_too_long_use_the_largest_step():
+    start = datetime(2025, 1, 1)
+    assert choose_step(start, start + timedelta(days=3650), 2) == STEPS[-1]
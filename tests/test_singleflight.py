@@ -0,0 +1,79 @@
+from singleflight import SingleFlight, SingleFlightTimeout
+import pytest
+import threading
+import time
+
+# Helper function to run calls of `key` from several threads while the leader
+# is held inside fn until `release` is set
+def run_concurrently(flight, key, fn, threads=5):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=call) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers, results, errors
+
+def wait_for_followers(flight, count):
+    deadline = time.monotonic() + 2
+    while flight.stats['shared'] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight(timeout=5)
+    release, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        release.wait(2)
+        return 'result'
+
+    workers, results, errors = run_concurrently(flight, 'key', fn)
+    wait_for_followers(flight, 4)
+    release.set()
+    for worker in workers:
+        worker.join()
+    assert results == ['result'] * 5 and not errors
+    assert len(calls) == 1
+    assert flight.stats == {'leaders': 1, 'shared': 4, 'timeouts': 0}
+
+def test_errors_are_shared_and_nothing_is_kept():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+
+    def fn():
+        release.wait(2)
+        raise ValueError('boom')
+
+    workers, results, errors = run_concurrently(flight, 'key', fn, threads=3)
+    wait_for_followers(flight, 2)
+    release.set()
+    for worker in workers:
+        worker.join()
+    assert not results and len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+    # The next call runs again instead of reusing the failure
+    assert flight.do('key', lambda: 'fresh') == 'fresh'
+
+def test_followers_time_out_while_leader_continues():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(2)))
+    leader.start()
+    while not flight._calls:
+        time.sleep(0.001)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', lambda: 'unused')
+    release.set()
+    leader.join()
+    assert flight.stats['timeouts'] == 1
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.stats == {'leaders': 2, 'shared': 0, 'timeouts': 0}
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+from sketches import (RELATIVE_ACCURACY, ZERO_KEY, merge_sketches, percentiles_body, quantile, raw_sketch_pipeline,
+                      sketch_key, sketch_values)
+import random
+
+# Helper function to sketch a list of values as {bin key: count}
+def sketch(values):
+    bins = {}
+    for value in values:
+        key = sketch_key(value)
+        bins[key] = bins.get(key, 0) + 1
+    return bins
+
+# Helper function to read the exact quantile with the sketch's rank convention
+def exact(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def test_quantiles_within_relative_accuracy():
+    rng = random.Random(5)
+    values = [rng.lognormvariate(2, 1.5) for _ in range(20000)]
+    bins = sketch(values)
+    for q in (0, 0.01, 0.25, 0.5, 0.9, 0.99, 1):
+        assert abs(quantile(bins, q) - exact(values, q)) <= RELATIVE_ACCURACY * exact(values, q) * 1.0001
+
+def test_zero_bin_and_empty_sketch():
+    assert sketch_key(0) == ZERO_KEY
+    bins = sketch([0, 0, 0, 5])
+    assert quantile(bins, 0.5) == 0.0
+    assert abs(quantile(bins, 1) - 5) <= 5 * RELATIVE_ACCURACY
+    assert quantile({}, 0.5) is None
+
+def test_merge_equals_sketch_of_union():
+    rng = random.Random(9)
+    first = [rng.randint(5, 50) for _ in range(500)]
+    second = [rng.randint(5, 500) for _ in range(700)]
+    parts = [{'_id': {'f': 'users_sketch', 'k': key}, 'n': n}
+             for part in (first, second) for key, n in sketch(part).items()]
+    merged = merge_sketches(parts)
+    assert merged['users_sketch'] == sketch(first + second)
+    assert merged['downtime_sketch'] == {}
+
+def test_percentiles_body_reads_uptime_from_downtime():
+    uptimes = [99.99, 99.5, 98.0, 90.0, 100.0]
+    sketches = {'users_sketch': sketch([10, 20, 30, 40, 50]),
+                'downtime_sketch': sketch([100 - uptime for uptime in uptimes])}
+    body = percentiles_body(sketches, [0, 50, 100])
+    assert body['users_connected'] == {'p0': 10, 'p50': 30, 'p100': 50}
+    assert body['uptime']['p100'] == 100.0
+    assert abs(body['uptime']['p50'] - 99.5) <= 0.5 * RELATIVE_ACCURACY
+    assert abs(body['uptime']['p0'] - 90.0) <= 10 * RELATIVE_ACCURACY
+    empty = percentiles_body({'users_sketch': {}, 'downtime_sketch': {}}, [50])
+    assert empty['users_connected'] == {'p50': None} and empty['uptime'] == {'p50': None}
+
+def test_server_bins_match_python_bins(mongo_db):
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    metrics = [{'timestamp': start + timedelta(minutes=i), 'uptime': round(rng.uniform(90, 100), 2),
+                'users_connected': rng.randint(0, 5000), 'activity': 'Normal'} for i in range(2000)]
+    mongo_db.metrics.insert_many(metrics)
+    server = merge_sketches(mongo_db.metrics.aggregate(raw_sketch_pipeline({'$gte': start})))
+    local = {'users_sketch': {}, 'downtime_sketch': {}}
+    for metric in metrics:
+        for field, value in sketch_values(metric).items():
+            key = sketch_key(value)
+            local[field][key] = local[field].get(key, 0) + 1
+    assert server == local
@@ -0,0 +1,23 @@
+from datetime import datetime
+from rollups import raw_totals_pipeline
+from slowlog import redact
+
+def test_filter_literals_are_redacted_even_with_a_dollar():
+    query = {'activity': {'$regex': '$secret', '$options': 'i'}, 'host': '$web-1',
+             'timestamp': {'$gte': datetime(2025, 1, 1)}, '_id': {'$in': [1, 2, 3]}}
+    assert redact(query) == {'activity': {'$regex': '?', '$options': '?'}, 'host': '?',
+                             'timestamp': {'$gte': '?'}, '_id': {'$in': ['?']}}
+
+def test_expression_field_paths_are_kept():
+    pipeline = raw_totals_pipeline({'$gte': datetime(2025, 1, 1), '$lte': datetime(2025, 2, 1)})
+    match, group = redact(pipeline)
+    assert match == {'$match': {'timestamp': {'$gte': '?', '$lte': '?'}}}
+    assert group['$group']['uptime_sum'] == {'$sum': '$uptime'}
+    assert group['$group']['count'] == {'$sum': '?'}
+    assert group['$group']['suspicious'] == {'$sum': {'$cond': [{'$eq': ['$activity', '?']}, '?', '?']}}
+
+def test_expr_unwind_and_literal():
+    assert redact({'$expr': {'$gt': ['$users_connected', '$limit']}}) == {
+        '$expr': {'$gt': ['$users_connected', '$limit']}}
+    assert redact([{'$unwind': '$bins'}, {'$project': {'v': {'$literal': '$not_a_path'}}}]) == [
+        {'$unwind': '$bins'}, {'$project': {'v': {'$literal': '?'}}}]
@@ -0,0 +1,24 @@
+from totals import CountCache
+import time
+
+def test_count_cache_invalidates_per_collection():
+    cache = CountCache(ttl=60)
+    metrics_key = CountCache.key('metrics', {'activity': 'Normal'})
+    notifications_key = CountCache.key('notifications', {})
+    cache.set(metrics_key, 10)
+    cache.set(notifications_key, 5)
+    cache.invalidate('metrics')
+    assert cache.get(metrics_key) is None and cache.get(notifications_key) == 5
+
+def test_count_cache_expires():
+    cache = CountCache(ttl=0.01)
+    key = CountCache.key('metrics', {})
+    cache.set(key, 10)
+    time.sleep(0.02)
+    assert cache.get(key) is None
+
+def test_count_cache_keys_include_the_change_version():
+    cache = CountCache(ttl=60)
+    cache.set(CountCache.key('metrics', {'activity': 'Normal'}, 1), 10)
+    assert cache.get(CountCache.key('metrics', {'activity': 'Normal'}, 1)) == 10
+    assert cache.get(CountCache.key('metrics', {'activity': 'Normal'}, 2)) is None
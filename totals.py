@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import json
+import threading
+import time
+
+# Accepted values of the count= query parameter
+COUNT_MODES = ('none', 'approx', 'exact')
+
+# Per-filter cache of count_documents results, shared by the threads of a worker
+class CountCache:
+    def __init__(self, ttl=30, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Normalize a filter so equivalent queries share one cache entry. With the
+    # collection's change version, a count taken before a write (here or in
+    # another worker) is not reused after it.
+    @staticmethod
+    def key(collection_name, query, version=None):
+        return collection_name, json.dumps(query, sort_keys=True, default=str), version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            total, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return total
+
+    def set(self, key, total):
+        with self._lock:
+            self._entries[key] = (total, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Drop every cached count of a collection after it has been written to
+    def invalidate(self, collection_name):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == collection_name]:
+                del self._entries[key]
+
+# Total number of documents matching a query according to the count mode:
+# none skips counting, approx uses collection metadata for unfiltered queries
+# and the per-filter cache otherwise, exact always runs count_documents.
+# version is the collection's change version read for the request, if any.
+def count_total(collection, query, mode, cache, version=None):
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return collection.count_documents(query)
+    if not query:
+        return collection.estimated_document_count()
+
+    key = cache.key(collection.name, query, version)
+    total = cache.get(key)
+    if total is None:
+        total = collection.count_documents(query)
+        cache.set(key, total)
+    return total
+
+# Same as count_total for an AsyncMongoClient collection
+async def count_total_async(collection, query, mode, cache):
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return await collection.count_documents(query)
+    if not query:
+        return await collection.estimated_document_count()
+
+    key = cache.key(collection.name, query)
+    total = cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        cache.set(key, total)
+    return total